@@ -1,9 +1,14 @@
+from logging import warning
+
 import bottle
 from bottle.ext import sqlalchemy
 from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
 
+from azdashboard.app.helpers.history_helper import HistoryRecorder
+from azdashboard.app.helpers.metrics_helper import RequestMetricsPlugin
 from azdashboard.app.models import Base
-from azdashboard.config import routes
+from azdashboard.config import environment, routes
 
 __version__ = '0.1.0'
 
@@ -18,7 +23,8 @@ class AzDashboard:
                  db_echo=False,
                  reloader=False,
                  debug=False,
-                 template_path='./azdashboard/app/views/'):
+                 template_path='./azdashboard/app/views/',
+                 sample=True):
         self.server_type = server
         self.host = host
         self.port = port
@@ -49,3 +55,25 @@ class AzDashboard:
             use_kwargs=False
         )
         self.app.install(sqlalchemy_plugin)
+        self.app.install(RequestMetricsPlugin())
+
+        # one thread samples the queue depths for every viewer
+        self.sampler = environment.sampler
+        self.recorder = None
+        if sample:
+            self.sampler.add_listener(environment.series.record)
+            history = environment.history
+            in_memory = db_url.startswith('sqlite') and ':memory:' in db_url
+            if history["enabled"] and in_memory:
+                # every thread would get its own empty database
+                warning('queue history needs a file-backed database: '
+                        'in-memory SQLite is single-threaded only')
+            elif history["enabled"]:
+                # the plugin only creates tables on the first request
+                Base.metadata.create_all(engine)
+                self.recorder = HistoryRecorder(
+                    sessionmaker(bind=engine),
+                    retention=history["retention"],
+                    rollup_interval=history["rollup_interval"])
+                self.sampler.add_listener(self.recorder.record)
+            self.sampler.start()
@@ -0,0 +1,32 @@
+from time import time
+
+from bottle import request
+
+from azdashboard.app.controllers.application_controller import (
+    ApplicationController
+)
+from azdashboard.app.helpers.history_helper import HOUR, history
+from azdashboard.config import environment
+
+import json
+
+
+class HistoryController(ApplicationController):
+    """Class for serving the depth history of queues."""
+
+    def history(self, queue_name, db):
+        """Return the depths of a queue between the `start` and `end`
+        query parameters (epoch seconds, the last hour by default),
+        from the smallest rollup giving at most `points` points."""
+        end = self._int("end", int(time()))
+        start = self._int("start", end - HOUR)
+        points = self._int("points", environment.history["max_points"])
+        data = history(db, queue_name, start, end,
+                       interval=environment.sampling.get("interval", 5),
+                       max_points=max(points, 1),
+                       retention=environment.history["retention"])
+        return json.dumps(data)
+
+    def _int(self, name, default):
+        value = request.query.get(name) or ""
+        return int(value) if value.isdigit() else default
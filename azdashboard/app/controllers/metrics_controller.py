@@ -0,0 +1,31 @@
+from bottle import response
+
+from azdashboard.app.controllers.application_controller import (
+    ApplicationController
+)
+from azdashboard.config import environment
+from azdashboard.lib.azurelib.core.breaker import CLOSED, HALF_OPEN, OPEN
+from azdashboard.lib.azurelib.core.metrics import registry
+
+registry.describe('azdashboard_cache', 'gauge',
+                  'Queue cache counters, by counter')
+registry.describe('azurelib_circuit_state', 'gauge',
+                  'Circuit breaker state: 0 closed, 1 half-open, 2 open')
+
+BREAKER_STATES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class MetricsController(ApplicationController):
+    """Class for exposing metrics to Prometheus."""
+
+    def metrics(self):
+        """Render every metric in the Prometheus text format."""
+        for counter, value in environment.queue_cache.stats().items():
+            registry.set('azdashboard_cache', {'counter': counter}, value)
+        connection = environment.az_connection
+        for kind, state in connection.breakers().items():
+            registry.set('azurelib_circuit_state',
+                         {'account': connection.get_user(), 'kind': kind},
+                         BREAKER_STATES[state])
+        response.content_type = 'text/plain; version=0.0.4; charset=utf-8'
+        return registry.render()
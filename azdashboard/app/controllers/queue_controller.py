@@ -1,3 +1,7 @@
+from time import time
+
+from bottle import request, response
+
 from azdashboard.app.controllers.application_controller import (
     ApplicationController
 )
@@ -12,13 +16,103 @@ class QueueController(ApplicationController):
 
     def all(self):
         """Render index page."""
-        connection = environment.az_connection
-        queue = connection.queue()
-        data = queue.list_queues()
+        data = environment.queue_cache.get(
+            ("list_queues",), self._list_queues,
+            ttl=environment.cache_ttl["list_queues"])
         return json.dumps(data)
 
     def get_queue(self, queue_name):
+        if environment.sampler.ready():
+            size = environment.sampler.depth(queue_name)
+            if size is not None:
+                return size
+        return environment.queue_cache.get(
+            ("queue_size", queue_name),
+            lambda: self._queue_size(queue_name),
+            ttl=environment.cache_ttl["queue_size"])
+
+    def sizes(self):
+        """Return every queue, optionally filtered by the `prefix`
+        query parameter, together with its approximate depth."""
+        prefix = request.query.get("prefix") or None
+        if environment.sampler.ready():
+            return json.dumps(environment.sampler.sizes(prefix))
+        data = environment.queue_cache.get(
+            ("queue_sizes", prefix),
+            lambda: self._queue_sizes(prefix),
+            ttl=environment.cache_ttl["queue_size"])
+        return json.dumps(data)
+
+    def stream(self):
+        """Stream the queue depths sampled in the background as
+        server-sent events: a 'snapshot' event with every depth, then
+        'changes' events with the changed ones (null for deleted
+        queues). Browsers reconnect with the Last-Event-ID header and
+        only get what they missed."""
+        prefix = request.query.get("prefix") or None
+        since = request.get_header("Last-Event-ID") or \
+            request.query.get("since") or "0"
+        since = int(since) if since.isdigit() else 0
+        response.content_type = "text/event-stream"
+        response.set_header("Cache-Control", "no-cache")
+        # no buffering by nginx
+        response.set_header("X-Accel-Buffering", "no")
+        return self._events(since, prefix)
+
+    def changes(self):
+        """Long-poll variant of stream: return the depths changed
+        since the `since` version as soon as there are some, or after
+        `wait` seconds at most. 'full' is set when 'queues' holds
+        every depth instead, for new or outdated clients."""
+        prefix = request.query.get("prefix") or None
+        since = request.query.get("since") or "0"
+        since = int(since) if since.isdigit() else 0
+        wait = request.query.get("wait") or ""
+        wait = min(int(wait) if wait.isdigit() else
+                   environment.streaming["long_poll"],
+                   environment.streaming["long_poll"])
+        version, depths, full = environment.sampler.changes(
+            since, timeout=wait, prefix=prefix)
+        return json.dumps({"version": version, "full": full,
+                           "queues": depths})
+
+    def _events(self, since, prefix):
+        sampler = environment.sampler
+        heartbeat = environment.streaming["heartbeat"]
+        # the stream ends so server threads are not held forever;
+        # EventSource reconnects by itself
+        deadline = time() + environment.streaming["duration"]
+        yield "retry: {0}\n\n".format(
+            int(environment.streaming["retry"] * 1000))
+        while True:
+            left = deadline - time()
+            if left <= 0:
+                return
+            version, depths, full = sampler.changes(
+                since, timeout=min(heartbeat, left), prefix=prefix)
+            if version == since:
+                yield ": keep-alive\n\n"
+                continue
+            since = version
+            if depths or full:
+                yield "id: {0}\nevent: {1}\ndata: {2}\n\n".format(
+                    version, "snapshot" if full else "changes",
+                    json.dumps(depths))
+
+    def _list_queues(self):
+        connection = environment.az_connection
+        queue = connection.queue()
+        return queue.list_queues()
+
+    def _queue_size(self, queue_name):
         connection = environment.az_connection
         queue = connection.queue()
         queue.select(queue_name)
-        return queue.size()
\ No newline at end of file
+        return queue.size()
+
+    def _queue_sizes(self, prefix):
+        connection = environment.az_connection
+        queue = connection.queue()
+        return queue.sizes(prefix=prefix,
+                           workers=environment.fanout["workers"],
+                           timeout=environment.fanout["timeout"])
\ No newline at end of file
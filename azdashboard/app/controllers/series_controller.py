@@ -0,0 +1,49 @@
+from math import isfinite
+from time import time
+
+from bottle import HTTPError, request
+
+from azdashboard.app.controllers.application_controller import (
+    ApplicationController
+)
+from azdashboard.config import environment
+
+import json
+
+
+class SeriesController(ApplicationController):
+    """Class for serving the recent samples kept in memory."""
+
+    def all(self):
+        """Return the names of the series, optionally filtered by
+        the `prefix` query parameter."""
+        prefix = request.query.get("prefix") or None
+        return json.dumps(environment.series.names(prefix))
+
+    def sparkline(self, name):
+        """Return the last `window` seconds (the whole buffer by
+        default) of a series downsampled to `points` buckets, at most
+        one per sample kept, with the `percentile` of every bucket if
+        asked for."""
+        end = int(time()) + 1
+        window = self._number("window", environment.sparklines["window"])
+        if not (isfinite(window) and window > 0):
+            raise HTTPError(400, "window must be a positive number")
+        points = self._number("points", environment.sparklines["points"])
+        if not isfinite(points):
+            raise HTTPError(400, "points must be a number")
+        points = min(max(int(points), 1), environment.sparklines["capacity"])
+        percentile = self._number("percentile", None)
+        if percentile is not None and not 0 <= percentile <= 100:
+            raise HTTPError(400, "percentile must be between 0 and 100")
+        data = environment.series.downsample(
+            name, points, end - window, end, percentile)
+        if data is None:
+            raise HTTPError(404, "Unknown series " + name)
+        return json.dumps({"name": name, "points": data})
+
+    def _number(self, name, default):
+        try:
+            return float(request.query.get(name) or default)
+        except (TypeError, ValueError):
+            return default
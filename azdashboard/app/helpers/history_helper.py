@@ -0,0 +1,120 @@
+from time import time
+
+from azdashboard.app.models.queue_sample import QueueRollup, QueueSample
+
+MINUTE = 60
+HOUR = 60 * MINUTE
+DAY = 24 * HOUR
+
+# (resolution, source) in rollup order, 0 standing for raw samples
+ROLLUPS = [(MINUTE, 0), (HOUR, MINUTE), (DAY, HOUR)]
+
+# seconds every resolution is kept, None for ever
+RETENTION = {0: 2 * DAY, MINUTE: 14 * DAY, HOUR: 400 * DAY, DAY: None}
+
+
+class HistoryRecorder(object):
+    """
+    Stores the queue depths sampled by the QueueSampler, rolling them
+    up into 1 minute, 1 hour and 1 day aggregates and pruning the
+    expired ones every rollup_interval seconds.
+    """
+
+    def __init__(self, session, retention=None, rollup_interval=MINUTE):
+        """Args:
+            session: callable returning a new SQLAlchemy session,
+                e.g. a sessionmaker
+            retention: (optional) dict of the seconds every resolution
+                is kept, RETENTION by default
+            rollup_interval: (optional) seconds between two rollups
+        """
+        super(HistoryRecorder, self).__init__()
+        self._session = session
+        self.retention = retention or RETENTION
+        self._rollup_interval = rollup_interval
+        self._rolled_up = 0
+
+    def record(self, timestamp, depths):
+        """Stores the depths sampled at timestamp, then rolls up
+        and prunes the history if it is time to."""
+        timestamp = int(timestamp)
+        db = self._session()
+        try:
+            QueueSample.insert_many(db, timestamp, depths)
+            if timestamp - self._rolled_up >= self._rollup_interval:
+                self.roll_up(db, timestamp)
+                self.prune(db, timestamp)
+                self._rolled_up = timestamp
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def roll_up(self, db, now):
+        """Aggregates the complete buckets of every resolution."""
+        for resolution, source in ROLLUPS:
+            QueueRollup.roll_up(db, resolution, source, now)
+
+    def prune(self, db, now):
+        """Deletes the samples and rollups older than their retention."""
+        for resolution, keep in self.retention.items():
+            if keep is None:
+                continue
+            if resolution:
+                db.query(QueueRollup).filter(
+                    QueueRollup.resolution == resolution,
+                    QueueRollup.timestamp < now - keep).delete(
+                    synchronize_session=False)
+            else:
+                db.query(QueueSample).filter(
+                    QueueSample.timestamp < now - keep).delete(
+                    synchronize_session=False)
+
+
+def resolution_for(start, end, interval, max_points=500, retention=None,
+                   now=None):
+    """Returns the smallest resolution, 0 for raw samples, giving at
+    most max_points points from start to end and still kept at start.
+    Args:
+        start: epoch seconds
+        end: epoch seconds
+        interval: seconds between two raw samples
+        max_points: (optional) max number of points wanted
+        retention: (optional) dict of the seconds every resolution
+            is kept, RETENTION by default
+        now: (optional) epoch seconds, the current time by default
+    """
+    retention = retention or RETENTION
+    now = time() if now is None else now
+    for resolution in sorted(retention):
+        step = resolution or interval
+        keep = retention[resolution]
+        if (end - start) / float(step) <= max_points and \
+                (keep is None or start >= now - keep):
+            return resolution
+    return max(retention)
+
+
+def history(db, queue, start, end, interval, max_points=500, retention=None,
+            now=None):
+    """Returns the depths of a queue from start to end from the
+    smallest adequate resolution (see resolution_for), as a dict
+    with the 'resolution' in seconds (0 for raw samples) and the
+    'points': {'t', 'min', 'max', 'avg'} items. Buckets which are
+    not complete yet are not rolled up, so not included."""
+    resolution = resolution_for(start, end, interval, max_points,
+                                retention, now)
+    if resolution:
+        points = [{'t': rollup.timestamp, 'min': rollup.minimum,
+                   'max': rollup.maximum,
+                   'avg': float(rollup.total) / rollup.samples}
+                  for rollup in QueueRollup.between(
+                      db, resolution, queue, start - start % resolution,
+                      end)]
+    else:
+        points = [{'t': timestamp, 'min': size, 'max': size, 'avg': size}
+                  for timestamp, size in QueueSample.between(
+                      db, queue, start, end)]
+    return {'queue': queue, 'resolution': resolution, 'points': points}
@@ -0,0 +1,37 @@
+from time import time
+
+from bottle import HTTPResponse, response
+
+from azdashboard.lib.azurelib.core.metrics import registry
+
+registry.describe("http_request_seconds", "histogram",
+                  "Latency of HTTP requests, by route")
+
+
+class RequestMetricsPlugin(object):
+    """
+    Bottle plugin recording the latency of every request in the metrics
+    registry, labelled with its route, method and status code.
+    """
+    name = 'request_metrics'
+    api = 2
+
+    def apply(self, callback, route):
+        labels = {'route': route.rule, 'method': route.method}
+
+        def wrapper(*args, **kwargs):
+            started = time()
+            status = 500
+            try:
+                body = callback(*args, **kwargs)
+                status = response.status_code
+                return body
+            except HTTPResponse as resp:
+                status = resp.status_code
+                raise
+            finally:
+                registry.observe('http_request_seconds',
+                                 dict(labels, status=status),
+                                 time() - started)
+
+        return wrapper
@@ -0,0 +1,160 @@
+from collections import deque
+from threading import Condition, Event, Thread
+from time import time
+
+
+class QueueSampler(object):
+    """
+    Background thread refreshing the depth of every queue on a schedule,
+    so the Azure calls made by the dashboard do not depend on how many
+    viewers it has. Every sample that changes some depth gets a new
+    version number; viewers ask for the changes since the version they
+    already have, and wait for the next one.
+    """
+
+    def __init__(self, sample, interval=5, history=120):
+        """Args:
+            sample: callable returning the depths, as AzQueue.sizes
+                does: a dict with a 'queues' list of {'name', 'size'}
+                items and a 'partial' flag
+            interval: (optional) seconds between two samples
+            history: (optional) number of versions whose changes are
+                kept. Older viewers get every depth again.
+        """
+        super(QueueSampler, self).__init__()
+        self._sample = sample
+        self._interval = interval
+        self._depths = {}
+        self._version = 0
+        self._changes = deque(maxlen=history)
+        self._condition = Condition()
+        self._stop = Event()
+        self._thread = None
+        self._listeners = []
+        self.sampled_at = None
+        # set when some queue did not answer the last sample
+        self.partial = False
+        self.error = None
+
+    def start(self):
+        """Starts the sampling thread, once."""
+        if self._thread is None:
+            self._thread = Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stops the sampling thread."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def add_listener(self, listener):
+        """Adds a callable receiving the timestamp and the depths of
+        every queue after each successful sample."""
+        self._listeners.append(listener)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.sample()
+            self._stop.wait(self._interval)
+
+    def sample(self):
+        """Samples the depths once. Returns the changed ones."""
+        try:
+            result = self._sample()
+        except Exception as err:
+            self.error = err
+            return {}
+        self.error = None
+        depths = dict((queue["name"], queue["size"])
+                      for queue in result["queues"])
+        with self._condition:
+            changed = dict((name, size) for name, size in depths.items()
+                           if size is not None and
+                           self._depths.get(name) != size)
+            if not result["partial"]:
+                # deleted queues, only known from a complete listing
+                changed.update((name, None) for name in self._depths
+                               if name not in depths)
+            for name, size in changed.items():
+                if size is None:
+                    self._depths.pop(name, None)
+                else:
+                    self._depths[name] = size
+            self.sampled_at = time()
+            self.partial = result["partial"]
+            if changed or not self._version:
+                self._version += 1
+                self._changes.append((self._version, changed))
+                self._condition.notify_all()
+            depths = dict(self._depths)
+        for listener in self._listeners:
+            try:
+                listener(self.sampled_at, depths)
+            except Exception as err:
+                self.error = err
+        return changed
+
+    def ready(self):
+        """Returns True if the depths are up to date: sampled
+        successfully during the last three intervals."""
+        return self.sampled_at is not None and \
+            time() - self.sampled_at < 3 * self._interval
+
+    def depth(self, name):
+        """Returns the last sampled depth of a queue, None if unknown."""
+        with self._condition:
+            return self._depths.get(name)
+
+    def snapshot(self, prefix=None):
+        """Returns the current version and the depths of the queues
+        whose name starts with prefix."""
+        with self._condition:
+            return self._version, self._filter(self._depths, prefix)
+
+    def sizes(self, prefix=None):
+        """Returns the depths of the queues whose name starts with
+        prefix as AzQueue.sizes does, 'partial' being set when some
+        of them are older than the last sample."""
+        with self._condition:
+            depths = self._filter(self._depths, prefix)
+            return {"queues": [{"name": name, "size": depths[name]}
+                               for name in sorted(depths)],
+                    "partial": self.partial}
+
+    def changes(self, since=0, timeout=None, prefix=None):
+        """Waits, for at most timeout seconds, for a version newer
+        than since.
+        Args:
+            since: (optional) version the caller has, 0 for none
+            timeout: (optional) max wait, in seconds
+            prefix: (optional) only include queues whose name
+                starts with it
+        Returns:
+            tuple of the current version, the depths changed since
+            `since` (None for deleted queues) and a flag set when
+            they are every depth instead, as `since` is unknown or
+            too old. The depths are empty if nothing changed in time.
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self._version != since, timeout)
+            if since == self._version:
+                return self._version, {}, False
+            full = since <= 0 or since > self._version or \
+                self._changes[0][0] > since + 1
+            if full:
+                # new viewer, version of a previous process, or forgotten
+                changed = self._depths
+            else:
+                changed = {}
+                for version, depths in self._changes:
+                    if version > since:
+                        changed.update(depths)
+            return self._version, self._filter(changed, prefix), full
+
+    def _filter(self, depths, prefix):
+        if not prefix:
+            return dict(depths)
+        return dict((name, size) for name, size in depths.items()
+                    if name.startswith(prefix))
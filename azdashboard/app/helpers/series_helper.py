@@ -0,0 +1,233 @@
+from array import array
+from bisect import bisect_left
+from threading import Lock
+
+from azdashboard.lib.azurelib.core.metrics import registry
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class RingBuffer(object):
+    """
+    Fixed-capacity buffer of the last (timestamp, value) samples of a
+    series, in two preallocated arrays: epoch seconds as 32 bit
+    unsigned integers and values as 32 bit floats, 8 bytes a sample.
+    Samples are appended in time order; the oldest are overwritten
+    once the buffer is full. Downsampling is vectorized with NumPy
+    when it is installed, done in pure Python otherwise.
+    """
+
+    def __init__(self, capacity=720):
+        """Args:
+            capacity: (optional) number of samples kept
+        """
+        super(RingBuffer, self).__init__()
+        self.capacity = capacity
+        if numpy is not None:
+            self._times = numpy.zeros(capacity, dtype=numpy.uint32)
+            self._values = numpy.zeros(capacity, dtype=numpy.float32)
+        else:
+            self._times = array('I', [0]) * capacity
+            self._values = array('f', [0]) * capacity
+        self._next = 0
+        self._count = 0
+
+    def append(self, timestamp, value):
+        self._times[self._next] = int(timestamp)
+        self._values[self._next] = value
+        self._next = (self._next + 1) % self.capacity
+        self._count = min(self._count + 1, self.capacity)
+
+    def __len__(self):
+        return self._count
+
+    def nbytes(self):
+        """Returns the size of the sample arrays, in bytes."""
+        return self.capacity * (self._times.itemsize +
+                                self._values.itemsize)
+
+    def window(self, start=None, end=None):
+        """Returns copies of the timestamps and values of the samples
+        from start (included) to end (excluded), oldest first."""
+        if self._count < self.capacity:
+            times = self._times[:self._count]
+            values = self._values[:self._count]
+        else:
+            times = _join(self._times[self._next:], self._times[:self._next])
+            values = _join(self._values[self._next:],
+                           self._values[:self._next])
+        low = 0 if start is None else bisect_left(times, start)
+        high = len(times) if end is None else bisect_left(times, end)
+        times, values = times[low:high], values[low:high]
+        if numpy is not None:
+            # slices of numpy arrays are views
+            return times.copy(), values.copy()
+        return times, values
+
+    def downsample(self, points, start, end, percentile=None):
+        """Returns downsample() of the samples from start to end."""
+        times, values = self.window(start, end)
+        return downsample(times, values, points, start, end, percentile)
+
+
+def _join(first, second):
+    if numpy is not None:
+        return numpy.concatenate((first, second))
+    return first + second
+
+
+def downsample(times, values, points, start, end, percentile=None):
+    """Aggregates samples into `points` buckets of the same duration.
+    Args:
+        times: sorted epoch seconds of the samples, from start
+            (included) to end (excluded)
+        values: values of the samples
+        points: number of buckets
+        start: epoch seconds
+        end: epoch seconds
+        percentile: (optional) percentile (0-100) of every bucket
+            to compute as well, interpolated
+    Returns:
+        list of {'t', 'min', 'max', 'avg'} dicts, plus 'p' with a
+        percentile, for the buckets holding samples; 't' is the
+        start of the bucket
+    """
+    if not len(times):
+        return []
+    width = (end - start) / float(points)
+    if numpy is not None:
+        return _downsample_numpy(times, values, start, width, points,
+                                 percentile)
+    return _downsample_python(times, values, start, width, points,
+                              percentile)
+
+
+def _downsample_numpy(times, values, start, width, points, percentile):
+    edges = start + width * numpy.arange(points)
+    firsts = numpy.searchsorted(times, edges)
+    lasts = numpy.append(firsts[1:], len(times))
+    full = firsts < lasts
+    firsts, lasts, edges = firsts[full], lasts[full], edges[full]
+    counts = lasts - firsts
+    values = numpy.asarray(values, dtype=numpy.float64)
+    columns = {
+        't': edges.astype(numpy.int64),
+        'min': numpy.minimum.reduceat(values, firsts),
+        'max': numpy.maximum.reduceat(values, firsts),
+        'avg': numpy.add.reduceat(values, firsts) / counts
+    }
+    if percentile is not None:
+        # values sorted within every bucket, buckets kept in order
+        buckets = numpy.repeat(numpy.arange(len(firsts)), counts)
+        ordered = values[numpy.lexsort((values, buckets))]
+        rank = firsts + (counts - 1) * (percentile / 100.0)
+        low = numpy.floor(rank).astype(numpy.int64)
+        high = numpy.ceil(rank).astype(numpy.int64)
+        columns['p'] = ordered[low] + \
+            (ordered[high] - ordered[low]) * (rank - low)
+    columns = dict((name, column.tolist())
+                   for name, column in columns.items())
+    return [dict((name, columns[name][i]) for name in columns)
+            for i in range(len(firsts))]
+
+
+def _downsample_python(times, values, start, width, points, percentile):
+    buckets = []
+    first = 0
+    for bucket in range(points):
+        edge = start + width * bucket
+        last = len(times) if bucket == points - 1 else \
+            bisect_left(times, edge + width, first)
+        if last > first:
+            chunk = values[first:last]
+            point = {'t': int(edge), 'min': min(chunk), 'max': max(chunk),
+                     'avg': sum(chunk) / float(len(chunk))}
+            if percentile is not None:
+                ordered = sorted(chunk)
+                rank = (len(ordered) - 1) * (percentile / 100.0)
+                low = int(rank)
+                high = min(low + 1, len(ordered) - 1)
+                point['p'] = ordered[low] + \
+                    (ordered[high] - ordered[low]) * (rank - low)
+            buckets.append(point)
+        first = last
+    return buckets
+
+
+class SeriesStore(object):
+    """
+    Ring buffers of the recent queue depths ('depth:<queue>' series)
+    and mean latencies of azurelib calls ('latency:<kind>.<operation>'
+    series, in seconds), recorded by the QueueSampler, so the recent
+    charts are rendered without any I/O.
+    """
+
+    def __init__(self, capacity=720, max_series=10000):
+        """Args:
+            capacity: (optional) samples kept per series
+            max_series: (optional) max number of series. Samples of
+                new series beyond it are dropped.
+        """
+        super(SeriesStore, self).__init__()
+        self._capacity = capacity
+        self._max_series = max_series
+        self._series = {}
+        self._lock = Lock()
+        # call counts and durations at the previous sample
+        self._latencies = None
+
+    def append(self, name, timestamp, value):
+        """Appends a sample to a series, creating it if needed."""
+        with self._lock:
+            series = self._series.get(name)
+            if series is None:
+                if len(self._series) >= self._max_series:
+                    return
+                series = self._series[name] = RingBuffer(self._capacity)
+            series.append(timestamp, value)
+
+    def record(self, timestamp, depths):
+        """Records the sampled depths and the mean latency of the
+        azurelib calls made since the previous sample. To be added
+        as a QueueSampler listener."""
+        for queue, size in depths.items():
+            self.append('depth:' + queue, timestamp, size)
+        calls = {}
+        for labels, count, total in registry.totals('azurelib_call_seconds'):
+            name = '{0}.{1}'.format(labels.get('kind'),
+                                    labels.get('operation'))
+            previous = calls.get(name, (0, 0.0))
+            calls[name] = (previous[0] + count, previous[1] + total)
+        if self._latencies is None:
+            self._latencies = calls
+            return
+        for name, (count, total) in calls.items():
+            last_count, last_total = self._latencies.get(name, (0, 0.0))
+            if count > last_count:
+                self.append('latency:' + name, timestamp,
+                            (total - last_total) / (count - last_count))
+        self._latencies = calls
+
+    def names(self, prefix=None):
+        with self._lock:
+            return sorted(name for name in self._series
+                          if not prefix or name.startswith(prefix))
+
+    def downsample(self, name, points, start, end, percentile=None):
+        """Returns downsample() of a series from start to end,
+        None if the series is unknown."""
+        with self._lock:
+            series = self._series.get(name)
+            if series is None:
+                return None
+            times, values = series.window(start, end)
+        # aggregated out of the lock, on the copies
+        return downsample(times, values, points, start, end, percentile)
+
+    def nbytes(self):
+        """Returns the size of the sample arrays of every series."""
+        with self._lock:
+            return sum(series.nbytes() for series in self._series.values())
@@ -0,0 +1,126 @@
+from sqlalchemy import (
+    BigInteger,
+    Column,
+    Integer,
+    String,
+    and_,
+    func,
+    literal_column,
+    select
+)
+
+from azdashboard.app.models import Base
+
+
+class QueueSample(Base):
+    """Model of a sampled queue depth.
+
+    Timestamps are epoch seconds, so samples can be bucketed with the
+    same integer arithmetic on every database. The (queue, timestamp)
+    primary key is the index range queries of a queue use.
+    """
+
+    __tablename__ = 'queue_samples'
+
+    queue = Column(String(63), primary_key=True)
+    timestamp = Column(BigInteger, primary_key=True, autoincrement=False)
+    size = Column(Integer, nullable=False)
+
+    @classmethod
+    def insert_many(cls, db, timestamp, depths):
+        """Inserts the depths sampled at timestamp in one statement.
+        Args:
+            db: SQLAlchemy session
+            timestamp: epoch seconds
+            depths: dict of queue names and depths
+        """
+        if depths:
+            db.execute(cls.__table__.insert(),
+                       [{'queue': queue, 'timestamp': timestamp, 'size': size}
+                        for queue, size in depths.items()])
+
+    @classmethod
+    def between(cls, db, queue, start, end):
+        """Returns the (timestamp, size) samples of a queue
+        from start (included) to end (excluded)."""
+        return db.query(cls.timestamp, cls.size).filter(
+            cls.queue == queue, cls.timestamp >= start,
+            cls.timestamp < end).order_by(cls.timestamp).all()
+
+
+class QueueRollup(Base):
+    """Model of the depths of a queue aggregated over `resolution`
+    seconds, starting at `timestamp`."""
+
+    __tablename__ = 'queue_rollups'
+
+    resolution = Column(Integer, primary_key=True, autoincrement=False)
+    queue = Column(String(63), primary_key=True)
+    timestamp = Column(BigInteger, primary_key=True, autoincrement=False)
+    samples = Column(Integer, nullable=False)
+    minimum = Column(Integer, nullable=False)
+    maximum = Column(Integer, nullable=False)
+    total = Column(BigInteger, nullable=False)
+
+    @classmethod
+    def roll_up(cls, db, resolution, source, until):
+        """Aggregates, in the database, the complete buckets of
+        `resolution` seconds ending by until which are not rolled
+        up yet.
+        Args:
+            db: SQLAlchemy session
+            resolution: seconds per bucket
+            source: resolution of the rollups aggregated, 0 for the
+                raw samples
+            until: epoch seconds
+        Returns:
+            the number of rollups inserted
+        """
+        table = cls.__table__
+        if source:
+            rows = table.alias()
+            counts = [func.sum(rows.c.samples), func.min(rows.c.minimum),
+                      func.max(rows.c.maximum), func.sum(rows.c.total)]
+            where = [rows.c.resolution == source]
+        else:
+            rows = QueueSample.__table__
+            counts = [func.count(), func.min(rows.c.size),
+                      func.max(rows.c.size), func.sum(rows.c.size)]
+            where = []
+
+        last = db.query(func.max(cls.timestamp)).filter(
+            cls.resolution == resolution).scalar()
+        if last is None:
+            query = select(func.min(rows.c.timestamp))
+            if where:
+                query = query.where(and_(*where))
+            first = db.execute(query).scalar()
+            if first is None:
+                return 0
+            start = first - first % resolution
+        else:
+            start = last + resolution
+        end = until - until % resolution
+        if start >= end:
+            return 0
+
+        # inlined, so the grouped and selected buckets are the same
+        # expression to the database
+        resolution = literal_column(str(int(resolution)))
+        bucket = rows.c.timestamp - rows.c.timestamp % resolution
+        query = select(resolution, rows.c.queue, bucket, *counts).where(
+            and_(rows.c.timestamp >= start, rows.c.timestamp < end, *where)
+        ).group_by(rows.c.queue, bucket)
+        result = db.execute(table.insert().from_select(
+            ['resolution', 'queue', 'timestamp', 'samples', 'minimum',
+             'maximum', 'total'], query))
+        return result.rowcount
+
+    @classmethod
+    def between(cls, db, resolution, queue, start, end):
+        """Returns the rollups of a queue whose bucket starts
+        from start (included) to end (excluded)."""
+        return db.query(cls).filter(
+            cls.resolution == resolution, cls.queue == queue,
+            cls.timestamp >= start, cls.timestamp < end).order_by(
+            cls.timestamp).all()
@@ -1,5 +1,18 @@
+from azdashboard.app.helpers.history_helper import (
+    DAY,
+    HOUR,
+    MINUTE,
+    RETENTION
+)
+from azdashboard.app.helpers.sampler_helper import QueueSampler
+from azdashboard.app.helpers.series_helper import SeriesStore
 from azdashboard.config import settings
+from azdashboard.lib.azurelib.core.cache import TTLCache
 from azdashboard.lib.azurelib.core.connection import AzConnection
+from azdashboard.lib.azurelib.core.retry import (
+    ExponentialBackoff,
+    set_default_policy
+)
 
 if settings.environment == 'production':
     import azdashboard.config.environments.production as env
@@ -11,8 +24,73 @@ else:
     raise RuntimeError("Environment not set or incorrect")
 
 server = env.server
+server_threads = env.server_threads
 debug = env.debug
 reloader = env.reloader
 db_url = env.db_url
 db_echo = env.db_echo
-az_connection = AzConnection(env.custom["azure"]["user"], env.custom["azure"]["key"])
+azure = env.custom["azure"]
+retry = azure.get("retry", {})
+set_default_policy(ExponentialBackoff(retries=retry.get("retries", 5),
+                                      base=retry.get("base", 0.5),
+                                      cap=retry.get("cap", 10),
+                                      deadline=retry.get("deadline", 30)))
+az_connection = AzConnection(azure["user"], azure["key"],
+                             pool_size=azure.get("pool_size", 10),
+                             breaker=azure.get("breaker"),
+                             max_concurrent=azure.get("max_concurrent"),
+                             registry_ttl=azure.get("registry_ttl", 300))
+
+# cached Azure metadata calls: ttl (seconds) per call type
+cache = env.custom.get("cache", {})
+cache_ttl = {
+    "list_queues": cache.get("list_queues", 30),
+    "queue_size": cache.get("queue_size", 5)
+}
+queue_cache = TTLCache(max_size=cache.get("max_size", 1024),
+                       stale=cache.get("stale", 60))
+
+# parallel queue depth lookups
+fanout = {
+    "workers": azure.get("fanout_workers", 16),
+    "timeout": azure.get("fanout_timeout", 10)
+}
+
+# queue depths sampled in the background, shared by every viewer
+sampling = env.custom.get("sampling", {})
+sampler = QueueSampler(
+    lambda: az_connection.queue().sizes(workers=fanout["workers"],
+                                        timeout=fanout["timeout"]),
+    interval=sampling.get("interval", 5),
+    history=sampling.get("history", 120))
+streaming = {
+    "heartbeat": sampling.get("heartbeat", 15),
+    "duration": sampling.get("stream_duration", 30),
+    "long_poll": sampling.get("long_poll", 25),
+    "retry": sampling.get("retry", 3)
+}
+
+# depth history: retention (seconds) of the raw samples and rollups
+history = env.custom.get("history", {})
+retention = history.get("retention", {})
+history = {
+    "enabled": history.get("enabled", True),
+    "max_points": history.get("max_points", 500),
+    "rollup_interval": history.get("rollup_interval", MINUTE),
+    "retention": {
+        0: retention.get("raw", RETENTION[0]),
+        MINUTE: retention.get("minute", RETENTION[MINUTE]),
+        HOUR: retention.get("hour", RETENTION[HOUR]),
+        DAY: retention.get("day", RETENTION[DAY])
+    }
+}
+
+# recent samples of every series, kept in memory for the sparklines
+sparklines = env.custom.get("sparklines", {})
+series = SeriesStore(capacity=sparklines.get("capacity", 720),
+                     max_series=sparklines.get("max_series", 10000))
+sparklines = {
+    "capacity": sparklines.get("capacity", 720),
+    "window": sparklines.get("window", 3600),
+    "points": sparklines.get("points", 60)
+}
@@ -1,6 +1,10 @@
 # server backend
 server = 'cherrypy'
 
+# worker threads of the cherrypy/cheroot server. Every open live
+# stream (/api/queues/stream) holds one for up to stream_duration.
+server_threads = 64
+
 # debug error messages
 debug = True
 
@@ -16,6 +20,82 @@ db_echo = True
 custom = {
     "azure": {
         "user": "",
-        "key": ""
+        "key": "",
+        # keep-alive HTTP connections per storage service
+        "pool_size": 10,
+        # concurrent depth lookups and their overall deadline (seconds)
+        "fanout_workers": 16,
+        "fanout_timeout": 10,
+        # exponential backoff with full jitter of failed calls,
+        # within a time budget of `deadline` seconds per call
+        "retry": {
+            "retries": 5,
+            "base": 0.5,
+            "cap": 10,
+            "deadline": 30
+        },
+        # fail fast once half of the calls of the last `window` seconds
+        # failed, probing the account again after `open_timeout` seconds
+        "breaker": {
+            "error_rate": 0.5,
+            "min_calls": 20,
+            "window": 30,
+            "open_timeout": 30,
+            "probes": 1
+        },
+        # max calls in flight on the account
+        "max_concurrent": 32,
+        # seconds queues, tables and containers are remembered to
+        # exist, or not, by exists() and ensure_created(). 0 disables.
+        "registry_ttl": 300
+    },
+    # ttl of cached Azure calls, in seconds. Expired entries are
+    # served for `stale` more seconds while being refreshed.
+    "cache": {
+        "max_size": 1024,
+        "list_queues": 30,
+        "queue_size": 5,
+        "stale": 60
+    },
+    # queue depths refreshed every `interval` seconds by one thread and
+    # streamed to browsers from /api/queues/stream. Streams send a
+    # comment every `heartbeat` seconds and end after `stream_duration`
+    # seconds; browsers reconnect after `retry` seconds. Each open
+    # stream holds a server thread (see server_threads), clients which
+    # should not can long-poll /api/queues/changes, which waits at most
+    # `long_poll` seconds.
+    "sampling": {
+        "interval": 5,
+        "history": 120,
+        "heartbeat": 15,
+        "stream_duration": 30,
+        "long_poll": 25,
+        "retry": 3
+    },
+    # sampled depths stored in the database, rolled up by minute, hour
+    # and day every `rollup_interval` seconds. `retention` is in
+    # seconds, None to keep for ever. History requests are served from
+    # the smallest rollup giving at most `max_points` points. Needs a
+    # file-backed db_url: in-memory SQLite is single-threaded only.
+    "history": {
+        "enabled": True,
+        "max_points": 500,
+        "rollup_interval": 60,
+        "retention": {
+            "raw": 2 * 24 * 3600,
+            "minute": 14 * 24 * 3600,
+            "hour": 400 * 24 * 3600,
+            "day": None
+        }
+    },
+    # the last `capacity` samples of every queue depth and azurelib call
+    # latency, kept in memory (8 bytes a sample) for the sparklines of
+    # /api/series/<name>/sparkline, which default to `points` buckets
+    # over the last `window` seconds
+    "sparklines": {
+        "capacity": 720,
+        "max_series": 10000,
+        "window": 3600,
+        "points": 60
     }
 }
\ No newline at end of file
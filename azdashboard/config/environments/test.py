@@ -1,6 +1,10 @@
 # server backend
 server = 'wsgiref'
 
+# worker threads of the cherrypy/cheroot server. Every open live
+# stream (/api/queues/stream) holds one for up to stream_duration.
+server_threads = 10
+
 # debug error messages
 debug = True
 
@@ -1,5 +1,8 @@
 from azdashboard.app.controllers.assets_controller import AssetsController
+from azdashboard.app.controllers.history_controller import HistoryController
+from azdashboard.app.controllers.metrics_controller import MetricsController
 from azdashboard.app.controllers.queue_controller import QueueController
+from azdashboard.app.controllers.series_controller import SeriesController
 
 
 def setup_routing(app):
@@ -10,6 +13,17 @@ def setup_routing(app):
     app.route('/favicon.ico', 'GET', AssetsController.favicon)
     app.route('/favicon.png', 'GET', AssetsController.favicon)
 
+    # monitoring
+    app.route('/metrics', 'GET', MetricsController().metrics)
+
     # home
     app.route('/', 'GET', QueueController().all)
+    app.route('/api/queues', 'GET', QueueController().sizes)
+    app.route('/api/queues/stream', 'GET', QueueController().stream)
+    app.route('/api/queues/changes', 'GET', QueueController().changes)
+    app.route('/api/queues/<queue_name>/history', 'GET',
+              HistoryController().history)
+    app.route('/api/series', 'GET', SeriesController().all)
+    app.route('/api/series/<name>/sparkline', 'GET',
+              SeriesController().sparkline)
     app.route('/<queue_name>', 'GET', QueueController().get_queue)
@@ -0,0 +1,318 @@
+"""Asyncio counterparts of the azurelib objects.
+
+The storage SDK only ships a blocking HTTP client, so each call is
+dispatched to a thread pool sized like the connection's keep-alive
+pool. Awaiting callers never block the event loop: polling backoffs
+use asyncio.sleep and every awaitable may be cancelled (the underlying
+HTTP request is then left to finish on its worker thread and its
+result is dropped).
+
+Single calls to the service (e.g. size, push, get) are attempted once
+per executor job, and retried with asyncio.sleep between attempts, so
+a failing call does not hold a thread for its whole retry budget.
+Helpers making several calls (e.g. sizes, *_many, scan, upload_stream)
+run on the executor as they are, their retries included. The methods
+returning configuration objects (cache, write_behind, packer,
+delete_pipeline) are not mirrored: use them on the synchronous
+object, e.g. before wrapping it.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from itertools import islice
+from time import time
+
+from azdashboard.lib.azurelib.core.connection import AzConnection
+from azdashboard.lib.azurelib.core.errors import AzureException
+from azdashboard.lib.azurelib.core.retry import NoRetry, get_default_policy
+
+
+def _delegate(name, collect=False, retry=False):
+    """Builds a coroutine method running the wrapped
+    entity's method of the same name on the executor.
+    With collect=True, the iterator it returns is consumed
+    on the executor too, and returned as a list.
+    With retry=True, for methods wrapped by azure_error,
+    the retries are awaited on the event loop (see _retry)."""
+
+    async def method(self, *args, **kwargs):
+        func = getattr(self._entity, name)
+        if collect:
+            return await self._run(lambda: list(func(*args, **kwargs)))
+        if retry:
+            return await self._retry(func, *args, **kwargs)
+        return await self._run(func, *args, **kwargs)
+    method.__name__ = name
+    method.__doc__ = "Awaitable version of the synchronous `{0}`.".format(
+        name)
+    return method
+
+
+def _iterate(name, batch=100):
+    """Builds an async generator method iterating over what the
+    wrapped entity's method of the same name returns, pulling up
+    to `batch` items per executor job."""
+
+    async def method(self, *args, **kwargs):
+        func = getattr(self._entity, name)
+        items = await self._run(lambda: iter(func(*args, **kwargs)))
+        try:
+            while True:
+                chunk = await self._run(lambda: list(islice(items, batch)))
+                if not chunk:
+                    return
+                for item in chunk:
+                    yield item
+        finally:
+            # stops the background threads of prefetching iterators
+            if hasattr(items, "close"):
+                await self._run(items.close)
+    method.__name__ = name
+    method.__doc__ = "Async iterator version of the synchronous " \
+        "`{0}`.".format(name)
+    return method
+
+
+class AzAsyncEntity(object):
+
+    """Base class for asyncio azurelib objects"""
+
+    def __init__(self, entity, executor):
+        """Args:
+            entity: the synchronous azurelib object to wrap
+            executor: concurrent.futures executor running its calls
+        """
+
+        super(AzAsyncEntity, self).__init__()
+        self._entity = entity
+        self._executor = executor
+
+    def _run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return loop.run_in_executor(self._executor,
+                                    partial(func, *args, **kwargs))
+
+    async def _retry(self, func, *args, **kwargs):
+        """Runs a call wrapped by azure_error on the executor, one
+        attempt per job, awaiting the waits of its retry policy (the
+        `retry_policy` keyword argument, or the default one)."""
+
+        policy = kwargs.pop("retry_policy", None) or get_default_policy()
+        started = time()
+        retry_no = 0
+        while True:
+            try:
+                return await self._run(func, *args, retry_policy=NoRetry(),
+                                       **kwargs)
+            except AzureException as err:
+                delay = None
+                if policy.should_retry(err):
+                    delay = policy.next_delay(retry_no + 1, time() - started)
+                if delay is None:
+                    raise
+            retry_no += 1
+            await asyncio.sleep(delay)
+
+    def select(self, name):
+        self._entity.select(name)
+
+    def get_name(self):
+        return self._entity.get_name()
+
+    def get_service(self):
+        return self._entity.get_service()
+
+
+class AzAsyncQueue(AzAsyncEntity):
+
+    """Asyncio version of azurelib.AzQueue"""
+
+    exists = _delegate("exists")
+    create = _delegate("create", retry=True)
+    ensure_created = _delegate("ensure_created")
+    delete = _delegate("delete", retry=True)
+    size = _delegate("size", retry=True)
+    sizes = _delegate("sizes")
+    peek_messages = _delegate("peek_messages", retry=True)
+    push = _delegate("push", retry=True)
+    push_packed = _delegate("push_packed")
+    flush = _delegate("flush")
+    purge = _delegate("purge", retry=True)
+    delete_message = _delegate("delete_message", retry=True)
+    update_message = _delegate("update_message", retry=True)
+    list_queues = _delegate("list_queues", retry=True)
+    flush_deletes = _delegate("flush_deletes")
+    close = _delegate("close")
+
+    async def get_messages(self, number=32, timeout=None, is_base64=True,
+                           blocking=True, maxTime=60 * 2, exit_handler=None):
+        """Awaitable version of AzQueue.get_messages. When blocking,
+        waits between empty receives without holding a thread."""
+
+        messages = []
+        retry_no = 0
+        if exit_handler is None:
+            exit_handler = self._entity.default_loop_handler
+        while not messages and exit_handler():
+            messages = await self._retry(self._entity.get_messages,
+                                         number=number, timeout=timeout,
+                                         is_base64=is_base64, blocking=False)
+            if not blocking:
+                break
+            if not messages:
+                retry_no += 1
+                await asyncio.sleep(
+                    self._entity.get_next_time(retry_no, maxTime))
+        return messages
+
+    async def pop_messages(self, number=32, is_base64=True,
+                           blocking=True, maxTime=60 * 2, exit_handler=None,
+                           pipelined=False):
+        """Awaitable version of AzQueue.pop_messages. The
+        messages are deleted concurrently, or if pipelined, by
+        the queue's DeletePipeline (see flush_deletes)."""
+
+        messages = await self.get_messages(number=number,
+                                           is_base64=is_base64,
+                                           blocking=blocking,
+                                           exit_handler=exit_handler,
+                                           maxTime=maxTime)
+        if pipelined:
+            deletes = self._entity.delete_pipeline()
+            await self._run(lambda: [deletes.submit(msg)
+                                     for msg in messages])
+            return messages
+        await asyncio.gather(*[self.delete_message(msg)
+                               for msg in messages])
+        return messages
+
+    async def pop_packed_messages(self, number=32, maxTime=2 * 60,
+                                  exit_handler=None, pipelined=False):
+        """Awaitable version of AzQueue.pop_packed_messages."""
+
+        messages = await self.pop_messages(number, maxTime=maxTime,
+                                           exit_handler=exit_handler,
+                                           pipelined=pipelined)
+        return self._entity.unpack_messages(messages)
+
+
+class AzAsyncTable(AzAsyncEntity):
+
+    """Asyncio version of azurelib.AzTable"""
+
+    create = _delegate("create", retry=True)
+    ensure_created = _delegate("ensure_created")
+    delete = _delegate("delete", retry=True)
+    exists = _delegate("exists")
+    get = _delegate("get", retry=True)
+    insert = _delegate("insert", retry=True)
+    upsert = _delegate("upsert", retry=True)
+    update = _delegate("update", retry=True)
+    query = _delegate("query")
+    iter_query = _iterate("iter_query")
+    scan = _iterate("scan")
+    remove = _delegate("remove", retry=True)
+    insert_many = _delegate("insert_many")
+    upsert_many = _delegate("upsert_many")
+    delete_many = _delegate("delete_many")
+    upsert_buffered = _delegate("upsert_buffered")
+    flush = _delegate("flush")
+    close = _delegate("close")
+    list_tables = _delegate("list_tables", retry=True)
+
+    def set_partition(self, partition):
+        self._entity.set_partition(partition)
+
+
+class AzAsyncContainer(AzAsyncEntity):
+
+    """Asyncio version of azurelib.AzContainer"""
+
+    create = _delegate("create")
+    ensure_created = _delegate("ensure_created")
+    set_container_access_type = _delegate("set_container_access_type")
+    list_containers = _delegate("list_containers", collect=True)
+    exists = _delegate("exists")
+    delete_container = _delegate("delete_container")
+    list_blobs = _delegate("list_blobs", collect=True)
+
+
+class AzAsyncBlob(AzAsyncEntity):
+
+    """Asyncio version of azurelib.AzBlob"""
+
+    upload_file = _delegate("upload_file")
+    upload_io = _delegate("upload_io")
+    upload_stream = _delegate("upload_stream")
+    iter_chunks = _iterate("iter_chunks", batch=1)
+    get_properties = _delegate("get_properties")
+    delete = _delegate("delete")
+    download = _delegate("download")
+
+    def set_container(self, container):
+        if isinstance(container, AzAsyncContainer):
+            container = container.get_name()
+        self._entity.set_container(container)
+
+
+class AzAsyncConnection(object):
+
+    """Asyncio connection instance for azurelib objects"""
+
+    def __init__(self, user, key, pool_size=10, executor=None,
+                 breaker=None, max_concurrent=None, services=None,
+                 registry_ttl=300):
+        """Args:
+            user: Azure Storage username
+            key: Azure Storage account key
+            pool_size: (optional) keep-alive HTTP connections per
+                service kind, also the number of concurrent calls
+            executor: (optional) executor running the blocking calls.
+                Defaults to a pool of `pool_size` threads.
+            breaker, max_concurrent, services, registry_ttl: (optional)
+                passed on to the underlying AzConnection
+        """
+
+        super(AzAsyncConnection, self).__init__()
+        self._connection = AzConnection(user, key, pool_size=pool_size,
+                                        breaker=breaker,
+                                        max_concurrent=max_concurrent,
+                                        services=services,
+                                        registry_ttl=registry_ttl)
+        self._executor = executor or ThreadPoolExecutor(
+            max_workers=pool_size)
+
+    def queue(self, name=None):
+        """Creates an AzAsyncQueue object."""
+
+        return AzAsyncQueue(self._connection.queue(name), self._executor)
+
+    def table(self, name=None):
+        """Creates an AzAsyncTable object."""
+
+        return AzAsyncTable(self._connection.table(name), self._executor)
+
+    def container(self, name):
+        """Creates an AzAsyncContainer object."""
+
+        return AzAsyncContainer(self._connection.container(name),
+                                self._executor)
+
+    def blob(self, name):
+        """Creates an AzAsyncBlob object."""
+
+        return AzAsyncBlob(self._connection.blob(name), self._executor)
+
+    def close(self):
+        """Waits for running calls and closes the pooled connections."""
+
+        self._executor.shutdown(wait=True)
+        self._connection.close()
+
+    def breakers(self):
+        """Returns AzConnection.breakers()."""
+
+        return self._connection.breakers()
+
+    def get_user(self):
+        return self._connection.get_user()
@@ -0,0 +1,295 @@
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from queue import Empty, Queue
+from threading import Event, Lock, Thread
+from time import time
+
+from azdashboard.lib.azurelib.core.retry import NoRetry
+
+log = logging.getLogger(__name__)
+
+
+class _Lease(object):
+
+    """A received message and the time its visibility ends"""
+
+    def __init__(self, msg, expires):
+        self.msg = msg
+        self.expires = expires
+        self.lock = Lock()
+        self.settled = False
+
+
+class AzQueueConsumer(object):
+
+    """Consumes an AzQueue with a pool of workers.
+
+    A fetcher thread receives batches of up to 32 messages into a
+    bounded buffer, and stops receiving while the buffer is full.
+    Workers pass every message to the handler and delete it only once
+    the handler returned without raising. A failed message becomes
+    visible again when its visibility timeout expires. While messages
+    are buffered or handled, a renewer thread extends their visibility,
+    so long-running handlers keep their lease. Messages received more
+    than max_dequeue times are poison: they are moved to poison_queue,
+    or just deleted, without being handled again.
+
+    Usage:
+        consumer = AzQueueConsumer(queue, handler, workers=8)
+        consumer.start()
+        ...
+        consumer.stop()
+    """
+
+    def __init__(self, queue, handler, workers=4, processes=False,
+                 batch_size=32, max_buffered=64, visibility_timeout=60,
+                 max_idle=30, is_base64=True, max_dequeue=5,
+                 poison_queue=None):
+        """Args:
+            queue: the AzQueue to consume
+            handler: callable receiving a message dict, as returned
+                by AzQueue.get_messages. Must be picklable if
+                processes is True.
+            workers: (optional) number of concurrent handlers
+            processes: (optional) - boolean -
+                True to run handlers in a pool of worker processes
+                rather than threads, to use several cores
+            batch_size: (optional) max messages received at once (<= 32)
+            max_buffered: (optional) max messages received but
+                not handled yet
+            visibility_timeout: (optional) lease of received messages,
+                in seconds. Renewed while they are not done.
+            max_idle: (optional) upper limit, in seconds, of the
+                wait between two empty receives
+            is_base64: (optional) - boolean -
+                True if queue uses base64 encoding
+            max_dequeue: (optional) number of deliveries after which
+                a message is poison. None to retry for ever.
+            poison_queue: (optional) AzQueue receiving the poison
+                messages. They are deleted if None.
+        """
+
+        super(AzQueueConsumer, self).__init__()
+        self._queue = queue
+        self._handler = handler
+        self._workers = workers
+        self._processes = processes
+        self._batch_size = min(batch_size, 32)
+        self._max_buffered = max_buffered
+        self._visibility = visibility_timeout
+        self._max_idle = max_idle
+        self._is_base64 = is_base64
+        self._max_dequeue = max_dequeue
+        self._poison_queue = poison_queue
+        self._buffer = Queue(maxsize=max_buffered)
+        self._leases = {}
+        self._leases_lock = Lock()
+        self._stop_fetching = Event()
+        self._stop_working = Event()
+        self._stop_renewing = Event()
+        self._fetcher = None
+        self._handlers = []
+        self._renewer = None
+        self._pool = None
+        self._stats_lock = Lock()
+        self.processed = 0
+        self.failed = 0
+        self.delete_failed = 0
+        self.poisoned = 0
+        self.renewed = 0
+
+    def start(self):
+        """Starts receiving and handling messages."""
+
+        if self._processes:
+            self._pool = ProcessPoolExecutor(max_workers=self._workers)
+        for event in (self._stop_fetching, self._stop_working,
+                      self._stop_renewing):
+            event.clear()
+        self._fetcher = self._spawn(self._fetch)
+        self._handlers = [self._spawn(self._work)
+                          for _ in range(self._workers)]
+        self._renewer = self._spawn(self._renew)
+
+    def stop(self, drain=True):
+        """Stops receiving messages and waits for the handlers
+        to end.
+        Args:
+            drain: (optional) - boolean -
+                True to handle the buffered messages before stopping,
+                False to release them back to the queue
+        """
+
+        self._stop_fetching.set()
+        if self._fetcher is not None:
+            self._fetcher.join()
+            self._fetcher = None
+        if not drain:
+            self._release_buffered()
+        self._stop_working.set()
+        for thread in self._handlers:
+            thread.join()
+        self._handlers = []
+        self._stop_renewing.set()
+        if self._renewer is not None:
+            self._renewer.join()
+            self._renewer = None
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+
+    def stats(self):
+        """Returns the consumer counters as a dict."""
+
+        with self._stats_lock:
+            return {
+                "processed": self.processed,
+                "failed": self.failed,
+                "delete_failed": self.delete_failed,
+                "poisoned": self.poisoned,
+                "renewed": self.renewed,
+                "buffered": self._buffer.qsize(),
+                "leased": len(self._leases)
+            }
+
+    def _spawn(self, target):
+        thread = Thread(target=target, daemon=True)
+        thread.start()
+        return thread
+
+    def _count(self, name):
+        with self._stats_lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def _fetch(self):
+        retry_no = 0
+        while not self._stop_fetching.is_set():
+            room = self._max_buffered - self._buffer.qsize()
+            if room <= 0:
+                self._stop_fetching.wait(0.1)
+                continue
+            try:
+                messages = self._queue.get_messages(
+                    number=min(self._batch_size, room),
+                    timeout=self._visibility,
+                    is_base64=self._is_base64,
+                    blocking=False)
+            except Exception:
+                log.warning("could not receive messages from %s",
+                            self._queue.get_name(), exc_info=True)
+                messages = []
+            if not messages:
+                retry_no += 1
+                self._stop_fetching.wait(
+                    self._queue.get_next_time(retry_no, self._max_idle))
+                continue
+            retry_no = 0
+            expires = time() + self._visibility
+            for msg in messages:
+                lease = _Lease(msg, expires)
+                with self._leases_lock:
+                    self._leases[msg["message_id"]] = lease
+                self._buffer.put(lease)
+
+    def _work(self):
+        while True:
+            try:
+                lease = self._buffer.get(timeout=0.1)
+            except Empty:
+                if self._stop_working.is_set():
+                    return
+                continue
+            if self._is_poison(lease.msg):
+                self._poison(lease)
+                continue
+            try:
+                if self._pool is not None:
+                    self._pool.submit(self._handler, lease.msg).result()
+                else:
+                    self._handler(lease.msg)
+            except Exception:
+                self._settle(lease)
+                self._count("failed")
+                continue
+            with lease.lock:
+                try:
+                    self._queue.delete_message(lease.msg)
+                    deleted = True
+                except Exception:
+                    # handled, but it will be delivered again
+                    log.warning("could not delete handled message %s",
+                                lease.msg["message_id"], exc_info=True)
+                    deleted = False
+            self._settle(lease)
+            self._count("processed" if deleted else "delete_failed")
+
+    def _is_poison(self, msg):
+        return self._max_dequeue is not None and \
+            int(msg.get("dequeue_count") or 0) > self._max_dequeue
+
+    def _poison(self, lease):
+        """Moves a message delivered too many times out of the queue."""
+
+        with lease.lock:
+            try:
+                if self._poison_queue is not None:
+                    self._poison_queue.push(lease.msg["message_text"],
+                                            is_base64=self._is_base64)
+                self._queue.delete_message(lease.msg)
+            except Exception:
+                log.warning("could not remove poison message %s",
+                            lease.msg["message_id"], exc_info=True)
+                self._count("failed")
+            else:
+                log.warning("removed poison message %s, delivered %s times",
+                            lease.msg["message_id"],
+                            lease.msg.get("dequeue_count"))
+                self._count("poisoned")
+        self._settle(lease)
+
+    def _settle(self, lease):
+        with lease.lock:
+            lease.settled = True
+        with self._leases_lock:
+            self._leases.pop(lease.msg["message_id"], None)
+
+    def _renew(self):
+        interval = max(self._visibility / 3.0, 0.1)
+        while not self._stop_renewing.wait(interval):
+            now = time()
+            with self._leases_lock:
+                leases = [lease for lease in self._leases.values()
+                          if lease.expires - now < self._visibility / 2.0]
+            for lease in leases:
+                with lease.lock:
+                    if lease.settled:
+                        continue
+                    # a single attempt, the lock stalls the worker's
+                    # delete meanwhile; the next round retries
+                    try:
+                        self._queue.update_message(lease.msg,
+                                                   self._visibility,
+                                                   is_base64=self._is_base64,
+                                                   retry_policy=NoRetry())
+                    except Exception:
+                        log.warning("could not renew the lease of %s",
+                                    lease.msg["message_id"], exc_info=True)
+                        continue
+                    lease.expires = time() + self._visibility
+                self._count("renewed")
+
+    def _release_buffered(self):
+        """Makes the buffered messages visible again right away."""
+
+        while True:
+            try:
+                lease = self._buffer.get_nowait()
+            except Empty:
+                return
+            with lease.lock:
+                try:
+                    self._queue.update_message(lease.msg, 0,
+                                               is_base64=self._is_base64)
+                except Exception:
+                    pass
+            self._settle(lease)
@@ -0,0 +1,232 @@
+import copy
+from collections import deque
+from threading import BoundedSemaphore, Lock
+from time import time
+
+from azdashboard.lib.azurelib.core.errors import (
+    AzureException,
+    BulkheadFullError,
+    CircuitOpenError
+)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+class CircuitBreaker(object):
+
+    """Fails calls fast while a service keeps failing.
+
+    Closed, it counts the outcomes of the last `window` seconds and
+    opens once at least `min_calls` were made and the share of
+    failures reaches `error_rate`. Open, it rejects every call for
+    `open_timeout` seconds, then goes half-open and lets `probes`
+    calls through: if they all succeed it closes again, otherwise it
+    reopens.
+    """
+
+    def __init__(self, error_rate=0.5, min_calls=20, window=30,
+                 open_timeout=30, probes=1):
+        super(CircuitBreaker, self).__init__()
+        self.error_rate = error_rate
+        self.min_calls = min_calls
+        self.window = window
+        self.open_timeout = open_timeout
+        self.probes = probes
+        self._outcomes = deque()
+        self._failures = 0
+        self._state = CLOSED
+        self._opened = 0
+        self._probing = 0
+        self._probed = 0
+        # bumped every time the breaker goes half-open
+        self._episode = 0
+        self._lock = Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            self._check_timeout()
+            return self._state
+
+    def allow(self):
+        """Returns a token, which is true, if a call may go through,
+        None otherwise. A token must be followed by a record() or a
+        cancel() of it once the call is over."""
+
+        with self._lock:
+            self._check_timeout()
+            if self._state == CLOSED:
+                return self._admission()
+            if self._state == HALF_OPEN and self._probing < self.probes:
+                self._probing += 1
+                return self._admission()
+            return None
+
+    def record(self, success, token=None):
+        """Records the outcome of an allowed call.
+        Args:
+            success: boolean
+            token: (optional) allow()'s answer for the call. Defaults
+                to a call admitted in the current state.
+        """
+
+        now = time()
+        with self._lock:
+            admitted, episode = token or self._admission()
+            if admitted == HALF_OPEN:
+                if not self._probing_in(episode):
+                    # its half-open episode is over
+                    return
+                self._probing -= 1
+                if not success:
+                    self._open(now)
+                else:
+                    self._probed += 1
+                    if self._probed >= self.probes:
+                        self._close()
+                return
+            if self._state != CLOSED:
+                # admitted before the breaker opened, not a probe
+                return
+            self._outcomes.append((now, success))
+            if not success:
+                self._failures += 1
+            while self._outcomes and self._outcomes[0][0] < now - self.window:
+                if not self._outcomes.popleft()[1]:
+                    self._failures -= 1
+            calls = len(self._outcomes)
+            if calls >= self.min_calls and \
+                    self._failures >= self.error_rate * calls:
+                self._open(now)
+
+    def cancel(self, token=None):
+        """Gives back an allowed call which ended without an
+        outcome, e.g. interrupted by a KeyboardInterrupt."""
+
+        with self._lock:
+            admitted, episode = token or self._admission()
+            if admitted == HALF_OPEN and self._probing_in(episode):
+                self._probing -= 1
+
+    def _admission(self):
+        return self._state, self._episode
+
+    def _probing_in(self, episode):
+        return self._state == HALF_OPEN and episode == self._episode and \
+            self._probing > 0
+
+    def _check_timeout(self):
+        if self._state == OPEN and time() >= self._opened + self.open_timeout:
+            self._state = HALF_OPEN
+            self._episode += 1
+            self._probing = 0
+            self._probed = 0
+
+    def _open(self, now):
+        self._state = OPEN
+        self._opened = now
+
+    def _close(self):
+        self._state = CLOSED
+        self._outcomes.clear()
+        self._failures = 0
+
+
+class Bulkhead(object):
+
+    """Caps the number of concurrent calls"""
+
+    def __init__(self, max_concurrent=32, timeout=5):
+        """Args:
+            max_concurrent: max number of calls in flight
+            timeout: (optional) seconds a call waits for a free slot
+                before being rejected. None waits forever.
+        """
+
+        super(Bulkhead, self).__init__()
+        self.max_concurrent = max_concurrent
+        self.timeout = timeout
+        self._slots = BoundedSemaphore(max_concurrent)
+
+    def acquire(self):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise BulkheadFullError(
+                "More than {0} concurrent calls".format(self.max_concurrent))
+
+    def release(self):
+        self._slots.release()
+
+
+class AzGuard(object):
+
+    """Runs Azure calls behind a circuit breaker and a bulkhead.
+    Either may be None."""
+
+    def __init__(self, breaker=None, bulkhead=None):
+        super(AzGuard, self).__init__()
+        self.breaker = breaker
+        self.bulkhead = bulkhead
+
+    def call(self, func, *args, **kwargs):
+        """Calls func, raising CircuitOpenError or BulkheadFullError
+        instead when the account must be spared."""
+
+        if self.breaker is not None and self.breaker.state == OPEN:
+            raise CircuitOpenError("Circuit open, failing fast")
+        if self.bulkhead is not None:
+            self.bulkhead.acquire()
+        try:
+            if self.breaker is None:
+                return func(*args, **kwargs)
+            token = self.breaker.allow()
+            if not token:
+                raise CircuitOpenError("Circuit open, failing fast")
+            outcome = None
+            try:
+                result = func(*args, **kwargs)
+                outcome = True
+                return result
+            except Exception as err:
+                error = AzureException(err)
+                # missing resources & co. say nothing of the account health
+                outcome = not (error.retriable or error.number >= 500)
+                raise
+            finally:
+                if outcome is None:
+                    self.breaker.cancel(token)
+                else:
+                    self.breaker.record(outcome, token)
+        finally:
+            if self.bulkhead is not None:
+                self.bulkhead.release()
+
+
+class GuardedService(object):
+
+    """Proxy of an Azure service running every method call, that is
+    every round trip to the account, through an AzGuard. Retry sleeps
+    and the loops of the entities around the calls (e.g. a blocking
+    get_messages) do not hold a bulkhead slot."""
+
+    def __init__(self, service, guard):
+        super(GuardedService, self).__init__()
+        self._az_service = service
+        self._az_guard = guard
+
+    def __copy__(self):
+        return GuardedService(copy.copy(self._az_service), self._az_guard)
+
+    def __getattr__(self, name):
+        if name.startswith("_az_"):
+            # not set yet, e.g. on an instance being copied or unpickled
+            raise AttributeError(name)
+        attribute = getattr(self._az_service, name)
+        if not callable(attribute):
+            return attribute
+        guard = self._az_guard
+
+        def guarded(*args, **kwargs):
+            return guard.call(attribute, *args, **kwargs)
+        return guarded
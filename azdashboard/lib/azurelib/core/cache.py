@@ -0,0 +1,181 @@
+from collections import OrderedDict
+from threading import Lock, Thread
+from time import time
+
+
+class TTLCache(object):
+
+    """Bounded LRU cache with per-entry time to live.
+
+    Entries older than their ttl, but younger than ttl + stale,
+    are returned as they are while a background thread reloads
+    them (stale-while-revalidate). Older entries are reloaded
+    synchronously.
+    """
+
+    def __init__(self, max_size=1024, ttl=30, stale=0, on_evict=None):
+        """Args:
+            max_size: max number of entries kept
+            ttl: (optional) default time to live, in seconds
+            stale: (optional) how long, in seconds, an expired entry
+                may still be served while it is being refreshed
+            on_evict: (optional) callable receiving the key of every
+                entry dropped because of the size limit
+        """
+
+        super(TTLCache, self).__init__()
+        self._max_size = max_size
+        self._ttl = ttl
+        self._stale = stale
+        self._on_evict = on_evict
+        self._entries = OrderedDict()
+        self._refreshing = set()
+        # bumped by clear, so loads started before are not stored
+        self._epoch = 0
+        # [loads in flight, generation] of the keys being loaded;
+        # pop bumps the generation of its key only
+        self._loads = {}
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+        self.evictions = 0
+        self.refresh_errors = 0
+
+    def get(self, key, loader, ttl=None):
+        """Returns the cached value of key, calling loader() to
+        (re)load it when needed.
+        Args:
+            key: hashable cache key
+            loader: callable with no arguments returning the value
+            ttl: (optional) time to live overriding the default one,
+                or a callable returning it (or None for the default)
+                for a loaded value
+        """
+
+        now = time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires = entry
+                if now < expires:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                if now < expires + self._stale:
+                    self._entries.move_to_end(key)
+                    self.stale_hits += 1
+                    if key not in self._refreshing:
+                        self._refreshing.add(key)
+                        Thread(target=self._refresh,
+                               args=(key, loader, ttl, self._begin(key)),
+                               daemon=True).start()
+                    return value
+            self.misses += 1
+            token = self._begin(key)
+        try:
+            value = loader()
+        except BaseException:
+            with self._lock:
+                self._end(key, token)
+            raise
+        self._store(key, value, ttl, token)
+        return value
+
+    def put(self, key, value, ttl=None):
+        """Stores value under key."""
+
+        self._store(key, value, ttl)
+
+    def _begin(self, key):
+        """Registers a load of key. Returns its token for _end.
+        Called with the lock held."""
+
+        load = self._loads.setdefault(key, [0, 0])
+        load[0] += 1
+        return self._epoch, load[1]
+
+    def _end(self, key, token):
+        """Unregisters a load of key. Returns True if key was not
+        invalidated since it began. Called with the lock held."""
+
+        load = self._loads[key]
+        load[0] -= 1
+        if not load[0]:
+            del self._loads[key]
+        return token == (self._epoch, load[1])
+
+    def _store(self, key, value, ttl, token=None):
+        if callable(ttl):
+            try:
+                ttl = ttl(value)
+            except BaseException:
+                if token is not None:
+                    with self._lock:
+                        self._end(key, token)
+                raise
+        ttl = self._ttl if ttl is None else ttl
+        evicted = []
+        with self._lock:
+            if token is not None and not self._end(key, token):
+                # invalidated while loading
+                return
+            self._entries[key] = (value, time() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_size:
+                evicted.append(self._entries.popitem(last=False)[0])
+                self.evictions += 1
+        if self._on_evict:
+            for old in evicted:
+                self._on_evict(old)
+
+    def peek(self, key):
+        """Returns the (value, expires) entry of key without
+        touching its recency, or None."""
+
+        with self._lock:
+            return self._entries.get(key)
+
+    def pop(self, key):
+        """Drops key from the cache. Values being loaded
+        at the time are not stored."""
+
+        with self._lock:
+            self._entries.pop(key, None)
+            load = self._loads.get(key)
+            if load is not None:
+                load[1] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._epoch += 1
+
+    def stats(self):
+        """Returns the cache counters as a dict."""
+
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale_hits": self.stale_hits,
+                "evictions": self.evictions,
+                "refresh_errors": self.refresh_errors
+            }
+
+    def _refresh(self, key, loader, ttl, token):
+        try:
+            value = loader()
+        except Exception:
+            with self._lock:
+                self._end(key, token)
+                self.refresh_errors += 1
+        else:
+            self._store(key, value, ttl, token)
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def __len__(self):
+        return len(self._entries)
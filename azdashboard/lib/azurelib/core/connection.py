@@ -1,8 +1,17 @@
+from threading import Lock
+
+import requests
 from azure.storage.blob import BlobService
 from azure.storage.queue import QueueService
 from azure.storage.table import TableService
 
+from azdashboard.lib.azurelib.core.breaker import (
+    AzGuard,
+    Bulkhead,
+    CircuitBreaker
+)
 from azdashboard.lib.azurelib.core.errhandlers import azure_error
+from azdashboard.lib.azurelib.core.registry import ResourceRegistry
 from azdashboard.lib.azurelib.queue import AzQueue
 # from azurelib.storage import AzContainer, AzBlob
 from azdashboard.lib.azurelib.table import AzTable
@@ -12,15 +21,102 @@ class AzConnection(object):
 
     """Connection instance for azurelib objects"""
 
-    def __init__(self, user, key):
+    def __init__(self, user, key, pool_size=10, breaker=None,
+                 max_concurrent=None, services=None, registry_ttl=300):
         """Args:
             user: Azure Storage username
             key: Azure Storage account key
+            pool_size: (optional) max number of keep-alive HTTP
+                connections kept open per service kind
+            breaker: (optional) dict of CircuitBreaker settings.
+                Every service kind gets its own circuit breaker.
+            max_concurrent: (optional) max number of calls in flight
+                on the account, all service kinds together
+            services: (optional) dict of ready made services by kind
+                ('queue', 'table', 'blob') used instead of creating
+                them, e.g. the in-process fakes of azurelib.fake
+            registry_ttl: (optional) seconds the existence of queues,
+                tables and containers is remembered by exists() and
+                ensure_created(). 0 or None to always ask the service.
         """
 
         super(AzConnection, self).__init__()
         self._user = user
         self._key = key
+        self._pool_size = pool_size
+        # one long-lived service per kind (queue, table, blob)
+        self._services = {}
+        self._injected = dict(services or {})
+        self._lock = Lock()
+        self._breaker = breaker
+        self._bulkhead = None
+        if max_concurrent:
+            self._bulkhead = Bulkhead(max_concurrent)
+        self._guards = {}
+        self._registry = None
+        if registry_ttl:
+            self._registry = ResourceRegistry(registry_ttl)
+
+    def _session(self):
+        """Creates a requests.Session backed by a keep-alive
+        connection pool of the configured size."""
+
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=self._pool_size,
+            pool_maxsize=self._pool_size)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def _service(self, kind):
+        """Returns the shared service of the given kind,
+        creating it on first use.
+        Args:
+            kind: one of 'queue', 'table' or 'blob'
+        """
+
+        service = self._services.get(kind)
+        if service is None:
+            with self._lock:
+                service = self._services.get(kind)
+                if service is None:
+                    service = self._injected.get(kind)
+                    if service is None:
+                        cls = {"queue": QueueService,
+                               "table": TableService,
+                               "blob": BlobService}[kind]
+                        service = cls(account_name=self._user,
+                                      account_key=self._key,
+                                      request_session=self._session())
+                    self._services[kind] = service
+                    self._guards[kind] = self._new_guard()
+        return service
+
+    def _new_guard(self):
+        if self._breaker is None and self._bulkhead is None:
+            return None
+        breaker = None
+        if self._breaker is not None:
+            breaker = CircuitBreaker(**self._breaker)
+        return AzGuard(breaker, self._bulkhead)
+
+    def _entity(self, cls, kind, *args, **kwargs):
+        """Creates an azurelib entity of the given kind
+        guarded by the account's guard and sharing its registry."""
+
+        entity = cls(self._service(kind), *args, **kwargs)
+        entity.set_guard(self._guards.get(kind))
+        entity.set_registry(self._registry)
+        return entity
+
+    def breakers(self):
+        """Returns the state of the circuit breaker
+        of every service kind in use."""
+
+        return dict((kind, guard.breaker.state)
+                    for kind, guard in self._guards.items()
+                    if guard is not None and guard.breaker is not None)
 
     @azure_error()
     def queue(self, name=None):
@@ -29,8 +125,7 @@ class AzConnection(object):
         Args:
             name: (optional) name of the azure queue."""
 
-        service = QueueService(self._user, self._key)
-        return AzQueue(service, name)
+        return self._entity(AzQueue, "queue", name)
 
     @azure_error()
     def table(self, name=None):
@@ -39,18 +134,28 @@ class AzConnection(object):
         Args:
             name: (optional) name of the azure table."""
 
-        service = TableService(self._user, self._key)
-        return AzTable(service, name)
+        return self._entity(AzTable, "table", name)
 
     @azure_error()
     def container(self, name):
-        service = BlobService(account_name=self._user, account_key=self._key)
-        return AzContainer(service, container_name=name)
+        from azdashboard.lib.azurelib.storage import AzContainer
+
+        return self._entity(AzContainer, "blob", container_name=name)
 
     @azure_error()
     def blob(self, name):
-        service = BlobService(account_name=self._user, account_key=self._key)
-        return AzBlob(service, blob_name=name)
+        from azdashboard.lib.azurelib.storage import AzBlob
+
+        return self._entity(AzBlob, "blob", blob_name=name)
+
+    def close(self):
+        """Closes the pooled HTTP connections of every service."""
+
+        with self._lock:
+            for service in self._services.values():
+                service._httpclient.request_session.close()
+            self._services = {}
+            self._guards = {}
 
     def get_user(self):
         return self._user
@@ -1,7 +1,13 @@
+from azdashboard.lib.azurelib.core.breaker import GuardedService
+
+
 class AzEntity(object):
 
     """Base class for Azurelib objects"""
 
+    # kind of resource in the registry, for those having exists()
+    _kind = None
+
     def __init__(self, service, name):
         """Creates an Azurelib AzEntity
         Args:
@@ -12,18 +18,25 @@ class AzEntity(object):
 
         super(AzEntity, self).__init__()
         self._service = service
+        self._guard = None
+        self._registry = None
         self.select(name)
 
     def select(self, name):
         """Sets the entity's name. Required for
         operations on live Azure instances"""
+        self._name = self.normalize(name)
+
+    @staticmethod
+    def normalize(name):
+        """Returns name as select() stores it"""
         if name:
             name = name.replace("_", "")
             # from azurelib.storage import AzBlob
             #
             # if not isinstance(self, AzBlob):
             name = name.replace(".", "")
-        self._name = name
+        return name
 
     def get_name(self):
         """Returns the entity's name"""
@@ -34,3 +47,44 @@ class AzEntity(object):
         """Returns the entity's service"""
 
         return self._service
+
+    def set_guard(self, guard):
+        """Sets the AzGuard (circuit breaker & bulkhead)
+        every call to the service goes through."""
+
+        service = getattr(self._service, "_az_service", self._service)
+        self._guard = guard
+        self._service = service if guard is None else \
+            GuardedService(service, guard)
+
+    def set_registry(self, registry):
+        """Sets the ResourceRegistry remembering which
+        resources of the account exist."""
+
+        self._registry = registry
+
+    def ensure_created(self):
+        """Creates the resource unless it is known to exist.
+        With a registry, the service is only called the first
+        time, or once the registry's answer has expired."""
+
+        if self._registry is None:
+            self.create()
+        else:
+            self._registry.ensure(self._kind, self._name, self.create)
+
+    def _registered(self, lookup):
+        """Answers exists() from the registry if it knows,
+        otherwise with lookup(), recording the answer."""
+
+        if self._registry is not None:
+            known = self._registry.known(self._kind, self._name)
+            if known is not None:
+                return known
+        exists = bool(lookup())
+        self._record(exists)
+        return exists
+
+    def _record(self, exists, name=None):
+        if self._registry is not None:
+            self._registry.record(self._kind, name or self._name, exists)
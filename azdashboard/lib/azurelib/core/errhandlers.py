@@ -1,8 +1,13 @@
-from time import sleep
+from time import sleep, time
 
 import wrapt
 
 from azdashboard.lib.azurelib.core.errors import AzureException
+from azdashboard.lib.azurelib.core.metrics import registry
+from azdashboard.lib.azurelib.core.retry import (
+    FixedRetry,
+    get_default_policy
+)
 # from utils.vt4log import getLog
 
 
@@ -18,22 +23,54 @@ def handle_error(error, suppress_list):
     return error
 
 
-def azure_error(no_of_retries=10, retry_timing=60, suppress=[]):
+def azure_error(no_of_retries=None, retry_timing=None, suppress=[],
+                policy=None):
+    """Decorator turning errors into AzureException and retrying
+    the retriable ones.
+    Args:
+        no_of_retries, retry_timing: (optional) retry up to
+            no_of_retries times, retry_timing seconds apart
+        suppress: (optional) HTTP codes for which False is returned
+        policy: (optional) RetryPolicy of the decorated function.
+            Defaults to the one set with retry.set_default_policy.
+    Every call also accepts a `retry_policy` keyword argument
+    overriding the policy for that call only.
+    """
+
+    if policy is None and (no_of_retries or retry_timing):
+        policy = FixedRetry(no_of_retries or 10, retry_timing or 60)
+
     @wrapt.decorator
     def retry_error(wrapped, instance, args, kwargs):
-        retriable = True
+        call_policy = kwargs.pop("retry_policy", None) or policy or \
+            get_default_policy()
+        labels = {
+            "kind": type(instance).__name__ if instance else "",
+            "operation": wrapped.__name__,
+            "entity": getattr(instance, "_name", None) or ""
+        }
+        started = time()
         retry_no = 0
-        while retry_no < no_of_retries and retriable:
-            try:
-                return wrapped(*args, **kwargs)
-            except Exception as err:
-                exc = handle_error(err, suppress)
-                if not exc:
-                    return False
-                if exc.retriable and retry_no < no_of_retries:
-                    retriable = True
+        try:
+            while True:
+                try:
+                    return wrapped(*args, **kwargs)
+                except Exception as err:
+                    exc = handle_error(err, suppress)
+                    if not exc:
+                        return False
+                    delay = None
+                    if call_policy.should_retry(exc):
+                        delay = call_policy.next_delay(retry_no + 1,
+                                                       time() - started)
+                    if delay is None:
+                        registry.inc("azurelib_errors_total",
+                                     dict(labels, code=exc.number))
+                        raise exc
                     retry_no += 1
-                    sleep(retry_timing)
-                else:
-                    raise exc
+                    registry.inc("azurelib_retries_total", labels)
+                    sleep(delay)
+        finally:
+            registry.observe("azurelib_call_seconds", labels,
+                             time() - started)
     return retry_error
@@ -2,6 +2,30 @@ import errno
 import socket
 
 from azure.common import AzureHttpError, AzureMissingResourceHttpError
+from requests.exceptions import ConnectionError, Timeout
+
+# HTTP codes of transient server errors & throttling
+RETRIABLE_CODES = [500, 503]
+
+
+class CircuitOpenError(Exception):
+
+    """Raised instead of calling an account whose circuit is open"""
+
+
+class BulkheadFullError(Exception):
+
+    """Raised when an account has too many calls in flight"""
+
+
+class WriteBehindFullError(Exception):
+
+    """Raised when a write-behind buffer has no room for an entity"""
+
+
+class ChecksumError(Exception):
+
+    """Raised when downloaded data does not match its MD5"""
 
 
 class AzureException(Exception):
@@ -12,29 +36,40 @@ class AzureException(Exception):
     Fields:
         number: HTTP status code to output
         message: Exception message.
+        exception: the original exception
+        retriable: True if the call may succeed when retried
     """
 
     def __init__(self, exception):
         super(AzureException, self).__init__()
+        self.exception = exception
         self.retriable = False
-        if type(exception) is AzureMissingResourceHttpError:
+        if isinstance(exception, AzureMissingResourceHttpError):
             self.number = 404
             self.message = "Azure error. Missing resource: {0}".format(
                 repr(exception))
-        elif type(exception) is AzureHttpError:
-            self.number = 500
+        elif isinstance(exception, AzureHttpError):
+            self.number = exception.status_code or 500
             self.message = "Azure error: {0}".format(repr(exception))
-        elif type(exception) is socket.gaierror:
+            self.retriable = self.number in RETRIABLE_CODES
+        elif isinstance(exception, (CircuitOpenError, BulkheadFullError)):
+            self.number = 503
+            self.message = "Azure calls rejected: {0}".format(exception)
+        elif isinstance(exception, socket.gaierror):
             self.number = 404
-            self.message = "Connection error: {0}".format(exception[1])
+            self.message = "Connection error: {0}".format(exception)
             self.retriable = True
-        elif type(exception) is socket.error:
-            if exception[0] in [errno.ECONNREFUSED,
-                                errno.ECONNRESET,
-                                errno.ETIMEDOUT]:
-                self.message = "Connection error: {0}".format(exception[1])
-                self.retriable = True
-                self.number = 504
+        elif isinstance(exception, (ConnectionError, Timeout)) or \
+                (isinstance(exception, socket.error) and
+                 exception.errno in [errno.ECONNREFUSED,
+                                     errno.ECONNRESET,
+                                     errno.ETIMEDOUT]):
+            self.message = "Connection error: {0}".format(exception)
+            self.retriable = True
+            self.number = 504
         else:
             self.message = "Unknown error: {0}".format(exception)
             self.number = 500
+
+    def __str__(self):
+        return self.message
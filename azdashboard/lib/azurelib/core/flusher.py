@@ -0,0 +1,90 @@
+import atexit
+import logging
+from threading import Condition, Thread
+
+log = logging.getLogger(__name__)
+
+
+class PeriodicFlusher(object):
+
+    """Daemon thread shared by the write buffers of the process.
+
+    Buffers are watched only while they hold pending data: the thread
+    calls their flush_expired() method at the smallest interval asked
+    for, is started by the first watch and ends once nothing is left
+    to watch. Buffers still watched at interpreter exit are closed.
+    Failed flushes, raising or returning False, are logged and
+    counted; the next call happens as scheduled.
+    """
+
+    def __init__(self):
+        super(PeriodicFlusher, self).__init__()
+        # buffer -> seconds between two calls, None for exit only
+        self._buffers = {}
+        self._condition = Condition()
+        self._thread = None
+        self._exit_hook = False
+        self.errors = 0
+
+    def watch(self, buffer, interval):
+        """Calls buffer.flush_expired() every interval seconds,
+        or only closes it at exit if interval is None, until forgotten.
+        """
+
+        with self._condition:
+            self._buffers[buffer] = interval
+            if not self._exit_hook:
+                atexit.register(self.close_all)
+                self._exit_hook = True
+            if interval and self._thread is None:
+                self._thread = Thread(target=self._run, daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    def forget(self, buffer):
+        """Stops watching buffer, e.g. once it has nothing pending."""
+
+        with self._condition:
+            self._buffers.pop(buffer, None)
+
+    def watching(self, buffer):
+        with self._condition:
+            return buffer in self._buffers
+
+    def _intervals(self):
+        return [interval for interval in self._buffers.values() if interval]
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if not self._intervals():
+                    self._thread = None
+                    return
+                self._condition.wait(min(self._intervals()))
+                buffers = [buffer for buffer, interval
+                           in self._buffers.items() if interval]
+            for buffer in buffers:
+                try:
+                    if buffer.flush_expired() is not False:
+                        continue
+                    log.warning("background flush of %r failed: %s",
+                                buffer, buffer.error)
+                except Exception:
+                    log.exception("background flush of %r failed", buffer)
+                with self._condition:
+                    self.errors += 1
+
+    def close_all(self):
+        """Closes the buffers still watched. Called at exit."""
+
+        with self._condition:
+            buffers = list(self._buffers)
+        for buffer in buffers:
+            try:
+                buffer.close()
+            except Exception:
+                log.exception("could not close %r at exit", buffer)
+
+
+# the flusher of every buffer
+flusher = PeriodicFlusher()
@@ -0,0 +1,139 @@
+from bisect import bisect_left
+from threading import Lock
+
+# upper bounds of latency histogram buckets, in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1, 2.5, 5, 10, 30, 60)
+
+
+class Histogram(object):
+
+    """Cumulative histogram of observed values"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__()
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry(object):
+
+    """Counters, gauges and histograms keyed by name and labels,
+    rendered in the Prometheus text exposition format."""
+
+    def __init__(self):
+        super(MetricsRegistry, self).__init__()
+        self._types = {}
+        self._help = {}
+        self._series = {}
+        self._lock = Lock()
+
+    def describe(self, name, kind, help=""):
+        """Declares a metric.
+        Args:
+            name: metric name
+            kind: 'counter', 'gauge' or 'histogram'
+            help: (optional) description
+        """
+
+        with self._lock:
+            self._types[name] = kind
+            self._help[name] = help
+            self._series.setdefault(name, {})
+
+    def inc(self, name, labels=None, amount=1):
+        """Adds amount to a counter."""
+
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+
+    def set(self, name, labels=None, value=0):
+        """Sets a gauge."""
+
+        key = self._key(labels)
+        with self._lock:
+            self._series.setdefault(name, {})[key] = value
+
+    def observe(self, name, labels=None, value=0):
+        """Adds an observation to a histogram."""
+
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram()
+            histogram.observe(value)
+
+    def totals(self, name):
+        """Returns the (labels, count, sum) of every series
+        of a histogram."""
+
+        with self._lock:
+            return [(dict(key), histogram.count, histogram.sum)
+                    for key, histogram in self._series.get(name, {}).items()]
+
+    def render(self):
+        """Returns every metric in the Prometheus text format."""
+
+        lines = []
+        with self._lock:
+            for name in sorted(self._series):
+                kind = self._types.get(name, "untyped")
+                if name in self._help:
+                    lines.append("# HELP {0} {1}".format(name,
+                                                         self._help[name]))
+                lines.append("# TYPE {0} {1}".format(name, kind))
+                for key, value in sorted(self._series[name].items()):
+                    if isinstance(value, Histogram):
+                        lines.extend(self._render_histogram(name, key, value))
+                    else:
+                        lines.append("{0}{1} {2}".format(
+                            name, self._labels(key), value))
+        return "\n".join(lines) + "\n"
+
+    def _render_histogram(self, name, key, histogram):
+        lines = []
+        cumulative = 0
+        bounds = [repr(float(b)) for b in histogram.buckets] + ["+Inf"]
+        for bound, count in zip(bounds, histogram.counts):
+            cumulative += count
+            lines.append("{0}_bucket{1} {2}".format(
+                name, self._labels(key + (("le", bound),)), cumulative))
+        lines.append("{0}_sum{1} {2}".format(name, self._labels(key),
+                                             histogram.sum))
+        lines.append("{0}_count{1} {2}".format(name, self._labels(key),
+                                               histogram.count))
+        return lines
+
+    def _key(self, labels):
+        if not labels:
+            return ()
+        return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def _labels(self, key):
+        if not key:
+            return ""
+        return "{" + ",".join(
+            '{0}="{1}"'.format(k, v.replace("\\", "\\\\")
+                                   .replace('"', '\\"')
+                                   .replace("\n", "\\n"))
+            for k, v in key) + "}"
+
+
+registry = MetricsRegistry()
+registry.describe("azurelib_call_seconds", "histogram",
+                  "Latency of azurelib calls, retries included")
+registry.describe("azurelib_retries_total", "counter",
+                  "Retries of azurelib calls")
+registry.describe("azurelib_errors_total", "counter",
+                  "Failed azurelib calls, by HTTP code")
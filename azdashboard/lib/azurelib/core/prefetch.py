@@ -0,0 +1,100 @@
+from queue import Full, Queue
+from threading import Event, Thread
+
+_DONE = object()
+
+
+class _Failure(object):
+
+    def __init__(self, error):
+        self.error = error
+
+
+class Channel(object):
+
+    """Bounded hand-off of items between producer threads
+    and a single consumer.
+
+    Iterating over the channel yields items until every producer
+    is done, re-raising the first error a producer failed with.
+    Once the consumer calls stop(), producers are released and
+    further items are discarded.
+    """
+
+    def __init__(self, depth=1, producers=1):
+        """Args:
+            depth: max number of items waiting for the consumer
+            producers: number of producers feeding the channel
+        """
+
+        super(Channel, self).__init__()
+        self._items = Queue(maxsize=depth)
+        self._producers = producers
+        self._stop = Event()
+
+    def put(self, item):
+        """Blocks until item is queued. Returns False if
+        the consumer stopped meanwhile."""
+
+        while not self._stop.is_set():
+            try:
+                self._items.put(item, timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
+
+    def feed(self, iterable):
+        """Puts every item of iterable, then marks
+        this producer as done."""
+
+        if self._stop.is_set():
+            return
+        try:
+            for item in iterable:
+                if not self.put(item):
+                    return
+            self.put(_DONE)
+        except Exception as err:
+            self.put(_Failure(err))
+
+    def stop(self):
+        self._stop.set()
+
+    def __iter__(self):
+        done = 0
+        while done < self._producers:
+            item = self._items.get()
+            if item is _DONE:
+                done += 1
+            elif isinstance(item, _Failure):
+                raise item.error
+            else:
+                yield item
+
+
+def prefetch(iterable, depth=1):
+    """Iterates over iterable on a background thread, keeping up
+    to depth items ready ahead of the consumer.
+
+    The thread starts with the first item asked for. Errors raised
+    by iterable are re-raised to the consumer. Closing (or dropping)
+    the returned generator stops the background thread after the
+    item it is currently producing.
+    Args:
+        iterable: any iterable, typically a generator of pages
+        depth: (optional) max number of items produced in advance
+    """
+
+    channel = Channel(depth)
+
+    def consume():
+        # started here, so a generator never started holds no thread
+        Thread(target=channel.feed, args=(iterable,), daemon=True).start()
+        try:
+            for item in channel:
+                yield item
+        finally:
+            channel.stop()
+
+    return consume()
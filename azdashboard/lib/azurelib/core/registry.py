@@ -0,0 +1,71 @@
+from threading import Lock
+from time import time
+
+
+class ResourceRegistry(object):
+
+    """Remembers, for `ttl` seconds, which queues, tables and
+    containers of an account are known to exist or not, so that
+    exists() and ensure_created() do not ask the service again."""
+
+    def __init__(self, ttl=300):
+        """Args:
+            ttl: seconds an answer is trusted. Resources created,
+                deleted or looked up by another process may be
+                reported wrongly for that long.
+        """
+
+        super(ResourceRegistry, self).__init__()
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = Lock()
+        # one lock per resource being provisioned
+        self._creating = {}
+
+    def known(self, kind, name):
+        """Returns True or False if the resource is known to exist
+        or not, None if it is unknown."""
+
+        with self._lock:
+            entry = self._entries.get((kind, name))
+            if entry is None:
+                return None
+            exists, expires = entry
+            if time() >= expires:
+                del self._entries[(kind, name)]
+                return None
+            return exists
+
+    def record(self, kind, name, exists=True):
+        """Records that the resource exists, or not."""
+
+        with self._lock:
+            self._entries[(kind, name)] = (exists, time() + self.ttl)
+
+    def forget(self, kind, name):
+        with self._lock:
+            self._entries.pop((kind, name), None)
+
+    def ensure(self, kind, name, create):
+        """Calls create() unless the resource is known to exist,
+        once at a time per resource."""
+
+        if self.known(kind, name):
+            return
+        key = (kind, name)
+        with self._lock:
+            lock = self._creating.setdefault(key, Lock())
+        try:
+            with lock:
+                if not self.known(kind, name):
+                    create()
+                    self.record(kind, name)
+        finally:
+            with self._lock:
+                # callers still waiting hold it, later ones find it known
+                if self._creating.get(key) is lock:
+                    del self._creating[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,99 @@
+import random
+
+
+class RetryPolicy(object):
+
+    """Decides whether, and after how long, a failed Azure
+    call is attempted again."""
+
+    def should_retry(self, error):
+        """Returns True if error is worth retrying.
+        Args:
+            error: AzureException raised by the call
+        """
+
+        return error.retriable
+
+    def next_delay(self, retry_no, elapsed):
+        """Returns the seconds to wait before the given retry,
+        or None to give up.
+        Args:
+            retry_no: number of the upcoming retry, from 1
+            elapsed: seconds since the first attempt started
+        """
+
+        raise NotImplementedError()
+
+
+class NoRetry(RetryPolicy):
+
+    """Never retries"""
+
+    def next_delay(self, retry_no, elapsed):
+        return None
+
+
+class FixedRetry(RetryPolicy):
+
+    """Retries up to `retries` times, `interval` seconds apart"""
+
+    def __init__(self, retries=10, interval=60):
+        super(FixedRetry, self).__init__()
+        self.retries = retries
+        self.interval = interval
+
+    def next_delay(self, retry_no, elapsed):
+        if retry_no > self.retries:
+            return None
+        return self.interval
+
+
+class ExponentialBackoff(RetryPolicy):
+
+    """Retries with exponential backoff and full jitter: the n-th
+    retry waits a random time between 0 and
+    min(cap, base * 2 ** (n - 1)). No retry is scheduled whose wait
+    would end past `deadline`; the deadline does not bound the
+    attempts themselves, so the last one may still end after it.
+    Bound them with the HTTP timeouts of the service."""
+
+    def __init__(self, retries=5, base=0.5, cap=10, deadline=30):
+        """Args:
+            retries: max number of retries
+            base: (optional) first backoff ceiling, in seconds
+            cap: (optional) upper limit of a single wait, in seconds
+            deadline: (optional) time after which no retry is
+                scheduled, in seconds from the first attempt.
+                None for no limit.
+        """
+
+        super(ExponentialBackoff, self).__init__()
+        self.retries = retries
+        self.base = base
+        self.cap = cap
+        self.deadline = deadline
+
+    def next_delay(self, retry_no, elapsed):
+        if retry_no > self.retries:
+            return None
+        delay = random.uniform(0, min(self.cap,
+                                      self.base * 2 ** (retry_no - 1)))
+        if self.deadline is not None and elapsed + delay > self.deadline:
+            return None
+        return delay
+
+
+_default_policy = ExponentialBackoff()
+
+
+def get_default_policy():
+    """Returns the policy used by azure_error when none is given."""
+
+    return _default_policy
+
+
+def set_default_policy(policy):
+    """Sets the policy used by azure_error when none is given."""
+
+    global _default_policy
+    _default_policy = policy
@@ -0,0 +1,871 @@
+"""In-process fakes of the azure.storage Queue, Table and Blob services.
+
+They keep everything in memory, implement the subset of the SDK the
+library uses and can inject latency and errors, so the library can be
+exercised and benchmarked without a live account:
+
+    services = fake_services(latency=0.002, error_rate=0.01)
+    connection = AzConnection("bench", "key", services=services)
+"""
+
+import base64
+import copy
+import hashlib
+import random
+import re
+import uuid
+from bisect import bisect_left, insort
+from collections import Counter, OrderedDict
+from email.utils import formatdate
+from threading import RLock
+from time import gmtime, sleep, strftime, time
+
+from azure.common import AzureHttpError
+from azure.storage import AzureBatchOperationError
+from azure.storage.blob.models import BlobResult
+
+# max number of results of a single list/query page
+MAX_MESSAGES = 32
+MAX_ENTITIES = 1000
+MAX_BLOBS = 5000
+MAX_BATCH = 100
+
+
+class Faults(object):
+
+    """Latency and errors injected in every call of a fake service"""
+
+    def __init__(self, latency=0, jitter=0, error_rate=0, status_code=503,
+                 seed=None):
+        """Args:
+            latency: (optional) seconds every call takes
+            jitter: (optional) random extra seconds, up to jitter
+            error_rate: (optional) share of calls failing, 0 to 1
+            status_code: (optional) HTTP code of the injected errors
+            seed: (optional) seed of the random generator
+        """
+
+        super(Faults, self).__init__()
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.status_code = status_code
+        self._random = random.Random(seed)
+
+    def apply(self):
+        """Waits the call's latency, then raises the injected
+        error, if any."""
+
+        delay = self.latency
+        if self.jitter:
+            delay += self._random.uniform(0, self.jitter)
+        if delay:
+            sleep(delay)
+        if self.error_rate and self._random.random() < self.error_rate:
+            raise AzureHttpError("Injected failure", self.status_code)
+
+
+class _Record(object):
+
+    """SDK style result object: its attributes are its data"""
+
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+
+class _Results(list):
+
+    """SDK style list result, carrying paging info as attributes"""
+
+
+class _NullSession(object):
+
+    def close(self):
+        pass
+
+
+class _HttpClient(object):
+
+    def __init__(self, request_session):
+        self.request_session = request_session or _NullSession()
+
+
+def _batch_error(index, message, status_code):
+    """Returns the error of a failed entity group transaction, with
+    the message format of the service: the index of the failed
+    operation, then the request id and time on their own lines."""
+
+    codes = {400: "InvalidInput", 404: "ResourceNotFound",
+             409: "EntityAlreadyExists", 412: "UpdateConditionNotSatisfied"}
+    return AzureBatchOperationError(
+        "{0}:{1}\nRequestId:{2}\nTime:{3}".format(
+            index, message, uuid.uuid4(),
+            strftime("%Y-%m-%dT%H:%M:%SZ", gmtime())),
+        status_code, codes.get(status_code, ""))
+
+
+def _now():
+    return formatdate(usegmt=True)
+
+
+def _missing(what):
+    return AzureHttpError("The specified {0} does not exist.".format(what),
+                          404)
+
+
+def _exists(what):
+    return AzureHttpError("The specified {0} already exists.".format(what),
+                          409)
+
+
+class FakeService(object):
+
+    """Base of the fake services: shared lock, fault injection
+    and per-operation call counts."""
+
+    def __init__(self, account_name=None, account_key=None,
+                 request_session=None, faults=None):
+        super(FakeService, self).__init__()
+        self.account_name = account_name
+        self.account_key = account_key
+        self.faults = faults or Faults()
+        self.calls = Counter()
+        self._httpclient = _HttpClient(request_session)
+        self._lock = RLock()
+
+    def _request(self, operation):
+        """Accounts for a round trip to the service."""
+
+        self.calls[operation] += 1
+        self.faults.apply()
+
+
+class FakeQueueService(FakeService):
+
+    """In-memory azure.storage.queue.QueueService"""
+
+    def __init__(self, *args, **kwargs):
+        super(FakeQueueService, self).__init__(*args, **kwargs)
+        self._queues = {}
+
+    def _queue(self, queue_name):
+        queue = self._queues.get(queue_name)
+        if queue is None:
+            raise _missing("queue")
+        return queue
+
+    def create_queue(self, queue_name, x_ms_meta_name_values=None,
+                     fail_on_exist=False):
+        self._request("create_queue")
+        with self._lock:
+            if queue_name in self._queues:
+                if fail_on_exist:
+                    raise _exists("queue")
+                return False
+            self._queues[queue_name] = {
+                "metadata": dict(x_ms_meta_name_values or {}),
+                "messages": OrderedDict()
+            }
+            return True
+
+    def delete_queue(self, queue_name, fail_not_exist=False):
+        self._request("delete_queue")
+        with self._lock:
+            if self._queues.pop(queue_name, None) is None:
+                if fail_not_exist:
+                    raise _missing("queue")
+                return False
+            return True
+
+    def list_queues(self, prefix=None, marker=None, maxresults=None,
+                    include=None):
+        self._request("list_queues")
+        with self._lock:
+            names = sorted(name for name in self._queues
+                           if not prefix or name.startswith(prefix))
+        results = _Results(_Record(name=name, url="", metadata={})
+                           for name in names)
+        results.next_marker = ""
+        return results
+
+    def get_queue_metadata(self, queue_name):
+        self._request("get_queue_metadata")
+        with self._lock:
+            queue = self._queue(queue_name)
+            metadata = dict(("x-ms-meta-" + key, value)
+                            for key, value in queue["metadata"].items())
+            metadata["x-ms-approximate-messages-count"] = \
+                str(len(queue["messages"]))
+            return metadata
+
+    def put_message(self, queue_name, message_text, visibilitytimeout=None,
+                    messagettl=None):
+        self._request("put_message")
+        now = time()
+        with self._lock:
+            queue = self._queue(queue_name)
+            message_id = str(uuid.uuid4())
+            queue["messages"][message_id] = {
+                "message_id": message_id,
+                "message_text": message_text,
+                "insertion_time": _now(),
+                "expiration_time": formatdate(
+                    now + (messagettl or 7 * 24 * 3600), usegmt=True),
+                "visible": now + (visibilitytimeout or 0),
+                "pop_receipt": "",
+                "dequeue_count": 0
+            }
+
+    def get_messages(self, queue_name, numofmessages=None,
+                     visibilitytimeout=None):
+        self._request("get_messages")
+        number = min(numofmessages or 1, MAX_MESSAGES)
+        now = time()
+        results = _Results()
+        with self._lock:
+            for message in self._queue(queue_name)["messages"].values():
+                if len(results) >= number:
+                    break
+                if message["visible"] > now:
+                    continue
+                message["visible"] = now + (visibilitytimeout or 30)
+                message["pop_receipt"] = uuid.uuid4().hex
+                message["dequeue_count"] += 1
+                results.append(self._message(message))
+        return results
+
+    def peek_messages(self, queue_name, numofmessages=None):
+        self._request("peek_messages")
+        number = min(numofmessages or 1, MAX_MESSAGES)
+        now = time()
+        results = _Results()
+        with self._lock:
+            for message in self._queue(queue_name)["messages"].values():
+                if len(results) >= number:
+                    break
+                if message["visible"] <= now:
+                    results.append(self._message(message, peek=True))
+        return results
+
+    def delete_message(self, queue_name, message_id, popreceipt):
+        self._request("delete_message")
+        with self._lock:
+            messages = self._queue(queue_name)["messages"]
+            message = messages.get(message_id)
+            if message is None or message["pop_receipt"] != popreceipt:
+                raise _missing("message")
+            del messages[message_id]
+
+    def update_message(self, queue_name, message_id, message_text,
+                       popreceipt, visibilitytimeout):
+        self._request("update_message")
+        with self._lock:
+            message = self._queue(queue_name)["messages"].get(message_id)
+            if message is None or message["pop_receipt"] != popreceipt:
+                raise _missing("message")
+            message["message_text"] = message_text
+            message["visible"] = time() + visibilitytimeout
+            message["pop_receipt"] = uuid.uuid4().hex
+            return {
+                "x-ms-popreceipt": message["pop_receipt"],
+                "x-ms-time-next-visible": formatdate(message["visible"],
+                                                     usegmt=True)
+            }
+
+    def clear_messages(self, queue_name):
+        self._request("clear_messages")
+        with self._lock:
+            self._queue(queue_name)["messages"].clear()
+
+    def _message(self, message, peek=False):
+        fields = dict((key, value) for key, value in message.items()
+                      if key != "visible")
+        if peek:
+            del fields["pop_receipt"]
+        else:
+            fields["time_next_visible"] = formatdate(message["visible"],
+                                                     usegmt=True)
+        return _Record(**fields)
+
+
+_TOKENS = re.compile(r"\s*(\(|\)|(?:datetime|guid|X)?'(?:[^']|'')*'|"
+                     r"-?\d+(?:\.\d+)?L?|[A-Za-z_]\w*)")
+_COMPARISONS = {
+    "eq": lambda a, b: a == b,
+    "ne": lambda a, b: a != b,
+    "gt": lambda a, b: a > b,
+    "ge": lambda a, b: a >= b,
+    "lt": lambda a, b: a < b,
+    "le": lambda a, b: a <= b
+}
+
+
+class _Filter(object):
+
+    """Compiles the OData $filter subset used with Table storage:
+    comparisons of a property with a literal, combined with
+    and/or/not and parentheses."""
+
+    def __init__(self, expression):
+        super(_Filter, self).__init__()
+        self._tokens = []
+        position = 0
+        expression = expression.rstrip()
+        while position < len(expression):
+            match = _TOKENS.match(expression, position)
+            if not match:
+                raise AzureHttpError("Invalid filter: " + expression, 400)
+            self._tokens.append(match.group(1))
+            position = match.end()
+        self._position = 0
+        self.match = self._or()
+        if self._position != len(self._tokens):
+            raise AzureHttpError("Invalid filter: " + expression, 400)
+
+    def _peek(self):
+        if self._position < len(self._tokens):
+            return self._tokens[self._position]
+        return None
+
+    def _next(self):
+        token = self._peek()
+        if token is None:
+            raise AzureHttpError("Incomplete filter", 400)
+        self._position += 1
+        return token
+
+    def _or(self):
+        left = self._and()
+        while self._peek() == "or":
+            self._next()
+            left = (lambda a, b: lambda e: a(e) or b(e))(left, self._and())
+        return left
+
+    def _and(self):
+        left = self._unary()
+        while self._peek() == "and":
+            self._next()
+            left = (lambda a, b: lambda e: a(e) and b(e))(left,
+                                                          self._unary())
+        return left
+
+    def _unary(self):
+        token = self._next()
+        if token == "not":
+            operand = self._unary()
+            return lambda e: not operand(e)
+        if token == "(":
+            expression = self._or()
+            if self._next() != ")":
+                raise AzureHttpError("Unbalanced filter", 400)
+            return expression
+        name = token
+        operator = _COMPARISONS.get(self._next())
+        if operator is None:
+            raise AzureHttpError("Invalid filter operator", 400)
+        value = self._literal(self._next())
+
+        def compare(entity):
+            current = entity.get(name)
+            if current is None:
+                return False
+            try:
+                return operator(current, value)
+            except TypeError:
+                return False
+        return compare
+
+    def _literal(self, token):
+        if token.endswith("'"):
+            return token[token.index("'") + 1:-1].replace("''", "'")
+        if token in ("true", "false"):
+            return token == "true"
+        try:
+            return int(token.rstrip("L"))
+        except ValueError:
+            return float(token)
+
+
+class FakeTableService(FakeService):
+
+    """In-memory azure.storage.table.TableService.
+
+    Entity group transactions follow the SDK: begin_batch, then the
+    entity operations (recorded, not sent), then commit_batch, which
+    applies them all or none. A failed batch raises an error whose
+    message starts with the index of the failed operation."""
+
+    def __init__(self, *args, **kwargs):
+        super(FakeTableService, self).__init__(*args, **kwargs)
+        self._tables = {}
+        self._batch = None
+
+    def _table(self, table_name):
+        table = self._tables.get(table_name)
+        if table is None:
+            raise _missing("table")
+        return table
+
+    def create_table(self, table, fail_on_exist=False):
+        self._request("create_table")
+        with self._lock:
+            if table in self._tables:
+                if fail_on_exist:
+                    raise _exists("table")
+                return False
+            self._tables[table] = {"keys": [], "entities": {}}
+            return True
+
+    def delete_table(self, table_name, fail_not_exist=False):
+        self._request("delete_table")
+        with self._lock:
+            if self._tables.pop(table_name, None) is None:
+                if fail_not_exist:
+                    raise _missing("table")
+                return False
+            return True
+
+    def query_tables(self, table_name=None, top=None, next_table_name=None):
+        self._request("query_tables")
+        with self._lock:
+            if table_name is not None:
+                self._table(table_name)
+                names = [table_name]
+            else:
+                names = sorted(self._tables)
+        return _Results(_Record(name=name) for name in names)
+
+    def get_entity(self, table_name, partition_key, row_key, select=""):
+        self._request("get_entity")
+        with self._lock:
+            entity = self._table(table_name)["entities"].get(
+                (partition_key, row_key))
+            if entity is None:
+                raise _missing("entity")
+            return self._select(entity, select)
+
+    def query_entities(self, table_name, filter=None, select=None, top=None,
+                       next_partition_key=None, next_row_key=None):
+        self._request("query_entities")
+        match = _Filter(filter).match if filter else None
+        top = min(top or MAX_ENTITIES, MAX_ENTITIES)
+        results = _Results()
+        with self._lock:
+            table = self._table(table_name)
+            keys = table["keys"]
+            index = 0
+            if next_partition_key is not None:
+                index = bisect_left(keys,
+                                    (next_partition_key, next_row_key or ""))
+            while index < len(keys) and len(results) < top:
+                entity = table["entities"][keys[index]]
+                index += 1
+                if match is None or match(entity):
+                    results.append(self._select(entity, select))
+            if index < len(keys):
+                results.x_ms_continuation = {
+                    "nextpartitionkey": keys[index][0],
+                    "nextrowkey": keys[index][1]
+                }
+        return results
+
+    def insert_entity(self, table_name, entity,
+                      content_type="application/atom+xml"):
+        return self._operation("insert_entity", self._insert, table_name,
+                               entity)
+
+    def update_entity(self, table_name, partition_key, row_key, entity,
+                      content_type="application/atom+xml", if_match="*"):
+        return self._operation("update_entity", self._write, table_name,
+                               partition_key, row_key, entity, False,
+                               if_match)
+
+    def merge_entity(self, table_name, partition_key, row_key, entity,
+                     content_type="application/atom+xml", if_match="*"):
+        return self._operation("merge_entity", self._write, table_name,
+                               partition_key, row_key, entity, True,
+                               if_match)
+
+    def insert_or_replace_entity(self, table_name, partition_key, row_key,
+                                 entity,
+                                 content_type="application/atom+xml"):
+        return self._operation("insert_or_replace_entity", self._write,
+                               table_name, partition_key, row_key, entity,
+                               False, None)
+
+    def insert_or_merge_entity(self, table_name, partition_key, row_key,
+                               entity, content_type="application/atom+xml"):
+        return self._operation("insert_or_merge_entity", self._write,
+                               table_name, partition_key, row_key, entity,
+                               True, None)
+
+    def delete_entity(self, table_name, partition_key, row_key,
+                      content_type="application/atom+xml", if_match="*"):
+        return self._operation("delete_entity", self._delete, table_name,
+                               partition_key, row_key, if_match)
+
+    def begin_batch(self):
+        self._batch = []
+
+    def cancel_batch(self):
+        self._batch = None
+
+    def commit_batch(self):
+        operations, self._batch = self._batch, None
+        if not operations:
+            return []
+        self._request("commit_batch")
+        if len(operations) > MAX_BATCH:
+            raise _batch_error(0, "The batch request is too large.", 400)
+        tables = set(operation[1][0] for operation in operations)
+        partitions = set(operation[1][1].get("PartitionKey")
+                         if operation[0] == self._insert else
+                         operation[1][1] for operation in operations)
+        if len(tables) > 1 or len(partitions) > 1:
+            raise _batch_error(0, "All commands in a batch must operate on "
+                               "same entity group.", 400)
+        with self._lock:
+            table = self._table(tables.pop())
+            partition_key = partitions.pop()
+            # saved so that a failed batch changes nothing
+            saved = self._partition(table, partition_key)
+            results = []
+            for index, (function, args) in enumerate(operations):
+                try:
+                    results.append(function(*args))
+                except AzureHttpError as err:
+                    self._restore(table, partition_key, saved)
+                    raise _batch_error(index, err.args[0], err.status_code)
+            return results
+
+    def _operation(self, name, function, *args):
+        """Runs an entity operation, or records it in the open batch."""
+
+        if self._batch is not None:
+            self._batch.append((function, args))
+            return None
+        self._request(name)
+        with self._lock:
+            return function(*args)
+
+    def _insert(self, table_name, entity):
+        table = self._table(table_name)
+        key = (entity.get("PartitionKey"), entity.get("RowKey"))
+        if key in table["entities"]:
+            raise _exists("entity")
+        return self._store(table, key, dict(entity))
+
+    def _write(self, table_name, partition_key, row_key, entity, merge,
+               if_match):
+        table = self._table(table_name)
+        key = (partition_key, row_key)
+        current = table["entities"].get(key)
+        if if_match is not None:
+            if current is None:
+                raise _missing("entity")
+            if if_match != "*" and if_match != current["etag"]:
+                raise AzureHttpError("The condition specified using HTTP "
+                                     "conditional header(s) is not met.",
+                                     412)
+        properties = dict(current or {}) if merge else {}
+        properties.update(entity)
+        properties["PartitionKey"], properties["RowKey"] = key
+        return self._store(table, key, properties)
+
+    def _delete(self, table_name, partition_key, row_key, if_match):
+        table = self._table(table_name)
+        key = (partition_key, row_key)
+        current = table["entities"].get(key)
+        if current is None:
+            raise _missing("entity")
+        if if_match not in (None, "*") and if_match != current["etag"]:
+            raise AzureHttpError("The condition specified using HTTP "
+                                 "conditional header(s) is not met.", 412)
+        del table["entities"][key]
+        keys = table["keys"]
+        del keys[bisect_left(keys, key)]
+
+    def _store(self, table, key, properties):
+        properties.pop("etag", None)
+        properties["Timestamp"] = _now()
+        properties["etag"] = 'W/"datetime\'{0}\'"'.format(uuid.uuid4().hex)
+        if key not in table["entities"]:
+            insort(table["keys"], key)
+        table["entities"][key] = properties
+        return {"etag": properties["etag"]}
+
+    def _partition(self, table, partition_key):
+        """Returns the entities of a partition, by key."""
+
+        keys = table["keys"]
+        index = bisect_left(keys, (partition_key,))
+        entities = {}
+        while index < len(keys) and keys[index][0] == partition_key:
+            entities[keys[index]] = table["entities"][keys[index]]
+            index += 1
+        return entities
+
+    def _restore(self, table, partition_key, saved):
+        for key in self._partition(table, partition_key):
+            del table["entities"][key]
+        table["entities"].update(saved)
+        table["keys"] = sorted(table["entities"])
+
+    def _select(self, entity, select):
+        if select:
+            names = [name.strip() for name in select.split(",")]
+            fields = dict((name, entity.get(name)) for name in names)
+            fields["etag"] = entity["etag"]
+            return _Record(**fields)
+        return _Record(**copy.copy(entity))
+
+
+class FakeBlobService(FakeService):
+
+    """In-memory azure.storage.blob.BlobService, block blobs only"""
+
+    def __init__(self, *args, **kwargs):
+        super(FakeBlobService, self).__init__(*args, **kwargs)
+        self._containers = {}
+
+    def _container(self, container_name):
+        container = self._containers.get(container_name)
+        if container is None:
+            raise _missing("container")
+        return container
+
+    def _blob(self, container_name, blob_name):
+        blob = self._container(container_name)["blobs"].get(blob_name)
+        if blob is None or blob["data"] is None:
+            raise _missing("blob")
+        return blob
+
+    def create_container(self, container_name, x_ms_meta_name_values=None,
+                         x_ms_blob_public_access=None, fail_on_exist=False):
+        self._request("create_container")
+        with self._lock:
+            if container_name in self._containers:
+                if fail_on_exist:
+                    raise _exists("container")
+                return False
+            self._containers[container_name] = {
+                "blobs": {},
+                # sorted names of the committed blobs
+                "names": [],
+                "metadata": dict(x_ms_meta_name_values or {}),
+                "access": x_ms_blob_public_access,
+                "etag": uuid.uuid4().hex,
+                "last-modified": _now()
+            }
+            return True
+
+    def delete_container(self, container_name, fail_not_exist=False,
+                         x_ms_lease_id=None):
+        self._request("delete_container")
+        with self._lock:
+            if self._containers.pop(container_name, None) is None:
+                if fail_not_exist:
+                    raise _missing("container")
+                return False
+            return True
+
+    def set_container_acl(self, container_name, signed_identifiers=None,
+                          x_ms_blob_public_access=None, x_ms_lease_id=None):
+        self._request("set_container_acl")
+        with self._lock:
+            self._container(container_name)["access"] = \
+                x_ms_blob_public_access
+
+    def get_container_properties(self, container_name, x_ms_lease_id=None):
+        self._request("get_container_properties")
+        with self._lock:
+            container = self._container(container_name)
+            return {"etag": container["etag"],
+                    "last-modified": container["last-modified"]}
+
+    def list_containers(self, prefix=None, marker=None, maxresults=None,
+                        include=None):
+        self._request("list_containers")
+        with self._lock:
+            names = sorted(self._containers)
+        page, next_marker = self._page(names, prefix, marker, maxresults)
+        results = _Results(_Record(name=name, url="", properties={},
+                                   metadata={}) for name in page)
+        results.next_marker = next_marker
+        return results
+
+    def list_blobs(self, container_name, prefix=None, marker=None,
+                   maxresults=None, include=None, delimiter=None):
+        self._request("list_blobs")
+        with self._lock:
+            container = self._container(container_name)
+            blobs = container["blobs"]
+            page, next_marker = self._page(container["names"], prefix,
+                                           marker, maxresults)
+            results = _Results(_Record(name=name, snapshot="", url="",
+                                       properties=self._properties(
+                                           blobs[name]),
+                                       metadata={}) for name in page)
+        results.next_marker = next_marker
+        return results
+
+    def put_block_blob_from_bytes(self, container_name, blob_name, blob,
+                                  index=0, count=None, **headers):
+        if count is None:
+            count = len(blob) - index
+        self._put(container_name, blob_name, bytes(blob[index:index + count]),
+                  headers, True)
+
+    def put_block_blob_from_path(self, container_name, blob_name, file_path,
+                                 **headers):
+        with open(file_path, "rb") as stream:
+            data = stream.read()
+        self._put(container_name, blob_name, data, headers, True)
+
+    def put_block(self, container_name, blob_name, block, blockid,
+                  content_md5=None, x_ms_lease_id=None):
+        self._request("put_block")
+        data = bytes(block)
+        if content_md5 and content_md5 != self._md5(data):
+            raise AzureHttpError("The MD5 value specified in the request "
+                                 "did not match with the MD5 value "
+                                 "calculated by the server.", 400)
+        with self._lock:
+            blobs = self._container(container_name)["blobs"]
+            blob = blobs.setdefault(blob_name, {"data": None, "blocks": {},
+                                                "headers": {}})
+            blob["blocks"][blockid] = data
+
+    def put_block_list(self, container_name, blob_name, block_list,
+                       content_md5=None, **headers):
+        self._request("put_block_list")
+        with self._lock:
+            blob = self._container(container_name)["blobs"].get(blob_name)
+            blocks = blob["blocks"] if blob else {}
+            missing = [blockid for blockid in block_list
+                       if blockid not in blocks]
+            if missing:
+                raise AzureHttpError("The specified block list is invalid.",
+                                     400)
+            data = b"".join(blocks[blockid] for blockid in block_list)
+            self._store(container_name, blob_name, data, headers, False)
+
+    def get_blob(self, container_name, blob_name, snapshot=None,
+                 x_ms_range=None, x_ms_lease_id=None,
+                 x_ms_range_get_content_md5=None):
+        self._request("get_blob")
+        with self._lock:
+            blob = self._blob(container_name, blob_name)
+            properties = self._properties(blob)
+        data = blob["data"]
+        if x_ms_range:
+            match = re.match(r"bytes=(\d+)-(\d*)$", x_ms_range)
+            start = int(match.group(1))
+            end = int(match.group(2)) if match.group(2) else len(data) - 1
+            if start >= len(data):
+                raise AzureHttpError("The range specified is invalid for "
+                                     "the current size of the resource.",
+                                     416)
+            end = min(end, len(data) - 1)
+            properties["x-ms-blob-content-md5"] = \
+                properties.pop("content-md5", None)
+            data = data[start:end + 1]
+            properties["content-range"] = "bytes {0}-{1}/{2}".format(
+                start, end, len(blob["data"]))
+            properties["content-length"] = str(len(data))
+            if x_ms_range_get_content_md5:
+                properties["content-md5"] = self._md5(data)
+        return BlobResult(data, properties)
+
+    def get_blob_to_bytes(self, container_name, blob_name, snapshot=None,
+                          x_ms_lease_id=None, **kwargs):
+        return bytes(self.get_blob(container_name, blob_name))
+
+    def get_blob_to_path(self, container_name, blob_name, file_path,
+                         open_mode="wb", snapshot=None, x_ms_lease_id=None,
+                         **kwargs):
+        data = self.get_blob(container_name, blob_name)
+        with open(file_path, open_mode) as stream:
+            stream.write(data)
+
+    def get_blob_properties(self, container_name, blob_name,
+                            x_ms_lease_id=None):
+        self._request("get_blob_properties")
+        with self._lock:
+            return self._properties(self._blob(container_name, blob_name))
+
+    def delete_blob(self, container_name, blob_name, snapshot=None,
+                    timeout=None, x_ms_lease_id=None,
+                    x_ms_delete_snapshots=None):
+        self._request("delete_blob")
+        with self._lock:
+            self._blob(container_name, blob_name)
+            container = self._container(container_name)
+            del container["blobs"][blob_name]
+            names = container["names"]
+            del names[bisect_left(names, blob_name)]
+
+    def _put(self, container_name, blob_name, data, headers, whole):
+        self._request("put_blob")
+        with self._lock:
+            self._store(container_name, blob_name, data, headers, whole)
+
+    def _store(self, container_name, blob_name, data, headers, whole):
+        container = self._container(container_name)
+        blobs = container["blobs"]
+        if blob_name not in blobs or blobs[blob_name]["data"] is None:
+            insort(container["names"], blob_name)
+        md5 = headers.get("x_ms_blob_content_md5")
+        if whole and not md5:
+            md5 = self._md5(data)
+        blobs[blob_name] = {
+            "data": data,
+            "blocks": {},
+            "headers": {
+                "content-type": headers.get("x_ms_blob_content_type") or
+                "application/octet-stream",
+                "content-encoding": headers.get("content_encoding") or
+                headers.get("x_ms_blob_content_encoding"),
+                "content-md5": md5,
+                "etag": '"{0}"'.format(uuid.uuid4().hex),
+                "last-modified": _now()
+            }
+        }
+
+    def _properties(self, blob):
+        properties = dict((key, value)
+                          for key, value in blob["headers"].items()
+                          if value is not None)
+        properties["content-length"] = str(len(blob["data"]))
+        properties["x-ms-blob-type"] = "BlockBlob"
+        return properties
+
+    def _page(self, names, prefix, marker, maxresults):
+        """Returns a page of sorted names and the marker
+        of the next page, empty if none is left."""
+
+        size = min(maxresults or MAX_BLOBS, MAX_BLOBS)
+        prefix = prefix or ""
+        index = bisect_left(names, max(prefix, marker or ""))
+        page = []
+        while index < len(names) and names[index].startswith(prefix):
+            if len(page) == size:
+                return page, names[index]
+            page.append(names[index])
+            index += 1
+        return page, ""
+
+    def _md5(self, data):
+        return base64.b64encode(hashlib.md5(data).digest()).decode("ascii")
+
+
+def fake_services(**faults):
+    """Returns a dict of fake queue, table and blob services sharing
+    the given Faults settings, ready for AzConnection(services=...)."""
+
+    shared = Faults(**faults)
+    return {
+        "queue": FakeQueueService(faults=shared),
+        "table": FakeTableService(faults=shared),
+        "blob": FakeBlobService(faults=shared)
+    }
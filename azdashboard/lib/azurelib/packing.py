@@ -0,0 +1,210 @@
+import json
+import zlib
+from threading import RLock
+from time import time
+
+from azdashboard.lib.azurelib.core.flusher import flusher
+
+# max size of a base64 encoded Azure queue message
+MAX_MESSAGE_SIZE = 64 * 1024
+# versioned packed format: header followed by a zlib compressed JSON array
+HEADER_V1 = b"AZP\x01"
+# room kept for the end of a zlib stream
+_ZLIB_TAIL = 16
+
+
+def unpack(data):
+    """Decodes a packed message, either a legacy JSON array
+    or a versioned one.
+    Args:
+        data: bytes or string, as pushed by a PackingBuffer
+    Returns:
+        list of the packed messages
+    """
+
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    if data.startswith(HEADER_V1):
+        data = zlib.decompress(data[len(HEADER_V1):])
+    elif data[:3] == HEADER_V1[:3]:
+        raise ValueError("Unknown packed message version: {0}".format(
+            data[3:4]))
+    return json.loads(data.decode("utf-8"))
+
+
+class _JsonArray(object):
+
+    """Batch encoded as a plain JSON array (legacy format)"""
+
+    def __init__(self, budget):
+        self._budget = budget
+        self._pieces = []
+        self._size = 2
+
+    def try_add(self, piece):
+        size = self._size + len(piece) + (1 if self._pieces else 0)
+        if size > self._budget:
+            return False
+        self._pieces.append(piece)
+        self._size = size
+        return True
+
+    def payload(self):
+        return b"[" + b",".join(self._pieces) + b"]"
+
+    def __len__(self):
+        return len(self._pieces)
+
+
+class _ZlibArray(object):
+
+    """Batch encoded as a zlib compressed JSON array (format v1).
+
+    The stream is sync-flushed after every message, so its exact size
+    is known. A message is compressed straight in when it fits even
+    uncompressed; near the limit it is first tried on a copy of the
+    compressor.
+    """
+
+    def __init__(self, budget, level=6):
+        self._budget = budget - len(HEADER_V1) - _ZLIB_TAIL
+        self._zip = zlib.compressobj(level)
+        self._chunks = []
+        self._size = 0
+        self._count = 0
+        self._payload = None
+
+    def try_add(self, piece):
+        data = (b"," if self._count else b"[") + piece
+        # worst case growth of deflate on incompressible data
+        if self._size + len(data) + len(data) // 1000 + 12 <= self._budget:
+            compressor = self._zip
+        else:
+            compressor = self._zip.copy()
+        chunk = compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if self._size + len(chunk) > self._budget:
+            return False
+        self._zip = compressor
+        self._chunks.append(chunk)
+        self._size += len(chunk)
+        self._count += 1
+        return True
+
+    def payload(self):
+        if self._payload is None:
+            tail = self._zip.compress(b"]") + self._zip.flush(zlib.Z_FINISH)
+            self._payload = HEADER_V1 + b"".join(self._chunks) + tail
+        return self._payload
+
+    def __len__(self):
+        return self._count
+
+
+class PackingBuffer(object):
+
+    """Packs JSON messages into batches, each one fitting an Azure
+    queue message once base64 encoded.
+
+    Batches are plain JSON arrays, readable by any version, or with
+    compress=True, zlib compressed arrays in the versioned format
+    (see unpack). Every message is serialized once, when added, and
+    the size of the pending batch is tracked as messages come in.
+    A batch is sent when the next message does not fit in it, or by
+    the shared background flusher once its oldest message is max_age
+    seconds old. Pending messages are also sent on close(), when
+    leaving a `with` block and at interpreter exit. Buffers with
+    nothing pending hold no thread and no exit hook.
+    """
+
+    def __init__(self, send, max_size=MAX_MESSAGE_SIZE, max_age=10.0,
+                 compress=False):
+        """Args:
+            send: callable receiving the packed batch as bytes
+            max_size: (optional) max base64 encoded size of a batch
+            max_age: (optional) max seconds a message may wait in
+                the buffer. None disables the background flush.
+            compress: (optional) - boolean -
+                True to send zlib compressed batches
+        """
+
+        super(PackingBuffer, self).__init__()
+        self._send = send
+        # raw bytes fitting in max_size once base64 encoded
+        self._budget = max_size // 4 * 3
+        self._max_age = max_age
+        self._compress = compress
+        self._batch = self._new_batch()
+        self._since = None
+        self._last_send = time()
+        self._lock = RLock()
+        # last error of a send, None once a send succeeds
+        self.error = None
+
+    def _new_batch(self):
+        if self._compress:
+            return _ZlibArray(self._budget)
+        return _JsonArray(self._budget)
+
+    def add(self, msg):
+        """Adds a message to the buffer.
+        Args:
+            msg: JSON serializable object
+        Raises:
+            ValueError if msg alone does not fit in a queue message
+        """
+
+        piece = json.dumps(msg).encode("utf-8")
+        with self._lock:
+            quiet = (not self._batch and self._max_age is not None and
+                     time() - self._last_send >= self._max_age)
+            if not self._batch.try_add(piece):
+                self.flush()
+                if not self._batch.try_add(piece):
+                    raise ValueError("Message too large to be pushed")
+            if self._since is None:
+                self._since = time()
+                flusher.watch(self, self._max_age and self._max_age / 2.0)
+            # a quiet producer gets its message through right away
+            if quiet:
+                self.flush()
+
+    def flush(self):
+        """Sends the pending messages, if any.
+        Raises the send error, keeping the messages pending."""
+
+        with self._lock:
+            if not self._batch:
+                return
+            try:
+                self._send(self._batch.payload())
+            except Exception as err:
+                self.error = err
+                raise
+            self.error = None
+            self._batch = self._new_batch()
+            self._since = None
+            self._last_send = time()
+            flusher.forget(self)
+
+    def flush_expired(self):
+        """Sends the pending messages if the oldest one
+        is older than max_age."""
+
+        with self._lock:
+            if self._since is not None and \
+                    time() - self._since >= self._max_age:
+                self.flush()
+
+    def close(self):
+        """Sends pending messages."""
+
+        self.flush()
+
+    def __len__(self):
+        return len(self._batch)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
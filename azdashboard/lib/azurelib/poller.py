@@ -0,0 +1,184 @@
+import logging
+import random
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event, Lock, Thread
+from time import time
+
+log = logging.getLogger(__name__)
+
+
+class _Watch(object):
+
+    """Polling state of one queue"""
+
+    def __init__(self, queue, weight):
+        self.queue = queue
+        self.weight = float(weight)
+        self.delay = 0
+        self.due = 0
+        self.vtime = 0
+        # a batch of the queue is being handled
+        self.busy = False
+
+
+class AzQueuePoller(object):
+
+    """Polls many AzQueue instances from a single scheduler thread.
+
+    Every queue has its own backoff: after an empty receive it waits
+    a randomized delay (decorrelated jitter) that grows up to
+    max_interval, and it is polled again right away as soon as a
+    receive returns messages. When several queues are due at once,
+    the one with the least weighted service so far goes first (fair
+    queuing), so a queue of weight 2 gets about twice the messages
+    of a queue of weight 1 while both are busy. Batches are handled
+    by a pool of `workers` threads, so a slow handler does not delay
+    the other queues; a queue is polled again once its batch is
+    handled. Handler errors are counted and logged. stop() wakes the
+    scheduler immediately.
+
+    Usage:
+        poller = AzQueuePoller(handler)
+        poller.add(connection.queue('jobs'), weight=2)
+        poller.add(connection.queue('mails'))
+        poller.start()
+    """
+
+    def __init__(self, handler, number=32, timeout=None, is_base64=True,
+                 min_interval=0.5, max_interval=60, workers=4):
+        """Args:
+            handler: callable receiving (queue, messages) for every
+                non empty receive. It is in charge of deleting them.
+            number: (optional) max messages received at once
+            timeout: (optional) dequeue expiration. In seconds.
+            is_base64: (optional) - boolean -
+                True if queues use base64 encoding
+            min_interval: (optional) first backoff delay, in seconds
+            max_interval: (optional) upper limit of backoff delays
+            workers: (optional) number of threads running the handler
+        """
+
+        super(AzQueuePoller, self).__init__()
+        self._handler = handler
+        self._number = number
+        self._timeout = timeout
+        self._is_base64 = is_base64
+        self._min_interval = min_interval
+        self._max_interval = max_interval
+        self._watches = []
+        self._lock = Lock()
+        self._vclock = 0
+        self._wakeup = Event()
+        self._stopped = Event()
+        self._thread = None
+        self._workers = workers
+        self._executor = None
+        self.handled = 0
+        self.errors = 0
+        self.error = None
+
+    def add(self, queue, weight=1):
+        """Starts watching queue.
+        Args:
+            queue: AzQueue to poll
+            weight: (optional) share of polling given to the queue
+                relative to the others, while they are all busy
+        """
+
+        with self._lock:
+            self._watches.append(_Watch(queue, weight))
+        self._wakeup.set()
+
+    def remove(self, queue):
+        """Stops watching queue."""
+
+        with self._lock:
+            self._watches = [watch for watch in self._watches
+                             if watch.queue is not queue]
+
+    def start(self):
+        """Runs the scheduler on a daemon thread."""
+
+        self._executor = ThreadPoolExecutor(max_workers=self._workers)
+        self._thread = Thread(target=self.run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stops the scheduler, waking it up if it is waiting."""
+
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def run(self):
+        """Polls the queues until stop() is called."""
+
+        self._stopped.clear()
+        while not self._stopped.is_set():
+            now = time()
+            with self._lock:
+                idle = [watch for watch in self._watches if not watch.busy]
+                due = [watch for watch in idle if watch.due <= now]
+                upcoming = min([watch.due for watch in idle] or
+                               [now + self._max_interval])
+            if not due:
+                self._wakeup.wait(upcoming - now)
+                self._wakeup.clear()
+                continue
+            self._poll(min(due, key=lambda watch: watch.vtime))
+
+    def _poll(self, watch):
+        # an idle queue does not get credit for the time it was idle
+        watch.vtime = max(watch.vtime, self._vclock)
+        self._vclock = watch.vtime
+        try:
+            messages = watch.queue.get_messages(number=self._number,
+                                                timeout=self._timeout,
+                                                is_base64=self._is_base64,
+                                                blocking=False)
+        except Exception:
+            messages = []
+        if messages:
+            watch.delay = 0
+            watch.due = time()
+            watch.vtime += len(messages) / watch.weight
+            self._dispatch(watch, messages)
+        else:
+            watch.delay = min(self._max_interval,
+                              random.uniform(self._min_interval,
+                                             max(watch.delay * 3,
+                                                 self._min_interval)))
+            watch.due = time() + watch.delay
+            watch.vtime += 1 / watch.weight
+
+    def _dispatch(self, watch, messages):
+        """Hands a batch to the workers, or handles it on the scheduler
+        thread when run() was called directly."""
+
+        if self._executor is None:
+            self._handle(watch, messages)
+            return
+        watch.busy = True
+        self._executor.submit(self._handle, watch, messages)
+
+    def _handle(self, watch, messages):
+        try:
+            self._handler(watch.queue, messages)
+            with self._lock:
+                self.handled += 1
+        except Exception as err:
+            with self._lock:
+                self.errors += 1
+                self.error = err
+            log.exception("poller handler failed on %d messages",
+                          len(messages))
+        finally:
+            if watch.busy:
+                watch.busy = False
+                watch.due = time()
+                self._wakeup.set()
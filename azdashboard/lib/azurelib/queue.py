@@ -1,44 +1,125 @@
 import base64
 import binascii
-import json
-from sys import getsizeof
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait
+from threading import BoundedSemaphore, Condition, Lock
 from time import sleep, time
 
 from azdashboard.lib.azurelib.core.entity import AzEntity
 from azdashboard.lib.azurelib.core.errhandlers import azure_error
+from azdashboard.lib.azurelib.packing import (
+    MAX_MESSAGE_SIZE,
+    PackingBuffer,
+    unpack
+)
+
+log = logging.getLogger(__name__)
+
+# thread pools of AzQueue.sizes by number of workers, shared by every
+# queue, so polling the depths does not start threads on every call
+_size_pools = {}
+_size_pools_lock = Lock()
+
+
+def _size_pool(workers):
+    with _size_pools_lock:
+        pool = _size_pools.get(workers)
+        if pool is None:
+            pool = _size_pools[workers] = ThreadPoolExecutor(
+                max_workers=workers,
+                thread_name_prefix="azqueue-sizes-{0}".format(workers))
+        return pool
 
 
 class AzQueue(AzEntity):
 
     """Object representing a live Azure Queue"""
 
+    _kind = "queue"
+
     def __init__(self, service, name):
         super(AzQueue, self).__init__(service, name)
-        # last sync time, queue buffer
-        self.ltime = time()
-        self.buffer = []
+        # buffer of push_packed, background deletes of pipelined pops
+        self._packer = None
+        self._deletes = None
 
     def flush(self):
-        """Remember to flush on exit"""
-        if self.buffer != []:
-            self.push(json.dumps(self.buffer))
-            self.buffer = []  # what if we reuse the object after flush?
+        """Pushes the messages buffered by push_packed"""
+        if self._packer is not None:
+            self._packer.flush()
+
+    def packer(self, max_size=MAX_MESSAGE_SIZE, max_age=10.0,
+               compress=False):
+        """Returns the queue's PackingBuffer used by push_packed,
+        creating it with the given settings on first use.
+        With compress=True, batches are zlib compressed; only
+        readers knowing the versioned packed format can unpack them.
+        """
+
+        if self._packer is None:
+            self._packer = PackingBuffer(self.push, max_size=max_size,
+                                         max_age=max_age, compress=compress)
+        return self._packer
+
+    def flush_deletes(self, timeout=None):
+        """Waits for the deletes sent by pipelined pops.
+        Returns True if none is left outstanding and none failed
+        since the previous flush (see DeletePipeline.flush)."""
+
+        if self._deletes is None:
+            return True
+        return self._deletes.flush(timeout)
+
+    def close(self):
+        """Flushes the push buffer and waits for pending deletes.
+        Returns True if every delete was acknowledged, see
+        flush_deletes. Failed ones are logged."""
+
+        if self._packer is not None:
+            self._packer.close()
+            self._packer = None
+        deleted = True
+        if self._deletes is not None:
+            deleted = self._deletes.close()
+            if not deleted:
+                log.warning("queue %s closed with failed or unacknowledged "
+                            "deletes: the messages will be received again",
+                            self._name)
+            self._deletes = None
+        return deleted
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def delete_pipeline(self, workers=8, max_pending=256):
+        """Returns the queue's DeletePipeline, creating it
+        with the given settings on first use."""
+
+        if self._deletes is None:
+            self._deletes = DeletePipeline(self, workers=workers,
+                                           max_pending=max_pending)
+        return self._deletes
 
-    @azure_error()
     def exists(self):
         """Returns True if the queue exists on
         the connection's account."""
 
-        if len(self._service.list_queues
-               (prefix=self._name)) > 0:
-            return True
-        return False
+        return self._registered(self._exists)
+
+    @azure_error()
+    def _exists(self):
+        queues = self._service.list_queues(prefix=self._name)
+        return any(queue.name == self._name for queue in queues)
 
     @azure_error()
     def create(self, fail_on_exist=False):
         """Create the queue on the connection's account"""
 
         self._service.create_queue(self._name, fail_on_exist=fail_on_exist)
+        self._record(True)
         return True
 
     @azure_error()
@@ -46,6 +127,7 @@ class AzQueue(AzEntity):
         """Delete the queue from the account"""
 
         self._service.delete_queue(self._name, fail_not_exist=fail_not_exist)
+        self._record(False)
         return True
 
     @azure_error()
@@ -87,7 +169,8 @@ class AzQueue(AzEntity):
                 break
             if not messages:
                 retry_no += 1
-                sleep(self.get_next_time(retry_no, maxTime))
+                self._wait(self.get_next_time(retry_no, maxTime),
+                           exit_handler)
         dicts = [message.__dict__ for message in messages]
         if is_base64:
             try:
@@ -100,28 +183,45 @@ class AzQueue(AzEntity):
 
     def pop_packed_messages(self, number=32,
                             maxTime=2*60,
-                            exit_handler=None,):
+                            exit_handler=None,
+                            pipelined=False):
         """Will get a message which contains more messages.
            Returns a python list which contains dicts.
         """
         messages = self.pop_messages(
-            number, maxTime=maxTime, exit_handler=exit_handler)
+            number, maxTime=maxTime, exit_handler=exit_handler,
+            pipelined=pipelined)
+        return self.unpack_messages(messages)
+
+    def unpack_messages(self, messages):
+        """Unpacks messages pushed with push_packed, in either
+           the legacy or the versioned packed format.
+           Returns a python list which contains dicts.
+        """
         mlist = []
         for msg in messages:
-            mlist.extend(json.loads(msg["message_text"]))
+            mlist.extend(unpack(msg["message_text"]))
         return mlist
 
     def pop_messages(self, number=32, is_base64=True,
-                     blocking=True, maxTime=60 * 2, exit_handler=None):
+                     blocking=True, maxTime=60 * 2, exit_handler=None,
+                     pipelined=False):
         """
         Pops the given number of messages from the queue
         (deletes them on the spot).
+        If pipelined, returns right away and deletes the messages
+        in the background. See delete_pipeline & flush_deletes.
         """
 
         messages = self.get_messages(number=number, is_base64=is_base64,
                                      blocking=blocking,
                                      exit_handler=exit_handler,
                                      maxTime=maxTime)
+        if pipelined:
+            deletes = self.delete_pipeline()
+            for msg in messages:
+                deletes.submit(msg)
+            return messages
         for msg in messages:
             self.delete_message(msg)
         return messages
@@ -144,46 +244,29 @@ class AzQueue(AzEntity):
 
     def push_packed(self, msg):
         """Pushes a message to the queue, but will attempt to delay,
-        packing it with others messages if possible
+        packing it with others messages if possible.
+        Buffered messages are pushed at most 10 seconds later,
+        on flush/close, or at exit.
 
         :param msg: message to push
         :type msg: dict
         :rtype: None
         """
-        now = time()
-        # More than 6 seconds since the last push?
-        try:
-            json.dumps([msg])
-        except Exception:
-            raise
-        if now - self.ltime >= 10.0:
-            # We try to push the buffer as it is, if we have anything there
-            if self.buffer != []:
-                self.push(json.dumps(self.buffer))
-                self.buffer = []
-            # We also push the current message
-            self.ltime = time()
-            self.push(json.dumps([msg]))
-        else:
-            # We add the current message to the buffer
-            self.buffer.append(msg)
-            # If it is starting to get big, we push it
-            if getsizeof(json.dumps(self.buffer)) > 40000:
-                self.ltime = time()
-                self.push(json.dumps(self.buffer))
-                self.buffer = []
+        self.packer().add(msg)
 
     @azure_error()
     def push(self, msg, is_base64=True):
         """Posts a message to the queue.
         Args:
-            msg: JSON format containing message's data
+            msg: JSON format containing message's data, string or bytes
         Returns:
             list of dictionary items, containing both data & metadata.
             See library's README for content.
         """
         if is_base64:
-            msg = base64.b64encode(msg)
+            if not isinstance(msg, bytes):
+                msg = msg.encode("utf-8")
+            msg = base64.b64encode(msg).decode("ascii")
         self._service.put_message(self._name, msg)
         return True
 
@@ -209,16 +292,176 @@ class AzQueue(AzEntity):
         return True
 
     @azure_error()
-    def list_queues(self):
-        """List all queues from the account"""
+    def update_message(self, msg, timeout, is_base64=True):
+        """Makes a received message invisible for timeout more seconds.
+        Args:
+            msg: dict object - message to be updated.
+                Its 'pop_receipt' & 'time_next_visible' keys are
+                updated in place.
+            timeout: new visibility timeout. In seconds.
+            is_base64: (optional) - boolean -
+                    True if queue uses base64 encoding
+        """
 
-        queues = self._service.list_queues()
+        text = msg["message_text"]
+        if is_base64:
+            if not isinstance(text, bytes):
+                text = text.encode("utf-8")
+            text = base64.b64encode(text).decode("ascii")
+        result = self._service.update_message(self._name,
+                                              msg["message_id"],
+                                              text,
+                                              msg["pop_receipt"],
+                                              timeout)
+        msg["pop_receipt"] = result["x-ms-popreceipt"]
+        msg["time_next_visible"] = result.get("x-ms-time-next-visible")
+        return True
+
+    @azure_error()
+    def list_queues(self, prefix=None):
+        """List all queues from the account
+        Args:
+            prefix: (optional) only list queues whose name
+                starts with it
+        """
+
+        queues = self._service.list_queues(prefix=prefix)
         dicts = [queue.__dict__ for queue in queues]
         return dicts
 
+    def sizes(self, prefix=None, workers=16, timeout=10):
+        """Gets the approximate number of messages of every queue
+        from the account, querying them in parallel.
+        Args:
+            prefix: (optional) only include queues whose name
+                starts with it
+            workers: (optional) max number of concurrent requests
+            timeout: (optional) overall deadline, in seconds
+        Returns:
+            dict with a 'queues' list of {'name', 'size'} items,
+            in listing order, and a 'partial' flag set when some
+            queues did not answer in time ('size' is None for those).
+        """
+
+        names = [queue["name"] for queue in self.list_queues(prefix=prefix)]
+        if not names:
+            return {"queues": [], "partial": False}
+        executor = _size_pool(workers)
+        futures = [executor.submit(self._sibling(name).size)
+                   for name in names]
+        wait(futures, timeout=timeout)
+        queues = []
+        partial = False
+        for name, future in zip(names, futures):
+            size = None
+            if future.done() and not future.exception():
+                size = future.result()
+            else:
+                future.cancel()
+                partial = True
+            queues.append({"name": name, "size": size})
+        return {"queues": queues, "partial": partial}
+
+    def _sibling(self, name):
+        """Returns an AzQueue for another queue of the same account."""
+
+        queue = AzQueue(self._service, name)
+        queue.set_guard(self._guard)
+        queue.set_registry(self._registry)
+        return queue
+
     def get_next_time(self, retry_no, max_time):
         exp_factor = 2
         return min(exp_factor ** retry_no, max_time)
 
     def default_loop_handler(self):
         return True
+
+    def _wait(self, seconds, exit_handler, tick=1.0):
+        """Sleeps for seconds, checking exit_handler every tick
+        so the listening loop can stop early."""
+
+        deadline = time() + seconds
+        while exit_handler():
+            left = deadline - time()
+            if left <= 0:
+                return
+            sleep(min(tick, left))
+
+
+class DeletePipeline(object):
+
+    """Deletes messages of an AzQueue in the background.
+
+    Deletes run concurrently on a bounded pool; submit() blocks once
+    max_pending deletes are outstanding. Every message gets a sequence
+    number and `acknowledged` is the count of leading messages whose
+    delete has completed, so everything before it is settled.
+    """
+
+    def __init__(self, queue, workers=8, max_pending=256):
+        """Args:
+            queue: AzQueue the messages were received from
+            workers: (optional) number of concurrent deletes
+            max_pending: (optional) max number of outstanding deletes
+        """
+
+        super(DeletePipeline, self).__init__()
+        self._queue = queue
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._slots = BoundedSemaphore(max_pending)
+        self._settled = Condition()
+        self._completed = set()
+        self.submitted = 0
+        self.acknowledged = 0
+        # (message, AzureException) of the deletes that failed
+        self.failed = []
+        # failures already reported by flush
+        self._reported = 0
+
+    def submit(self, msg):
+        """Schedules the delete of msg. Returns its sequence number."""
+
+        self._slots.acquire()
+        with self._settled:
+            seq = self.submitted
+            self.submitted += 1
+        self._executor.submit(self._delete, seq, msg)
+        return seq
+
+    def _delete(self, seq, msg):
+        try:
+            self._queue.delete_message(msg)
+        except Exception as err:
+            with self._settled:
+                self.failed.append((msg, err))
+        finally:
+            with self._settled:
+                self._completed.add(seq)
+                while self.acknowledged in self._completed:
+                    self._completed.remove(self.acknowledged)
+                    self.acknowledged += 1
+                self._settled.notify_all()
+            self._slots.release()
+
+    def flush(self, timeout=None):
+        """Waits until every submitted delete has completed.
+        Returns False if timeout expired first, or if some deletes
+        failed since the previous flush: those messages were not
+        acknowledged and will be delivered again. They are listed
+        in `failed`."""
+
+        with self._settled:
+            settled = self._settled.wait_for(
+                lambda: self.acknowledged == self.submitted, timeout)
+            failures, self._reported = \
+                len(self.failed) - self._reported, len(self.failed)
+            return settled and not failures
+
+    def close(self):
+        """Waits for the outstanding deletes and stops the pool.
+        Returns flush()'s answer."""
+
+        settled = self.flush()
+        self._executor.shutdown(wait=True)
+        return settled
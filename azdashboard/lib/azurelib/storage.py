@@ -1,34 +1,199 @@
+import base64
+import hashlib
+import heapq
+import json
+import os
+from collections import deque
+from itertools import chain
+from concurrent.futures import ThreadPoolExecutor
+from threading import BoundedSemaphore, Lock
+from time import time
+
 from googleapiclient.http import MediaFileUpload
 
 from azdashboard.lib.azurelib.core.entity import AzEntity
+from azdashboard.lib.azurelib.core.errhandlers import azure_error
+from azdashboard.lib.azurelib.core.errors import ChecksumError
+from azdashboard.lib.azurelib.core.prefetch import prefetch
 
 
 __author__ = 'daniel'
 
+# default & max size of the blocks of block uploads
+BLOCK_SIZE = 4 * 1024 * 1024
+MAX_BLOCK_SIZE = 4 * 1024 * 1024
+# size of the ranges of parallel downloads
+CHUNK_SIZE = 4 * 1024 * 1024
+# min seconds between two saves of a download's progress
+PROGRESS_INTERVAL = 1.0
+# max number of results of a listing call
+PAGE_SIZE = 5000
+
+
+def _blocks(source, block_size):
+    """Generator cutting a file-like object or an iterable
+    of bytes into blocks of block_size bytes, the last one
+    possibly shorter."""
+
+    if hasattr(source, "read"):
+        read = source.read
+        source = iter(lambda: read(block_size), b"")
+    pending = bytearray()
+    for chunk in source:
+        if isinstance(chunk, str):
+            chunk = chunk.encode("utf-8")
+        pending.extend(chunk)
+        while len(pending) >= block_size:
+            yield bytes(pending[:block_size])
+            del pending[:block_size]
+    if pending:
+        yield bytes(pending)
+
+
+def _md5(data):
+    return base64.b64encode(hashlib.md5(data).digest()).decode("ascii")
+
+
+def _file_md5(path):
+    md5 = hashlib.md5()
+    with open(path, "rb") as stream:
+        for chunk in iter(lambda: stream.read(CHUNK_SIZE), b""):
+            md5.update(chunk)
+    return base64.b64encode(md5.digest()).decode("ascii")
+
+
+def _read_progress(path, blob):
+    """Returns the chunks already downloaded according to the
+    sidecar progress file, if it describes the same blob."""
+
+    try:
+        with open(path) as stream:
+            progress = json.load(stream)
+    except (IOError, ValueError):
+        return set()
+    if any(progress.get(key) != value for key, value in blob.items()):
+        return set()
+    return set(progress.get("done", []))
+
+
+def _write_progress(path, blob, done):
+    temporary = path + ".tmp"
+    with open(temporary, "w") as stream:
+        json.dump(dict(blob, done=sorted(done)), stream)
+    os.replace(temporary, path)
+
 
 class AzContainer(AzEntity):
+    _kind = "container"
+
     def __init__(self, service, container_name=""):
         super(AzContainer, self).__init__(service, container_name)
 
     def create(self, public=False):
         access_type = "blob" if public else None
         self._service.create_container(container_name=self._name, x_ms_blob_public_access=access_type)
+        self._record(True)
 
     def set_container_access_type(self, container_name, public=False):
         access_type = "blob" if public else None
         self._service.set_container_acl(container_name, x_ms_blob_public_access=access_type)
 
-    def list_containers(self):
-        return [container.name for container in self._service.list_containers()]
+    def list_containers(self, prefix=None, page_size=PAGE_SIZE):
+        """Generator of the names of the account's containers,
+        fetched page by page as it is consumed.
+        Args:
+            prefix: (optional) only list containers whose name
+                starts with it
+            page_size: (optional) containers fetched per call
+        """
+
+        marker = None
+        while True:
+            containers, marker = self._list_containers_page(prefix, marker,
+                                                            page_size)
+            for container in containers:
+                yield container.name
+            if not marker:
+                return
+
+    @azure_error()
+    def _list_containers_page(self, prefix, marker, page_size):
+        containers = self._service.list_containers(prefix=prefix,
+                                                   marker=marker,
+                                                   maxresults=page_size)
+        return list(containers), containers.next_marker
 
     def exists(self):
-        return self._name in self.list_containers()
+        """Returns True if the container exists on
+        the connection's account."""
+
+        return self._registered(self._exists)
+
+    @azure_error(suppress=[404])
+    def _exists(self):
+        self._service.get_container_properties(self._name)
+        return True
 
     def delete_container(self, container_name):
+        container_name = self.normalize(container_name)
         self._service.delete_container(container_name)
+        self._record(False, container_name)
+
+    def list_blobs(self, container_name=None, prefix=None, shards=None,
+                   page_size=PAGE_SIZE):
+        """Lists blobs, fetching them page by page as they are consumed.
+        Args:
+            container_name: (optional) defaults to this container
+            prefix: (optional) only list blobs whose name starts with it
+            shards: (optional) iterable of name fragments, e.g.
+                '0123456789abcdef'. Each prefix + fragment is listed
+                concurrently and the results are merged in name order.
+                The fragments must not be prefixes of one another and
+                must cover every name listed.
+            page_size: (optional) blobs fetched per call
+        Returns:
+            iterator of blob objects, in name order
+        """
+
+        container_name = container_name or self._name
+        if not shards:
+            return self._iter_blobs(container_name, prefix, page_size)
+        return self._merge_shards(container_name, prefix, shards, page_size)
 
-    def list_blobs(self, container_name):
-        return self._service.list_blobs(container_name)
+    def _merge_shards(self, container_name, prefix, shards, page_size):
+        shards = [prefetch(self._blob_pages(container_name,
+                                            (prefix or "") + shard,
+                                            page_size))
+                  for shard in shards]
+        try:
+            for blob in heapq.merge(*[chain.from_iterable(pages)
+                                      for pages in shards],
+                                    key=lambda blob: blob.name):
+                yield blob
+        finally:
+            # heapq.merge leaves them open: stop their threads
+            for pages in shards:
+                pages.close()
+
+    def _iter_blobs(self, container_name, prefix, page_size):
+        for page in self._blob_pages(container_name, prefix, page_size):
+            for blob in page:
+                yield blob
+
+    def _blob_pages(self, container_name, prefix, page_size):
+        marker = None
+        while True:
+            blobs, marker = self._list_blobs_page(container_name, prefix,
+                                                  marker, page_size)
+            yield blobs
+            if not marker:
+                return
+
+    @azure_error()
+    def _list_blobs_page(self, container_name, prefix, marker, page_size):
+        blobs = self._service.list_blobs(container_name, prefix=prefix,
+                                         marker=marker, maxresults=page_size)
+        return list(blobs), blobs.next_marker
 
 
 class AzBlob(AzEntity):
@@ -42,15 +207,29 @@ class AzBlob(AzEntity):
         else:
             self._container = container
 
-    def upload_file(self, file_path):
+    def upload_file(self, file_path, block_size=BLOCK_SIZE, workers=4):
+        """Uploads a file, in parallel blocks if larger than
+        block_size. See upload_stream."""
+
         blob_name = self._name
         blob_type = MediaFileUpload(file_path).mimetype()
+        if os.path.getsize(file_path) > block_size:
+            with open(file_path, "rb") as stream:
+                self.upload_stream(stream, blob_type, block_size=block_size,
+                                   workers=workers)
+            return
         self._service.put_block_blob_from_path(self._container,
                                                blob_name,
                                                file_path,
                                                x_ms_blob_content_type=blob_type)
 
     def upload_io(self, content, content_type, compressed=False):
+        """Uploads bytes in a single call. Streams and iterables
+        of bytes are uploaded with upload_stream."""
+
+        if not isinstance(content, (bytes, bytearray)):
+            return self.upload_stream(content, content_type,
+                                      compressed=compressed)
         if compressed:
             self._service.put_block_blob_from_bytes(self._container,
                                                     self._name, content,
@@ -61,11 +240,197 @@ class AzBlob(AzEntity):
                                                     self._name, content,
                                                     x_ms_blob_content_type=content_type)
 
+    def upload_stream(self, source, content_type=None, compressed=False,
+                      block_size=BLOCK_SIZE, workers=4):
+        """Uploads a blob block by block, up to `workers` blocks at
+        a time, then commits the block list. Every block is retried
+        on its own. At most 2 * workers blocks are held in memory,
+        whatever the size of the blob.
+        Args:
+            source: file-like object open in binary mode,
+                or iterable of bytes
+            content_type: (optional) MIME type of the blob
+            compressed: (optional) True if the content is gzip encoded
+            block_size: (optional) bytes per block, 4MB at most
+            workers: (optional) max number of blocks uploaded
+                concurrently
+        Returns:
+            the number of bytes uploaded
+        """
+
+        if not 0 < block_size <= MAX_BLOCK_SIZE:
+            raise ValueError("Block size must be between 1 and {0}".format(
+                MAX_BLOCK_SIZE))
+        block_ids = []
+        errors = []
+        md5 = hashlib.md5()
+        size = 0
+        slots = BoundedSemaphore(2 * workers)
+
+        def uploaded(future):
+            if future.exception() is not None:
+                errors.append(future.exception())
+            slots.release()
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for block in _blocks(source, block_size):
+                slots.acquire()
+                if errors:
+                    slots.release()
+                    break
+                # block ids of a blob must all have the same length
+                block_id = base64.b64encode("{0:08d}".format(
+                    len(block_ids)).encode("ascii")).decode("ascii")
+                block_ids.append(block_id)
+                md5.update(block)
+                size += len(block)
+                executor.submit(self._put_block, block, block_id) \
+                    .add_done_callback(uploaded)
+        if errors:
+            raise errors[0]
+        self._put_block_list(block_ids, content_type,
+                             "gzip" if compressed else None,
+                             base64.b64encode(md5.digest()).decode("ascii"))
+        return size
+
+    @azure_error()
+    def _put_block(self, block, block_id):
+        self._service.put_block(self._container, self._name, block,
+                                block_id, content_md5=_md5(block))
+
+    @azure_error()
+    def _put_block_list(self, block_ids, content_type, content_encoding,
+                        content_md5):
+        self._service.put_block_list(self._container, self._name, block_ids,
+                                     x_ms_blob_content_type=content_type,
+                                     x_ms_blob_content_encoding=content_encoding,
+                                     x_ms_blob_content_md5=content_md5)
+
     def get_properties(self):
         return self._service.get_blob_properties(self._container, self._name)
 
     def delete(self):
         self._service.delete_blob(self._container, self._name)
 
-    def download(self, destination_path):
-        self._service.get_blob_to_path(self._container, self._name, destination_path)
+    def download(self, destination_path, workers=4, chunk_size=CHUNK_SIZE,
+                 resume=True):
+        """Downloads the blob to a file, fetching byte ranges
+        concurrently into the preallocated file when larger than
+        chunk_size. The blob's MD5, if any, is verified.
+        Args:
+            destination_path: path of the file to write
+            workers: (optional) max number of ranges fetched
+                concurrently
+            chunk_size: (optional) bytes per range
+            resume: (optional) True to keep the ranges fetched by an
+                interrupted download, recorded in the
+                `destination_path + '.progress'` sidecar file
+        Raises:
+            ChecksumError if the MD5 of the file does not match
+        """
+
+        properties = self.get_properties()
+        size = int(properties["content-length"])
+        md5 = properties.get("content-md5")
+        progress_path = destination_path + ".progress"
+        if size <= chunk_size and not os.path.exists(progress_path):
+            self._service.get_blob_to_path(self._container, self._name,
+                                           destination_path)
+        else:
+            self._download_ranges(destination_path, progress_path, size,
+                                  properties.get("etag"), workers,
+                                  chunk_size, resume)
+        if md5 and _file_md5(destination_path) != md5:
+            raise ChecksumError("MD5 mismatch of " + destination_path)
+
+    def _download_ranges(self, path, progress_path, size, etag, workers,
+                         chunk_size, resume):
+        blob = {"etag": etag, "size": size, "chunk_size": chunk_size}
+        done = set()
+        if resume and os.path.exists(path) and \
+                os.path.getsize(path) == size:
+            done = _read_progress(progress_path, blob)
+        chunks = [index for index in range((size + chunk_size - 1) //
+                                           chunk_size)
+                  if index not in done]
+        lock = Lock()
+        saved = [time()]
+        with open(path, "r+b" if done else "wb") as stream:
+            stream.truncate(size)
+
+            def fetch(index):
+                start = index * chunk_size
+                data = self._get_range(start,
+                                       min(start + chunk_size, size) - 1)
+                with lock:
+                    stream.seek(start)
+                    stream.write(data)
+                    stream.flush()
+                    done.add(index)
+                    if resume and time() - saved[0] >= PROGRESS_INTERVAL:
+                        _write_progress(progress_path, blob, done)
+                        saved[0] = time()
+
+            try:
+                with ThreadPoolExecutor(max_workers=workers) as executor:
+                    futures = [executor.submit(fetch, index)
+                               for index in chunks]
+                    try:
+                        for future in futures:
+                            future.result()
+                    except BaseException:
+                        for future in futures:
+                            future.cancel()
+                        raise
+            except BaseException:
+                # keep what was fetched for the next attempt
+                if resume:
+                    _write_progress(progress_path, blob, done)
+                raise
+        if os.path.exists(progress_path):
+            os.remove(progress_path)
+
+    def iter_chunks(self, chunk_size=CHUNK_SIZE, workers=4):
+        """Generator of the blob's content, in chunks of chunk_size
+        bytes, fetching up to `workers` chunks ahead concurrently.
+        Raises ChecksumError after the last chunk if the blob's
+        MD5, if any, does not match."""
+
+        properties = self.get_properties()
+        size = int(properties["content-length"])
+        expected = properties.get("content-md5")
+        md5 = hashlib.md5()
+        window = deque()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            try:
+                for start in range(0, size, chunk_size):
+                    window.append(executor.submit(
+                        self._get_range, start,
+                        min(start + chunk_size, size) - 1))
+                    if len(window) >= workers:
+                        data = window.popleft().result()
+                        md5.update(data)
+                        yield data
+                while window:
+                    data = window.popleft().result()
+                    md5.update(data)
+                    yield data
+            finally:
+                for future in window:
+                    future.cancel()
+        if expected and \
+                base64.b64encode(md5.digest()).decode("ascii") != expected:
+            raise ChecksumError("MD5 mismatch of " + self._name)
+
+    @azure_error()
+    def _get_range(self, start, end):
+        """Fetches bytes start to end, both included."""
+
+        data = self._service.get_blob(self._container, self._name,
+                                      x_ms_range="bytes={0}-{1}".format(
+                                          start, end))
+        if len(data) != end - start + 1:
+            raise IOError("Short read of {0}: {1} bytes instead of "
+                          "{2}".format(self._name, len(data),
+                                       end - start + 1))
+        return bytes(data)
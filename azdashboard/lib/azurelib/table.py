@@ -1,20 +1,105 @@
+import copy
+import logging
+import re
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+from azure.common import AzureMissingResourceHttpError
+
+from azdashboard.lib.azurelib.core.cache import TTLCache
 from azdashboard.lib.azurelib.core.entity import AzEntity
 from azdashboard.lib.azurelib.core.errhandlers import azure_error
+from azdashboard.lib.azurelib.core.errors import AzureException
+from azdashboard.lib.azurelib.core.prefetch import Channel
+from azdashboard.lib.azurelib.core.prefetch import prefetch as prefetch_pages
+from azdashboard.lib.azurelib.writebehind import UpsertBuffer
+
+log = logging.getLogger(__name__)
+
+# max number of operations of an entity group transaction
+BATCH_SIZE = 100
+
+# cached in place of entities known to be missing
+_MISSING = object()
 
 
 class AzTable(AzEntity):
 
     """Object representing a live Azure Table"""
 
+    _kind = "table"
+
     def __init__(self, service, name):
         super(AzTable, self).__init__(service, name)
         self._partition = None
+        # read-through cache of get, see cache()
+        self._cache = None
+        self._negative_ttl = 0
+        self._cached_keys = {}
+        self._cache_lock = Lock()
+        # write-behind buffer of upsert_buffered, see write_behind()
+        self._upserts = None
+
+    def cache(self, max_size=1024, ttl=30, stale=0, negative_ttl=0):
+        """Returns the entity cache used by get, creating it with
+        the given settings on first use. Entities written through
+        this AzTable are dropped from it.
+        Args:
+            max_size: max number of cached entities
+            ttl: (optional) seconds an entity is served from the cache
+            stale: (optional) seconds an expired entity may still be
+                served while it is fetched again in the background
+            negative_ttl: (optional) seconds a missing entity is
+                remembered as such. 0 disables negative caching.
+        """
+
+        if self._cache is None:
+            self._negative_ttl = negative_ttl
+            self._cache = TTLCache(max_size=max_size, ttl=ttl, stale=stale,
+                                   on_evict=self._forget)
+        return self._cache
+
+    def write_behind(self, max_entities=100, max_age=5.0,
+                     max_pending=10000):
+        """Returns the table's UpsertBuffer used by upsert_buffered,
+        creating it with the given settings on first use."""
+
+        if self._upserts is None:
+            self._upserts = UpsertBuffer(self.upsert_many,
+                                         max_entities=max_entities,
+                                         max_age=max_age,
+                                         max_pending=max_pending)
+        return self._upserts
+
+    def flush(self):
+        """Writes the upserts buffered by upsert_buffered.
+        Returns True if all of them were written."""
+
+        if self._upserts is None:
+            return True
+        return self._upserts.flush()
+
+    def close(self):
+        """Writes the buffered upserts and stops their
+        background flush."""
+
+        if self._upserts is not None:
+            self._upserts.close()
+            self._upserts = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
 
     @azure_error()
     def create(self, fail_on_exist=False):
         """Create the table on the connection's account"""
 
         self._service.create_table(self._name, fail_on_exist=fail_on_exist)
+        self._record(True)
         return True
 
     @azure_error()
@@ -22,13 +107,17 @@ class AzTable(AzEntity):
         """Delete the table from the account"""
 
         self._service.delete_table(self._name, fail_not_exist=fail_not_exist)
+        self._record(False)
         return True
 
-    @azure_error(suppress=[404])
     def exists(self):
         """Returns True if the table exists on
         the connection's account."""
 
+        return self._registered(self._exists)
+
+    @azure_error(suppress=[404])
+    def _exists(self):
         tables = self._service.query_tables(table_name=self._name)
         if tables and len(tables) > 0:
             return True
@@ -50,6 +139,20 @@ class AzTable(AzEntity):
 
         if not partition:
             partition = self._partition
+        if self._cache is None:
+            return self._get(row, partition, selection)
+        key = (self._name, partition, row, tuple(selection))
+        with self._cache_lock:
+            self._cached_keys.setdefault((partition, row), set()).add(key)
+        entity = self._cache.get(
+            key, lambda: self._load(row, partition, selection),
+            ttl=self._entry_ttl)
+        if entity is _MISSING:
+            raise AzureMissingResourceHttpError(
+                "The specified resource does not exist.", 404)
+        return dict(entity)
+
+    def _get(self, row, partition, selection):
         selected = ", ".join(selection)
         entities = self._service.get_entity(self._name,
                                             partition,
@@ -58,6 +161,39 @@ class AzTable(AzEntity):
         dicts = entities.__dict__
         return dicts
 
+    def _load(self, row, partition, selection):
+        """Fetches an entity for the cache."""
+
+        try:
+            return self._get(row, partition, selection)
+        except AzureMissingResourceHttpError:
+            if not self._negative_ttl:
+                raise
+            return _MISSING
+
+    def _entry_ttl(self, entity):
+        return self._negative_ttl if entity is _MISSING else None
+
+    def _invalidate(self, partition, row):
+        """Drops an entity, in every selection, from the cache."""
+
+        if self._cache is None:
+            return
+        with self._cache_lock:
+            keys = self._cached_keys.pop((partition, row), ())
+        for key in keys:
+            self._cache.pop(key)
+
+    def _forget(self, key):
+        """Unindexes a key evicted from the cache."""
+
+        with self._cache_lock:
+            keys = self._cached_keys.get((key[1], key[2]))
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._cached_keys[(key[1], key[2])]
+
     @azure_error()
     def insert(self, entity):
         """Inserts the provided entity into the table.
@@ -70,7 +206,10 @@ class AzTable(AzEntity):
 
         if "PartitionKey" not in entity:
             entity["PartitionKey"] = self._partition
-        self._service.insert_entity(self._name, entity)
+        try:
+            self._service.insert_entity(self._name, entity)
+        finally:
+            self._invalidate(entity["PartitionKey"], entity["RowKey"])
         return True
 
     @azure_error()
@@ -85,12 +224,29 @@ class AzTable(AzEntity):
 
         if "PartitionKey" not in entity:
             entity["PartitionKey"] = self._partition
-        self._service.insert_or_merge_entity(self._name,
-                                             entity["PartitionKey"],
-                                             entity["RowKey"],
-                                             entity)
+        try:
+            self._service.insert_or_merge_entity(self._name,
+                                                 entity["PartitionKey"],
+                                                 entity["RowKey"],
+                                                 entity)
+        finally:
+            self._invalidate(entity["PartitionKey"], entity["RowKey"])
         return True
 
+    def upsert_buffered(self, entity):
+        """Buffers an upsert, merging it with the pending upserts
+        of the same entity. Pending entities are written in batches
+        at most 5 seconds later, on flush/close, or at exit.
+        See write_behind.
+        Args:
+            entity: dict, as for upsert
+        """
+
+        entity = dict(entity)
+        if "PartitionKey" not in entity:
+            entity["PartitionKey"] = self._partition
+        self.write_behind().add(entity)
+
     @azure_error()
     def update(self, entity):
         """Merges the provided entity. Does
@@ -109,16 +265,18 @@ class AzTable(AzEntity):
             entity["PartitionKey"] = self._partition
         if "ETag" in entity:
             etag = entity.pop("Etag")
-            self._service.merge_entity(self._name,
-                                       entity["PartitionKey"],
-                                       entity["RowKey"],
-                                       entity,
-                                       if_match=etag)
+            try:
+                self._service.merge_entity(self._name,
+                                           entity["PartitionKey"],
+                                           entity["RowKey"],
+                                           entity,
+                                           if_match=etag)
+            finally:
+                self._invalidate(entity["PartitionKey"], entity["RowKey"])
         else:
             return self.insert(entity)
         return True
 
-    @azure_error()
     def query(self, query, selection, top=1000):
         """Queries the table.
         Args:
@@ -129,28 +287,133 @@ class AzTable(AzEntity):
             list of dict objects representing the queried entities
         """
 
+        return list(self.iter_query(query, selection, top=top,
+                                    prefetch=False))
+
+    def iter_query(self, query, selection, top=1000, limit=None,
+                   prefetch=True):
+        """Queries the table, yielding entities page by page.
+        Args:
+            query: string.
+                See http://msdn.microsoft.com/en-us/library/azure/dd894031.aspx
+            selection: list of columns to be selected
+            top: (optional) page size
+            limit: (optional) max number of entities to yield.
+                Paging stops as soon as it is reached.
+            prefetch: (optional) - boolean -
+                True to fetch the next page in the background
+                while the current one is consumed
+        Returns:
+            generator of dict objects representing the queried entities
+        """
+
+        pages = self._pages(query, ", ".join(selection), top, limit)
+        if prefetch:
+            pages = prefetch_pages(pages)
+        for page in pages:
+            for entity in page:
+                yield entity
+
+    def scan(self, ranges, selection, query=None, workers=8,
+             ordered=False, top=1000):
+        """Queries several partition ranges of the table in
+        parallel, merging the results into a single stream.
+        Args:
+            ranges: list of partitions to scan. Every item is either
+                a PartitionKey, or a (low, high) tuple matching
+                low <= PartitionKey < high, where None leaves that
+                side of the range open. Ranges must not overlap.
+            selection: list of columns to be selected
+            query: (optional) string filter applied within every range
+            workers: (optional) max number of ranges read concurrently
+            ordered: (optional) - boolean -
+                True to yield entities ordered by PartitionKey and
+                RowKey, False to yield pages as soon as they arrive
+            top: (optional) page size
+        Returns:
+            generator of dict objects representing the queried entities
+        """
+
+        ranges = sorted(ranges, key=lambda r: (
+            r[0] or "" if isinstance(r, tuple) else r))
+        if not ranges:
+            return
         select = ", ".join(selection)
-        done = False
-        dicts = []
-        next = {
-            "nextpartitionkey": None,
-            "nextrowkey": None
-        }
-        while not done:
-            entities = self._service.query_entities(self._name,
-                                                    filter=query,
-                                                    select=select,
-                                                    top=top,
-                                                    next_partition_key=next["nextpartitionkey"],
-                                                    next_row_key=next["nextrowkey"])
-            for entity in entities:
-                dicts.append(entity.__dict__)
-            if hasattr(entities, "x_ms_continuation"):
-                next["nextpartitionkey"] = entities.x_ms_continuation["nextpartitionkey"]
-                next["nextrowkey"] = entities.x_ms_continuation["nextrowkey"]
-            else:
-                done = True
-        return dicts
+        if ordered:
+            # each range fills its own channel, read one after the other
+            channels = [Channel(depth=2) for _ in ranges]
+        else:
+            channels = [Channel(depth=2 * workers,
+                                producers=len(ranges))] * len(ranges)
+        executor = ThreadPoolExecutor(max_workers=workers)
+        for partitions, channel in zip(ranges, channels):
+            pages = self._pages(self._range_filter(partitions, query),
+                                select, top, None)
+            executor.submit(channel.feed, pages)
+        executor.shutdown(wait=False)
+        try:
+            for channel in (channels if ordered else channels[:1]):
+                for page in channel:
+                    for entity in page:
+                        yield entity
+        finally:
+            for channel in channels:
+                channel.stop()
+
+    def _range_filter(self, partitions, query=None):
+        """Builds the filter matching a scan() range."""
+
+        def quote(key):
+            return "'{0}'".format(key.replace("'", "''"))
+
+        if isinstance(partitions, tuple):
+            low, high = partitions
+            conditions = []
+            if low is not None:
+                conditions.append("PartitionKey ge " + quote(low))
+            if high is not None:
+                conditions.append("PartitionKey lt " + quote(high))
+        else:
+            conditions = ["PartitionKey eq " + quote(partitions)]
+        if query:
+            conditions.append("({0})".format(query))
+        return " and ".join(conditions) or None
+
+    def _pages(self, query, select, top, limit):
+        """Generator of entity pages, following continuation tokens."""
+
+        next_partition = next_row = None
+        remaining = limit
+        while remaining is None or remaining > 0:
+            if remaining is not None:
+                top = min(top, remaining)
+            page, continuation = self._query_page(query, select, top,
+                                                  next_partition, next_row)
+            if remaining is not None:
+                page = page[:remaining]
+                remaining -= len(page)
+            yield page
+            if not continuation:
+                break
+            next_partition = continuation.get("nextpartitionkey")
+            next_row = continuation.get("nextrowkey")
+
+    @azure_error()
+    def _query_page(self, query, select, top, next_partition, next_row):
+        """Fetches a single page of entities.
+        Returns:
+            (list of dicts, continuation dict or None) tuple
+        """
+
+        entities = self._service.query_entities(
+            self._name,
+            filter=query,
+            select=select,
+            top=top,
+            next_partition_key=next_partition,
+            next_row_key=next_row)
+        dicts = [entity.__dict__ for entity in entities]
+        return dicts, getattr(entities, "x_ms_continuation", None)
 
     @azure_error()
     def remove(self, row, partition=None, etag=None):
@@ -166,10 +429,135 @@ class AzTable(AzEntity):
             partition = self._partition
         if not etag:
             etag = "*"
-        self._service.delete_entity(self._name,
-                                    partition,
-                                    row,
-                                    if_match=etag)
+        try:
+            self._service.delete_entity(self._name,
+                                        partition,
+                                        row,
+                                        if_match=etag)
+        finally:
+            self._invalidate(partition, row)
+        return True
+
+    def insert_many(self, entities, workers=8):
+        """Inserts the provided entities using entity group
+        transactions, one partition per worker.
+        Args:
+            entities: list of dicts, as for insert
+            workers: (optional) max number of partitions
+                written concurrently
+        Returns:
+            list with, for every entity, True or the AzureException
+            that prevented its insertion
+        """
+
+        return self._write_many("insert", entities, workers)
+
+    def upsert_many(self, entities, workers=8):
+        """Inserts or merges the provided entities using entity group
+        transactions. See insert_many."""
+
+        return self._write_many("upsert", entities, workers)
+
+    def delete_many(self, entities, workers=8):
+        """Deletes the provided entities using entity group
+        transactions. See insert_many.
+        Args:
+            entities: list of dicts that need to contain at least
+                the 'RowKey' key, and optionally 'PartitionKey'
+                and 'etag' keys.
+        """
+
+        return self._write_many("delete", entities, workers)
+
+    def _write_many(self, operation, entities, workers):
+        partitions = OrderedDict()
+        for index, entity in enumerate(entities):
+            if "PartitionKey" not in entity:
+                entity["PartitionKey"] = self._partition
+            partitions.setdefault(entity["PartitionKey"], []) \
+                .append((index, entity))
+        results = [None] * len(entities)
+        if not partitions:
+            return results
+
+        def write_partition(items):
+            for start in range(0, len(items), BATCH_SIZE):
+                batch = items[start:start + BATCH_SIZE]
+                try:
+                    self._commit_batch(operation, batch, results)
+                finally:
+                    for _, entity in batch:
+                        self._invalidate(entity["PartitionKey"],
+                                         entity["RowKey"])
+
+        with ThreadPoolExecutor(
+                max_workers=min(workers, len(partitions))) as executor:
+            for future in [executor.submit(write_partition, items)
+                           for items in partitions.values()]:
+                future.result()
+        return results
+
+    def _commit_batch(self, operation, items, results):
+        """Commits a batch of (index, entity) items, storing the
+        outcome of every entity in results. Entity group
+        transactions are atomic, so when the service reports the
+        operation that failed, the batch is resent without it."""
+
+        try:
+            self._send_batch(operation, [entity for _, entity in items])
+        except AzureException as err:
+            # the service prefixes the message with the failed index:
+            # "3:The specified entity already exists.\nRequestId:..."
+            match = re.match(r"(\d+):", str(err.exception))
+            failed = int(match.group(1)) if match else None
+            if failed is None and len(items) > 1 and err.number < 500:
+                log.warning("batch error without the failed operation, "
+                            "failing its %d entities: %s", len(items), err)
+            if failed is None or failed >= len(items) or len(items) == 1:
+                for index, _ in items:
+                    results[index] = err
+                return
+            results[items[failed][0]] = err
+            self._commit_batch(operation,
+                               items[:failed] + items[failed + 1:],
+                               results)
+            return
+        for index, _ in items:
+            results[index] = True
+
+    @azure_error()
+    def _send_batch(self, operation, entities):
+        """Sends entities of one partition as a single entity
+        group transaction."""
+
+        # batch state is kept on the service, so use a private copy
+        # sharing the pooled HTTP session. Operations are only queued
+        # until the commit, the one round trip going through the guard.
+        guard = getattr(self._service, "_az_guard", None)
+        service = copy.copy(getattr(self._service, "_az_service",
+                                    self._service))
+        service.begin_batch()
+        try:
+            for entity in entities:
+                if operation == "insert":
+                    service.insert_entity(self._name, entity)
+                elif operation == "upsert":
+                    service.insert_or_merge_entity(self._name,
+                                                   entity["PartitionKey"],
+                                                   entity["RowKey"],
+                                                   entity)
+                else:
+                    service.delete_entity(self._name,
+                                          entity["PartitionKey"],
+                                          entity["RowKey"],
+                                          if_match=entity.get("etag", "*"))
+        except Exception:
+            service.cancel_batch()
+            raise
+        if guard is None:
+            service.commit_batch()
+        else:
+            guard.call(service.commit_batch)
         return True
 
     @azure_error()
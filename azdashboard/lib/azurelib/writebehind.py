@@ -0,0 +1,168 @@
+from collections import OrderedDict
+from threading import Lock
+from time import time
+
+from azdashboard.lib.azurelib.core.errors import WriteBehindFullError
+from azdashboard.lib.azurelib.core.flusher import flusher
+
+
+class UpsertBuffer(object):
+
+    """Write-behind buffer of table upserts.
+
+    Upserts of the same (PartitionKey, RowKey) are merged property by
+    property, as insert-or-merge does, so only the latest value of
+    every property is written. Pending entities are written as entity
+    group transactions once max_entities of them are pending, by the
+    shared background flusher once the oldest upsert is max_age seconds
+    old, on flush/close, when leaving a `with` block and at interpreter
+    exit. Buffers with nothing pending hold no thread and no exit hook.
+    Entities that fail to be written are kept for the next
+    flush, merged under the upserts made since.
+    """
+
+    def __init__(self, write, max_entities=100, max_age=5.0,
+                 max_pending=10000):
+        """Args:
+            write: callable receiving a list of entities and returning,
+                for each one, True or the error that prevented its
+                write, e.g. AzTable.upsert_many
+            max_entities: (optional) number of pending entities
+                triggering a flush
+            max_age: (optional) max seconds an upsert may wait in the
+                buffer. None disables the background flush.
+            max_pending: (optional) max number of entities left
+                unwritten, failed ones included: upserts of new
+                entities beyond it flush right away, and are refused
+                with the last write error if the flush fails.
+        """
+
+        super(UpsertBuffer, self).__init__()
+        self._write = write
+        self._max_entities = max_entities
+        self._max_age = max_age
+        self._max_pending = max_pending
+        self._pending = OrderedDict()
+        self._since = None
+        self._lock = Lock()
+        # one flush at a time, so writes of a key keep their order
+        self._flush_lock = Lock()
+        self.error = None
+        self.upserts = 0
+        self.written = 0
+        self.failures = 0
+
+    def add(self, entity):
+        """Buffers an upsert.
+        Args:
+            entity: dict containing at least the 'PartitionKey'
+                and 'RowKey' keys
+        Raises:
+            the last write error if max_pending entities are left
+            unwritten and entity is not one of them, or
+            WriteBehindFullError if they were written but others
+            took their place meanwhile
+        """
+
+        key = (entity["PartitionKey"], entity["RowKey"])
+        if not self._has_room(key):
+            written = self.flush()
+            if not self._has_room(key):
+                if written or self.error is None:
+                    raise WriteBehindFullError(
+                        "{0} entities pending".format(self._max_pending))
+                raise self.error
+        with self._lock:
+            pending = self._pending.get(key)
+            if pending is None:
+                self._pending[key] = dict(entity)
+            else:
+                pending.update(entity)
+            self.upserts += 1
+            if self._since is None:
+                self._since = time()
+                flusher.watch(self, self._max_age and self._max_age / 2.0)
+            full = len(self._pending) >= self._max_entities
+        if full:
+            self.flush()
+
+    def _has_room(self, key):
+        with self._lock:
+            return key in self._pending or \
+                len(self._pending) < self._max_pending
+
+    def flush(self):
+        """Writes the pending entities.
+        Returns True if all of them were written. Otherwise,
+        the failed ones are kept and the error is set."""
+
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    flusher.forget(self)
+                    return True
+                batch, self._pending = self._pending, OrderedDict()
+                since, self._since = self._since, None
+            entities = list(batch.values())
+            try:
+                results = self._write(entities)
+            except Exception as err:
+                results = [err] * len(entities)
+            failed = OrderedDict(
+                (key, entity) for key, entity, result
+                in zip(batch.keys(), entities, results) if result is not True)
+            with self._lock:
+                self.written += len(entities) - len(failed)
+                if not failed:
+                    if not self._pending:
+                        flusher.forget(self)
+                    return True
+                self.failures += len(failed)
+                self.error = next(result for result in results
+                                  if result is not True)
+                # upserts made during the write are newer
+                for key, entity in self._pending.items():
+                    if key in failed:
+                        failed[key].update(entity)
+                    else:
+                        failed[key] = entity
+                self._pending = failed
+                self._since = since
+            return False
+
+    def flush_expired(self):
+        """Writes the pending entities if the oldest upsert
+        is older than max_age. Returns False if the write failed."""
+
+        with self._lock:
+            expired = self._since is not None and \
+                time() - self._since >= self._max_age
+        return self.flush() if expired else True
+
+    def close(self):
+        """Writes pending entities.
+        Raises the write error if some could not be written."""
+
+        if not self.flush():
+            raise self.error or WriteBehindFullError(
+                "{0} entities left unwritten".format(len(self)))
+
+    def stats(self):
+        """Returns the buffer counters as a dict."""
+
+        with self._lock:
+            return {
+                "pending": len(self._pending),
+                "upserts": self.upserts,
+                "written": self.written,
+                "failures": self.failures
+            }
+
+    def __len__(self):
+        return len(self._pending)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,348 @@
+"""Benchmarks of azurelib against the in-process fake services.
+
+Every benchmark runs `--repeat` times; the median run is recorded and
+compared to the stored baseline. A throughput below the baseline, or a
+p99 latency above it, by more than `--tolerance` is a regression and
+makes the script exit with status 1. `--save` stores the results as
+the new baseline.
+
+Usage: python azurelib_bench.py [--save] [--tolerance 0.25]
+                                [--repeat 3] [--only NAME ...]
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+from time import time
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path = [os.path.join(here, "..", "..", "..")] + sys.path
+
+from azdashboard.lib.azurelib.core.connection import AzConnection  # noqa
+from azdashboard.lib.azurelib.core.retry import ExponentialBackoff  # noqa
+from azdashboard.lib.azurelib.fake import fake_services  # noqa
+
+BASELINE = os.path.join(here, "baseline.json")
+# latencies under this many ms are timer noise, never flagged
+MIN_FLAGGED_LATENCY = 1.0
+
+
+class Run(object):
+
+    """Timings of one benchmark run"""
+
+    def __init__(self, unit):
+        super(Run, self).__init__()
+        self.unit = unit
+        self.items = 0
+        self.latencies = []
+        self._started = time()
+        self.seconds = None
+
+    def timed(self, func, *args, **kwargs):
+        """Calls func, recording its latency."""
+
+        started = time()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self.latencies.append(time() - started)
+
+    def stop(self):
+        self.seconds = time() - self._started
+
+    def result(self):
+        latencies = sorted(self.latencies) or [0]
+
+        def percentile(share):
+            index = min(len(latencies) - 1, int(len(latencies) * share))
+            return round(latencies[index] * 1000, 3)
+
+        return {
+            "unit": self.unit,
+            "throughput": round(self.items / self.seconds, 1),
+            "p50_ms": percentile(0.5),
+            "p99_ms": percentile(0.99)
+        }
+
+
+def connection(**faults):
+    return AzConnection("bench", "key", services=fake_services(**faults))
+
+
+def message(i):
+    return {"id": i, "kind": "sample", "payload": "x" * 64}
+
+
+def bench_push_packed(compress=False, count=20000):
+    queue = connection().queue("benchpush")
+    queue.create()
+    queue.packer(compress=compress)
+    run = Run("msgs/s")
+    for i in range(count):
+        run.timed(queue.push_packed, message(i))
+    queue.flush()
+    run.items = count
+    run.stop()
+    queue.close()
+    return run
+
+
+def fill_queue(queue, count):
+    queue.create()
+    for i in range(count):
+        queue.push_packed(message(i))
+    queue.flush()
+
+
+def bench_pop_packed(pipelined=False, count=100000):
+    queue = connection(latency=0.001).queue("benchpop")
+    fill_queue(queue, count)
+    run = Run("msgs/s")
+
+    def pop():
+        # pop_packed_messages, without blocking on an empty queue
+        return queue.unpack_messages(
+            queue.pop_messages(blocking=False, pipelined=pipelined))
+
+    while run.items < count:
+        messages = run.timed(pop)
+        if not messages:
+            break
+        run.items += len(messages)
+    queue.flush_deletes()
+    run.stop()
+    queue.close()
+    return run
+
+
+def fill_table(table, partitions, rows):
+    table.create()
+    table.upsert_many([{"PartitionKey": "p{0:04d}".format(p),
+                        "RowKey": "r{0:06d}".format(r), "value": r}
+                       for p in range(partitions) for r in range(rows)])
+
+
+def bench_table_query(prefetch=True, partitions=20, rows=1000):
+    table = connection(latency=0.02).table("benchquery")
+    fill_table(table, partitions, rows)
+    run = Run("entities/s")
+    entities = table.iter_query("value ge 0", ["value"], prefetch=prefetch,
+                                top=1000)
+    for _ in range(partitions * rows):
+        entity = run.timed(next, entities, None)
+        if entity is None:
+            break
+        run.items += 1
+    run.stop()
+    return run
+
+
+def bench_table_upsert_many(partitions=50, rows=100):
+    table = connection(latency=0.002).table("benchupsert")
+    table.create()
+    entities = [{"PartitionKey": "p{0:04d}".format(p),
+                 "RowKey": "r{0:06d}".format(r), "value": r}
+                for p in range(partitions) for r in range(rows)]
+    run = Run("entities/s")
+    run.timed(table.upsert_many, entities)
+    run.items = len(entities)
+    run.stop()
+    return run
+
+
+def bench_table_upsert_buffered(upserts=20000, keys=50):
+    table = connection(latency=0.002).table("benchbuffered")
+    table.create()
+    table.set_partition("p")
+    run = Run("upserts/s")
+    with table:
+        for i in range(upserts):
+            run.timed(table.upsert_buffered,
+                      {"RowKey": "r{0:04d}".format(i % keys), "beat": i})
+    run.items = upserts
+    run.stop()
+    return run
+
+
+def bench_blob_upload(workers=8, size=32, block_size=1024 * 1024):
+    az = connection(latency=0.01)
+    container = az.container("bench")
+    container.create()
+    blob = az.blob("upload")
+    blob.set_container("bench")
+    chunk = b"x" * 65536
+    chunks = (chunk for _ in range(size * 1024 * 1024 // len(chunk)))
+    run = Run("MB/s")
+    run.timed(blob.upload_stream, chunks, block_size=block_size,
+              workers=workers)
+    run.items = size
+    run.stop()
+    return run
+
+
+def bench_blob_download(workers=8, size=32, chunk_size=1024 * 1024):
+    az = connection(latency=0.01)
+    az.container("bench").create()
+    blob = az.blob("download")
+    blob.set_container("bench")
+    blob.upload_io(b"x" * size * 1024 * 1024, "application/octet-stream")
+    path = tempfile.mktemp()
+    run = Run("MB/s")
+    try:
+        run.timed(blob.download, path, workers=workers,
+                  chunk_size=chunk_size)
+    finally:
+        os.remove(path)
+    run.items = size
+    run.stop()
+    return run
+
+
+def bench_blob_list(shards=None, blobs=20000):
+    az = connection()
+    container = az.container("bench")
+    container.create()
+    service = container.get_service()
+    for i in range(blobs):
+        service.put_block_blob_from_bytes("bench", "{0:x}".format(
+            i * 7919 % blobs), b"")
+    service.faults.latency = 0.01
+    run = Run("blobs/s")
+    listing = container.list_blobs(shards=shards, page_size=1000)
+    for _ in range(blobs):
+        if run.timed(next, listing, None) is None:
+            break
+        run.items += 1
+    run.stop()
+    return run
+
+
+def bench_retry(calls=2000):
+    queue = connection(seed=1).queue("benchretry")
+    queue.create()
+    queue.get_service().faults.error_rate = 0.2
+    policy = ExponentialBackoff(retries=10, base=0.0005, cap=0.005,
+                                deadline=None)
+    run = Run("calls/s")
+    for _ in range(calls):
+        run.timed(queue.size, retry_policy=policy)
+    run.items = calls
+    run.stop()
+    return run
+
+
+def bench_sizes(queues=200):
+    az = connection(latency=0.002)
+    for i in range(queues):
+        az.queue("benchsizes{0:04d}".format(i)).create()
+    queue = az.queue()
+    run = Run("queues/s")
+    for _ in range(5):
+        result = run.timed(queue.sizes, prefix="benchsizes")
+        run.items += len(result["queues"])
+    run.stop()
+    return run
+
+
+BENCHMARKS = [
+    ("queue.push_packed", bench_push_packed),
+    ("queue.push_packed.zlib", lambda: bench_push_packed(compress=True)),
+    ("queue.pop_packed", bench_pop_packed),
+    ("queue.pop_packed.pipelined",
+     lambda: bench_pop_packed(pipelined=True)),
+    ("queue.sizes", bench_sizes),
+    ("table.query", lambda: bench_table_query(prefetch=False)),
+    ("table.query.prefetch", bench_table_query),
+    ("table.upsert_many", bench_table_upsert_many),
+    ("table.upsert_buffered", bench_table_upsert_buffered),
+    ("blob.upload_stream", bench_blob_upload),
+    ("blob.upload_stream.serial", lambda: bench_blob_upload(workers=1)),
+    ("blob.download", bench_blob_download),
+    ("blob.download.serial", lambda: bench_blob_download(workers=1)),
+    ("blob.list", bench_blob_list),
+    ("blob.list.sharded", lambda: bench_blob_list(shards="0123456789abcdef")),
+    ("retry.size", bench_retry)
+]
+
+
+def measure(benchmark, repeat):
+    """Returns the median (by throughput) result of repeated runs."""
+
+    runs = sorted((benchmark().result() for _ in range(repeat)),
+                  key=lambda result: result["throughput"])
+    return runs[len(runs) // 2]
+
+
+def compare(name, result, baseline, tolerance):
+    """Returns the regressions of result against its baseline."""
+
+    regressions = []
+    if baseline is None:
+        return regressions
+    if result["throughput"] < baseline["throughput"] * (1 - tolerance):
+        regressions.append("throughput {0} < {1}".format(
+            result["throughput"], baseline["throughput"]))
+    if baseline["p99_ms"] >= MIN_FLAGGED_LATENCY and \
+            result["p99_ms"] > baseline["p99_ms"] * (1 + tolerance):
+        regressions.append("p99 {0}ms > {1}ms".format(
+            result["p99_ms"], baseline["p99_ms"]))
+    return regressions
+
+
+def change(value, reference):
+    if not reference:
+        return "    new"
+    return "{0:+6.1f}%".format((value - reference) * 100.0 / reference)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="azurelib benchmarks")
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--save", action="store_true",
+                        help="store the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="allowed slowdown, as a share of the baseline")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--only", nargs="*",
+                        help="names (or name prefixes) of benchmarks to run")
+    args = parser.parse_args(argv)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as stream:
+            baseline = json.load(stream)
+
+    results = {}
+    failed = False
+    print("{0:28} {1:>14} {2:>8} {3:>10} {4:>10} {5:>8}".format(
+        "benchmark", "throughput", "", "p50 ms", "p99 ms", "vs base"))
+    for name, benchmark in BENCHMARKS:
+        if args.only and not any(name.startswith(only)
+                                 for only in args.only):
+            continue
+        result = results[name] = measure(benchmark, args.repeat)
+        reference = baseline.get(name)
+        regressions = compare(name, result, reference, args.tolerance)
+        print("{0:28} {1:>14} {2:<8} {3:>10} {4:>10} {5:>8} {6}".format(
+            name, result["throughput"], result["unit"], result["p50_ms"],
+            result["p99_ms"],
+            change(result["throughput"],
+                   reference and reference["throughput"]),
+            "REGRESSION: " + ", ".join(regressions) if regressions else ""))
+        failed = failed or bool(regressions)
+
+    if args.save:
+        baseline.update(results)
+        with open(args.baseline, "w") as stream:
+            json.dump(baseline, stream, indent=2, sort_keys=True)
+            stream.write("\n")
+        print("Baseline saved to " + args.baseline)
+        return 0
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,18 @@
+import unittest
+from webtest import TestApp
+
+import test_helper
+
+
+class MetricsControllerTests(unittest.TestCase):
+
+    def test_metrics(self):
+        app = TestApp(test_helper.get_app())
+        app.get('/api/series')
+        response = app.get('/metrics')
+        assert response.content_type == 'text/plain'
+        lines = response.text.splitlines()
+        assert '# TYPE http_request_seconds histogram' in lines
+        assert any(line.startswith('http_request_seconds_count{')
+                   and 'route="/api/series"' in line for line in lines)
+        assert any(line.startswith('azdashboard_cache{') for line in lines)
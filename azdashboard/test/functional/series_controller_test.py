@@ -0,0 +1,28 @@
+import json
+import time
+import unittest
+from webtest import TestApp
+
+import test_helper
+
+from azdashboard.config import environment
+
+
+class SeriesControllerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.app = TestApp(test_helper.get_app())
+        environment.series.append('depth:jobs', time.time(), 3)
+
+    def test_points_are_clamped(self):
+        response = self.app.get('/api/series/depth:jobs/sparkline'
+                                '?points=100000000&window=60')
+        assert len(json.loads(response.text)['points']) == 1
+
+    def test_invalid_windows_are_rejected(self):
+        for window in ('nan', '-5', '0', 'inf'):
+            self.app.get('/api/series/depth:jobs/sparkline?window=' + window,
+                         status=400)
+
+    def test_unknown_series(self):
+        self.app.get('/api/series/nope/sparkline', status=404)
@@ -6,4 +6,5 @@ import azdashboard
 
 
 def get_app():
-    return azdashboard.AzDashboard(template_path='../../app/views/').app
+    return azdashboard.AzDashboard(template_path='../../app/views/',
+                                   sample=False).app
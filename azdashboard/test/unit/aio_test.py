@@ -0,0 +1,130 @@
+import asyncio
+import unittest
+
+import test_helper
+
+from azdashboard.lib.azurelib.aio import AzAsyncConnection
+from azdashboard.lib.azurelib.core.errors import AzureException
+from azdashboard.lib.azurelib.core.retry import FixedRetry, NoRetry
+from azdashboard.lib.azurelib.fake import fake_services
+
+
+class AzAsyncConnectionTests(unittest.TestCase):
+
+    def connect(self, **kwargs):
+        kwargs.setdefault("services", fake_services())
+        return AzAsyncConnection("test", "key", pool_size=4, **kwargs)
+
+    def test_round_trip_on_the_injected_services(self):
+        az = self.connect()
+        queue = az.queue("work")
+
+        async def scenario():
+            await queue.create()
+            await asyncio.gather(*[queue.push(str(i)) for i in range(10)])
+            assert await queue.size() == 10
+            messages = await queue.pop_messages(blocking=False)
+            return sorted(msg["message_text"] for msg in messages)
+
+        texts = asyncio.run(scenario())
+        az.close()
+        assert texts == sorted(str(i).encode() for i in range(10))
+
+    def test_registry_is_forwarded(self):
+        services = fake_services()
+        az = self.connect(services=services, registry_ttl=300)
+        queue = az.queue("work")
+
+        async def scenario():
+            await queue.ensure_created()
+            await queue.ensure_created()
+
+        asyncio.run(scenario())
+        az.close()
+        assert services["queue"].calls["create_queue"] == 1
+
+    def test_breaker_is_forwarded(self):
+        az = self.connect(services=fake_services(error_rate=1),
+                          breaker={"min_calls": 2})
+        queue = az.queue("work")
+
+        async def scenario():
+            for i in range(2):
+                with self.assertRaises(Exception):
+                    await queue.size(retry_policy=NoRetry())
+
+        asyncio.run(scenario())
+        assert az.breakers() == {"queue": "open"}
+        az.close()
+
+    def test_retries_wait_on_the_event_loop(self):
+        services = fake_services()
+        services["queue"].create_queue("work")
+        services["queue"].faults.error_rate = 1
+        az = self.connect(services=services)
+        queue = az.queue("work")
+
+        async def recover():
+            await asyncio.sleep(0.1)
+            services["queue"].faults.error_rate = 0
+
+        async def scenario():
+            size = asyncio.ensure_future(
+                queue.size(retry_policy=FixedRetry(retries=20,
+                                                   interval=0.05)))
+            await recover()
+            return await size
+
+        assert asyncio.run(scenario()) == 0
+        az.close()
+        assert services["queue"].calls["get_queue_metadata"] > 1
+
+    def test_retries_are_bounded_by_the_policy(self):
+        services = fake_services(error_rate=1)
+        az = self.connect(services=services)
+        queue = az.queue("work")
+
+        async def scenario():
+            with self.assertRaises(AzureException):
+                await queue.size(retry_policy=FixedRetry(retries=2,
+                                                         interval=0.01))
+
+        asyncio.run(scenario())
+        az.close()
+        assert services["queue"].calls["get_queue_metadata"] == 3
+
+    def test_iterates_over_queries(self):
+        az = self.connect()
+        table = az.table("rows")
+        table.set_partition("p")
+
+        async def scenario():
+            await table.create()
+            await table.upsert_many([{"RowKey": "%03d" % i}
+                                     for i in range(250)])
+            rows = [row["RowKey"] async for row
+                    in table.iter_query(None, ["RowKey"], top=100)]
+            scanned = [row["RowKey"] async for row
+                       in table.scan(["p"], ["RowKey"])]
+            return rows, scanned
+
+        rows, scanned = asyncio.run(scenario())
+        az.close()
+        assert rows == ["%03d" % i for i in range(250)]
+        assert sorted(scanned) == rows
+
+    def test_pipelined_pops(self):
+        az = self.connect()
+        queue = az.queue("work")
+
+        async def scenario():
+            await queue.create()
+            for i in range(5):
+                await queue.push(str(i))
+            messages = await queue.pop_messages(blocking=False,
+                                                pipelined=True)
+            assert await queue.flush_deletes()
+            return len(messages), await queue.size()
+
+        assert asyncio.run(scenario()) == (5, 0)
+        az.close()
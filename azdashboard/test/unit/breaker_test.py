@@ -0,0 +1,132 @@
+import copy
+import unittest
+from threading import Event, Thread
+from time import sleep, time
+
+import test_helper
+
+from azdashboard.lib.azurelib.core.breaker import (
+    CLOSED,
+    HALF_OPEN,
+    OPEN,
+    AzGuard,
+    CircuitBreaker
+)
+from azdashboard.lib.azurelib.core.connection import AzConnection
+from azdashboard.lib.azurelib.fake import fake_services
+
+
+class CircuitBreakerTests(unittest.TestCase):
+
+    def test_opens_on_error_rate(self):
+        breaker = CircuitBreaker(error_rate=0.5, min_calls=4)
+        for success in [True, False, True, False]:
+            assert breaker.allow()
+            breaker.record(success)
+        assert breaker.state == OPEN
+        assert not breaker.allow()
+
+    def test_half_open_probe_closes(self):
+        breaker = CircuitBreaker(min_calls=1, open_timeout=0.05)
+        breaker.record(False)
+        sleep(0.1)
+        assert breaker.state == HALF_OPEN
+        assert breaker.allow()
+        assert not breaker.allow()
+        breaker.record(True)
+        assert breaker.state == CLOSED
+
+    def test_failed_probe_reopens(self):
+        breaker = CircuitBreaker(min_calls=1, open_timeout=0.05)
+        breaker.record(False)
+        sleep(0.1)
+        assert breaker.allow()
+        breaker.record(False)
+        assert breaker.state == OPEN
+
+    def test_interrupted_probe_is_given_back(self):
+        breaker = CircuitBreaker(min_calls=1, open_timeout=0.05)
+        breaker.record(False)
+        sleep(0.1)
+        guard = AzGuard(breaker)
+
+        def interrupted():
+            raise KeyboardInterrupt()
+        self.assertRaises(KeyboardInterrupt, guard.call, interrupted)
+        assert breaker.state == HALF_OPEN
+        assert guard.call(lambda: 1) == 1
+        assert breaker.state == CLOSED
+
+    def test_late_closed_calls_are_not_probes(self):
+        breaker = CircuitBreaker(min_calls=2, open_timeout=0.05)
+        late = breaker.allow()
+        breaker.record(False)
+        breaker.record(False)
+        assert breaker.state == OPEN
+        sleep(0.1)
+        probe = breaker.allow()
+        # the call admitted while closed ends during the probe
+        breaker.record(True, late)
+        breaker.record(False, late)
+        assert breaker.state == HALF_OPEN
+        assert not breaker.allow()
+        breaker.record(True, probe)
+        assert breaker.state == CLOSED
+
+    def test_stale_probes_are_ignored(self):
+        breaker = CircuitBreaker(min_calls=1, open_timeout=0.05, probes=2)
+        breaker.record(False)
+        sleep(0.1)
+        stale = breaker.allow()
+        breaker.record(False, breaker.allow())
+        sleep(0.1)
+        probe = breaker.allow()
+        breaker.record(True, stale)
+        breaker.cancel(stale)
+        assert breaker.allow()
+        assert not breaker.allow()
+        breaker.record(True, probe)
+        assert breaker.state == HALF_OPEN
+
+
+class AzGuardTests(unittest.TestCase):
+
+    def test_bulkhead_only_guards_round_trips(self):
+        az = AzConnection("test", "key", services=fake_services(),
+                          max_concurrent=1)
+        queue = az.queue("guarded")
+        queue.create()
+        stopped = Event()
+        consumer = Thread(target=queue.get_messages, kwargs={
+            "exit_handler": lambda: not stopped.is_set()})
+        consumer.start()
+        try:
+            sleep(0.1)
+            started = time()
+            assert queue.size() == 0
+            assert time() - started < 1
+        finally:
+            stopped.set()
+            consumer.join()
+
+    def test_batch_writes_on_a_guarded_connection(self):
+        services = fake_services()
+        az = AzConnection("test", "key", services=services, breaker={},
+                          max_concurrent=4)
+        table = az.table("guarded")
+        table.create()
+        table.set_partition("p")
+        results = table.upsert_many([{"RowKey": str(i)} for i in range(250)])
+        assert results == [True] * 250
+        assert len(table.query(None, ["RowKey"])) == 250
+        # one round trip through the guard per batch
+        assert services["table"].calls["commit_batch"] == 3
+
+    def test_guarded_services_can_be_copied(self):
+        az = AzConnection("test", "key", services=fake_services(),
+                          max_concurrent=4)
+        service = az.table("guarded").get_service()
+        clone = copy.copy(service)
+        assert clone is not service
+        assert clone._az_guard is service._az_guard
+        assert clone._az_service is not service._az_service
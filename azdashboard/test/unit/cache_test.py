@@ -0,0 +1,72 @@
+import unittest
+from time import sleep
+
+import test_helper
+
+from azdashboard.lib.azurelib.core.cache import TTLCache
+
+
+class TTLCacheTests(unittest.TestCase):
+
+    def test_hit_and_miss(self):
+        cache = TTLCache(ttl=60)
+        assert cache.get("a", lambda: 1) == 1
+        assert cache.get("a", lambda: 2) == 1
+        assert cache.stats()["hits"] == 1
+        assert cache.stats()["misses"] == 1
+
+    def test_lru_eviction(self):
+        evicted = []
+        cache = TTLCache(max_size=2, ttl=60, on_evict=evicted.append)
+        cache.get("a", lambda: 1)
+        cache.get("b", lambda: 2)
+        cache.get("a", lambda: 1)
+        cache.get("c", lambda: 3)
+        assert evicted == ["b"]
+        assert cache.peek("a") is not None
+
+    def test_stale_while_revalidate(self):
+        cache = TTLCache(ttl=0, stale=60)
+        cache.get("a", lambda: 1)
+        assert cache.get("a", lambda: 2) == 1
+        sleep(0.1)
+        assert cache.peek("a")[0] == 2
+        assert cache.stats()["stale_hits"] == 1
+
+    def test_load_racing_a_pop_is_not_stored(self):
+        cache = TTLCache(ttl=60)
+
+        def loader():
+            cache.pop("a")
+            return "old"
+
+        assert cache.get("a", loader) == "old"
+        assert cache.peek("a") is None
+
+    def test_load_racing_a_pop_of_another_key_is_stored(self):
+        cache = TTLCache(ttl=60)
+
+        def loader():
+            cache.pop("b")
+            return "new"
+
+        assert cache.get("a", loader) == "new"
+        assert cache.peek("a")[0] == "new"
+
+    def test_load_racing_a_clear_is_not_stored(self):
+        cache = TTLCache(ttl=60)
+
+        def loader():
+            cache.clear()
+            return "old"
+
+        assert cache.get("a", loader) == "old"
+        assert cache.peek("a") is None
+        assert not cache._loads
+
+    def test_ttl_per_value(self):
+        cache = TTLCache(ttl=60)
+        cache.get("a", lambda: None, ttl=lambda value: 0)
+        cache.get("b", lambda: 1, ttl=lambda value: None)
+        assert cache.get("a", lambda: 2) == 2
+        assert cache.get("b", lambda: 2) == 1
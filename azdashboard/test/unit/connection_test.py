@@ -0,0 +1,44 @@
+import unittest
+
+import test_helper
+
+from azdashboard.lib.azurelib.core.connection import AzConnection
+from azdashboard.lib.azurelib.fake import fake_services
+
+
+class Session(object):
+
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class AzConnectionTests(unittest.TestCase):
+
+    def test_entities_share_one_service_per_kind(self):
+        services = fake_services()
+        az = AzConnection("test", "key", services=services)
+        first, second = az.queue("first"), az.queue("second")
+        assert first.get_service() is services["queue"]
+        assert second.get_service() is first.get_service()
+        assert az.table("t").get_service() is not first.get_service()
+
+    def test_sessions_are_pooled(self):
+        az = AzConnection("test", "key", pool_size=7)
+        adapter = az._session().get_adapter("https://account")
+        assert adapter._pool_maxsize == 7
+        assert adapter._pool_connections == 7
+
+    def test_close_closes_the_sessions(self):
+        services = fake_services()
+        session = Session()
+        services["queue"]._httpclient.request_session = session
+        az = AzConnection("test", "key", services=services)
+        az.queue("work").create()
+        az.close()
+        assert session.closed
+        assert not az._services
+        # services are created again on next use
+        assert az.queue("work").exists()
@@ -0,0 +1,92 @@
+import time
+import unittest
+
+import test_helper
+
+from azdashboard.lib.azurelib.consumer import AzQueueConsumer
+from azdashboard.lib.azurelib.core.connection import AzConnection
+from azdashboard.lib.azurelib.fake import fake_services
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+class AzQueueConsumerTests(unittest.TestCase):
+
+    def setUp(self):
+        az = AzConnection("test", "key", services=fake_services())
+        self.queue = az.queue("work")
+        self.poison = az.queue("workpoison")
+        for queue in (self.queue, self.poison):
+            queue.create()
+
+    def consume(self, handler, condition, **kwargs):
+        consumer = AzQueueConsumer(self.queue, handler, max_idle=0.05,
+                                   **kwargs)
+        consumer.start()
+        try:
+            assert wait_until(lambda: condition(consumer.stats()))
+        finally:
+            consumer.stop()
+        return consumer.stats()
+
+    def test_handled_messages_are_deleted(self):
+        for i in range(20):
+            self.queue.push(str(i))
+        handled = []
+        self.consume(lambda msg: handled.append(msg["message_text"]),
+                     lambda stats: stats["processed"] == 20)
+        assert sorted(handled) == sorted(str(i).encode() for i in range(20))
+        assert self.queue.size() == 0
+
+    def test_failed_deletes_are_counted(self):
+        self.queue.push("expiring")
+
+        def handler(msg):
+            msg["pop_receipt"] = "expired"
+        stats = self.consume(handler,
+                             lambda stats: stats["delete_failed"] == 1)
+        assert stats["processed"] == 0
+
+    def test_poison_messages_are_moved(self):
+        self.queue.push("poison")
+
+        def handler(msg):
+            raise ValueError("always fails")
+        stats = self.consume(handler, lambda stats: stats["poisoned"] == 1,
+                             visibility_timeout=0.1, max_dequeue=2,
+                             poison_queue=self.poison)
+        assert stats["failed"] == 2
+        assert self.queue.size() == 0
+        assert self.poison.pop_messages(blocking=False)[0]["message_text"] \
+            == b"poison"
+
+    def test_stop_before_start(self):
+        AzQueueConsumer(self.queue, lambda msg: None).stop()
+
+    def test_receive_errors_are_logged(self):
+        missing = AzConnection("test", "key",
+                               services=fake_services()).queue("missing")
+        consumer = AzQueueConsumer(missing, lambda msg: None, max_idle=0.05)
+        with self.assertLogs("azdashboard.lib.azurelib.consumer",
+                             "WARNING") as logs:
+            consumer.start()
+            time.sleep(0.2)
+            consumer.stop()
+        assert "could not receive messages from missing" in logs.output[0]
+
+    def test_long_handlers_keep_their_lease(self):
+        self.queue.push("slow")
+        handled = []
+
+        def handler(msg):
+            handled.append(msg["message_text"])
+            time.sleep(0.5)
+        stats = self.consume(handler, lambda stats: stats["processed"] == 1,
+                             visibility_timeout=0.3)
+        assert stats["renewed"] >= 1
+        assert handled == [b"slow"]
@@ -0,0 +1,76 @@
+import unittest
+
+import test_helper
+
+from azdashboard.lib.azurelib.core.connection import AzConnection
+from azdashboard.lib.azurelib.core.errors import AzureException
+from azdashboard.lib.azurelib.core.retry import NoRetry
+from azdashboard.lib.azurelib.fake import fake_services
+
+
+class FakeQueueTests(unittest.TestCase):
+
+    def setUp(self):
+        self.az = AzConnection("test", "key", services=fake_services())
+        self.queue = self.az.queue("fakequeue")
+        self.queue.create()
+
+    def test_push_and_pop(self):
+        self.queue.push('{"a": 1}')
+        assert self.queue.size() == 1
+        messages = self.queue.pop_messages(blocking=False)
+        assert messages[0]["message_text"] == b'{"a": 1}'
+        assert self.queue.size() == 0
+
+    def test_packed_round_trip(self):
+        for i in range(100):
+            self.queue.push_packed({"i": i})
+        self.queue.flush()
+        messages = self.queue.unpack_messages(
+            self.queue.pop_messages(blocking=False))
+        assert [msg["i"] for msg in messages] == list(range(100))
+
+    def test_injected_errors(self):
+        self.queue.get_service().faults.error_rate = 1
+        self.assertRaises(AzureException, self.queue.size,
+                          retry_policy=NoRetry())
+
+
+class FakeTableTests(unittest.TestCase):
+
+    def setUp(self):
+        self.az = AzConnection("test", "key", services=fake_services())
+        self.table = self.az.table("faketable")
+        self.table.create()
+
+    def test_query_follows_continuations(self):
+        self.table.upsert_many([{"PartitionKey": "p", "RowKey": "%04d" % i,
+                                 "value": i} for i in range(250)])
+        entities = self.table.query("value ge 100 and value lt 200",
+                                    ["value"], top=30)
+        assert [entity["value"] for entity in entities] == \
+            list(range(100, 200))
+
+    def test_failed_batch_changes_nothing(self):
+        self.table.insert({"PartitionKey": "p", "RowKey": "2"})
+        results = self.table.insert_many(
+            [{"PartitionKey": "p", "RowKey": str(i)} for i in range(4)])
+        assert results[0] is True and results[3] is True
+        assert isinstance(results[2], AzureException)
+        rows = [entity["RowKey"] for entity in self.table.query(None, [])]
+        assert rows == ["0", "1", "2", "3"]
+
+
+class FakeBlobTests(unittest.TestCase):
+
+    def test_block_upload_and_ranged_read(self):
+        service = fake_services()["blob"]
+        service.create_container("c")
+        service.put_block("c", "b", b"hello ", "MA==")
+        service.put_block("c", "b", b"world", "MQ==")
+        service.put_block_list("c", "b", ["MA==", "MQ=="])
+        assert service.get_blob("c", "b") == b"hello world"
+        assert service.get_blob("c", "b", x_ms_range="bytes=6-10") == \
+            b"world"
+        assert service.get_blob_properties("c", "b")["content-length"] == \
+            "11"
@@ -0,0 +1,75 @@
+import unittest
+
+import test_helper
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from azdashboard.app.helpers.history_helper import (
+    DAY,
+    HOUR,
+    MINUTE,
+    HistoryRecorder,
+    history,
+    resolution_for
+)
+from azdashboard.app.models import Base
+from azdashboard.app.models.queue_sample import QueueRollup, QueueSample
+
+START = 1500000000 - 1500000000 % DAY
+
+
+class HistoryTests(unittest.TestCase):
+
+    def setUp(self):
+        engine = create_engine('sqlite:///:memory:')
+        Base.metadata.create_all(engine)
+        self.session = sessionmaker(bind=engine)
+        self.recorder = HistoryRecorder(self.session)
+
+    def record(self, seconds, interval=10):
+        for offset in range(0, seconds, interval):
+            self.recorder.record(START + offset, {'a': offset // interval,
+                                                  'b': 1})
+
+    def test_samples_are_rolled_up(self):
+        self.record(2 * HOUR + MINUTE)
+        db = self.session()
+        minutes = QueueRollup.between(db, MINUTE, 'a', START, START + HOUR)
+        assert len(minutes) == 60
+        assert (minutes[1].samples, minutes[1].minimum,
+                minutes[1].maximum, minutes[1].total) == (6, 6, 11, 51)
+        hours = QueueRollup.between(db, HOUR, 'a', START, START + DAY)
+        assert [(hour.samples, hour.minimum, hour.maximum)
+                for hour in hours] == [(360, 0, 359), (360, 360, 719)]
+        assert QueueRollup.between(db, DAY, 'a', START, START + DAY) == []
+
+    def test_expired_history_is_pruned(self):
+        self.recorder.retention = {0: HOUR, MINUTE: DAY}
+        self.record(2 * HOUR)
+        db = self.session()
+        first = db.query(QueueSample.timestamp).order_by(
+            QueueSample.timestamp).first()[0]
+        assert first >= START + HOUR - MINUTE
+        assert len(QueueRollup.between(db, MINUTE, 'b', START,
+                                       START + DAY)) == 119
+
+    def test_smallest_adequate_resolution(self):
+        now = START + 30 * DAY
+        assert resolution_for(now - HOUR, now, 10, now=now) == 0
+        assert resolution_for(now - HOUR, now, 5, now=now) == MINUTE
+        assert resolution_for(now - 6 * HOUR, now, 5, now=now) == MINUTE
+        assert resolution_for(now - 3 * DAY, now, 5, now=now) == HOUR
+        assert resolution_for(now - 20 * DAY, now, 5, max_points=5000,
+                              now=now) == HOUR
+        assert resolution_for(now - 1000 * DAY, now, 5, now=now) == DAY
+
+    def test_history_of_a_range(self):
+        self.record(2 * HOUR)
+        db = self.session()
+        data = history(db, 'a', START, START + 2 * HOUR, 10, max_points=200,
+                       now=START + 2 * HOUR)
+        assert data['resolution'] == MINUTE
+        assert len(data['points']) == 119
+        assert data['points'][0] == {'t': START, 'min': 0, 'max': 5,
+                                     'avg': 2.5}
@@ -0,0 +1,50 @@
+import unittest
+
+import test_helper
+
+from azdashboard.lib.azurelib.core.connection import AzConnection
+from azdashboard.lib.azurelib.core.metrics import MetricsRegistry, registry
+from azdashboard.lib.azurelib.fake import fake_services
+
+
+class MetricsRegistryTests(unittest.TestCase):
+
+    def test_renders_counters_and_gauges(self):
+        metrics = MetricsRegistry()
+        metrics.describe("jobs_total", "counter", "Jobs done")
+        metrics.inc("jobs_total", {"queue": "a"})
+        metrics.inc("jobs_total", {"queue": "a"}, 2)
+        metrics.set("depth", {"queue": 'say "hi"\n'}, 4)
+        assert metrics.render() == (
+            "# TYPE depth untyped\n"
+            'depth{queue="say \\"hi\\"\\n"} 4\n'
+            "# HELP jobs_total Jobs done\n"
+            "# TYPE jobs_total counter\n"
+            'jobs_total{queue="a"} 3\n')
+
+    def test_renders_cumulative_histograms(self):
+        metrics = MetricsRegistry()
+        metrics.describe("latency", "histogram")
+        for value in (0.001, 0.02, 100):
+            metrics.observe("latency", None, value)
+        lines = metrics.render().splitlines()
+        assert 'latency_bucket{le="0.005"} 1' in lines
+        assert 'latency_bucket{le="0.025"} 2' in lines
+        assert 'latency_bucket{le="60.0"} 2' in lines
+        assert 'latency_bucket{le="+Inf"} 3' in lines
+        assert "latency_count 3" in lines
+        assert metrics.totals("latency") == [({}, 3, 100.021)]
+
+    def test_azure_calls_are_timed(self):
+        az = AzConnection("test", "key", services=fake_services())
+        queue = az.queue("timed")
+        queue.create()
+
+        def calls():
+            return sum(count for labels, count, total
+                       in registry.totals("azurelib_call_seconds")
+                       if labels.get("kind") == "AzQueue")
+
+        before = calls()
+        queue.size()
+        assert calls() == before + 1
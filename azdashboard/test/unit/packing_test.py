@@ -0,0 +1,73 @@
+import base64
+import unittest
+from time import sleep
+
+import test_helper
+
+from azdashboard.lib.azurelib.core.flusher import flusher
+from azdashboard.lib.azurelib.packing import PackingBuffer, unpack
+
+
+class PackingBufferTests(unittest.TestCase):
+
+    def pack(self, messages, **kwargs):
+        sent = []
+        buf = PackingBuffer(sent.append, max_age=None, **kwargs)
+        for msg in messages:
+            buf.add(msg)
+        buf.close()
+        return sent
+
+    def test_batches_fit_max_size(self):
+        messages = [{"i": i} for i in range(50)]
+        sent = self.pack(messages, max_size=100)
+        assert all(len(base64.b64encode(batch)) <= 100 for batch in sent)
+        assert [msg for batch in sent for msg in unpack(batch)] == messages
+
+    def test_compressed_round_trip(self):
+        messages = [{"i": i, "text": "lorem ipsum " * 20} for i in range(500)]
+        plain = self.pack(messages)
+        packed = self.pack(messages, compress=True)
+        assert len(packed) < len(plain)
+        assert all(len(base64.b64encode(batch)) <= 64 * 1024
+                   for batch in packed)
+        assert [msg for batch in packed for msg in unpack(batch)] == messages
+
+    def test_unpacks_legacy_format(self):
+        assert unpack('[{"i": 1}]') == [{"i": 1}]
+
+    def test_flushes_by_age(self):
+        sent = []
+        with PackingBuffer(sent.append, max_size=1000, max_age=0.1) as buf:
+            buf.add({"i": 1})
+            buf.add({"i": 2})
+            sleep(0.3)
+            assert len(sent) >= 1
+        assert len(buf) == 0
+
+    def test_idle_buffers_are_not_watched(self):
+        sent = []
+        buf = PackingBuffer(sent.append, max_age=0.1)
+        assert not flusher.watching(buf)
+        buf.add({"i": 1})
+        assert flusher.watching(buf)
+        buf.flush()
+        assert not flusher.watching(buf)
+
+    def test_background_flush_errors_are_counted(self):
+        sent = []
+
+        def send(payload):
+            if not sent:
+                sent.append(None)
+                raise ValueError("down")
+            sent.append(payload)
+
+        errors = flusher.errors
+        buf = PackingBuffer(send, max_age=0.05)
+        buf.add({"i": 1})
+        sleep(0.3)
+        assert flusher.errors > errors
+        assert unpack(sent[-1]) == [{"i": 1}]
+        assert buf.error is None
+        assert not flusher.watching(buf)
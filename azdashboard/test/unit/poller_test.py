@@ -0,0 +1,77 @@
+import threading
+import time
+import unittest
+
+import test_helper
+
+from azdashboard.lib.azurelib.core.connection import AzConnection
+from azdashboard.lib.azurelib.fake import fake_services
+from azdashboard.lib.azurelib.poller import AzQueuePoller
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+class AzQueuePollerTests(unittest.TestCase):
+
+    def setUp(self):
+        az = AzConnection("test", "key", services=fake_services())
+        self.jobs = az.queue("jobs")
+        self.mails = az.queue("mails")
+        for queue in (self.jobs, self.mails):
+            queue.create()
+        self.received = {"jobs": 0, "mails": 0}
+        self.lock = threading.Lock()
+
+    def count(self, queue, messages):
+        with self.lock:
+            self.received[queue.get_name()] += len(messages)
+        for message in messages:
+            queue.delete_message(message)
+
+    def test_handler_errors_do_not_stop_polling(self):
+        def handler(queue, messages):
+            if queue is self.jobs:
+                raise ValueError("broken handler")
+            self.count(queue, messages)
+
+        poller = AzQueuePoller(handler, min_interval=0.01, max_interval=0.05)
+        poller.add(self.jobs)
+        poller.add(self.mails)
+        self.jobs.push("job")
+        poller.start()
+        try:
+            assert wait_until(lambda: poller.errors >= 1)
+            self.mails.push("mail")
+            assert wait_until(lambda: self.received["mails"] == 1)
+        finally:
+            poller.stop()
+        assert isinstance(poller.error, ValueError)
+
+    def test_slow_handler_does_not_delay_other_queues(self):
+        release = threading.Event()
+
+        def handler(queue, messages):
+            if queue is self.jobs:
+                release.wait(5)
+            self.count(queue, messages)
+
+        poller = AzQueuePoller(handler, min_interval=0.01, max_interval=0.05)
+        poller.add(self.jobs)
+        poller.add(self.mails)
+        self.jobs.push("job")
+        poller.start()
+        try:
+            time.sleep(0.1)
+            self.mails.push("mail")
+            assert wait_until(lambda: self.received["mails"] == 1)
+            assert self.received["jobs"] == 0
+            release.set()
+            assert wait_until(lambda: self.received["jobs"] == 1)
+        finally:
+            release.set()
+            poller.stop()
@@ -0,0 +1,64 @@
+import unittest
+from threading import Event
+
+import test_helper
+
+from azdashboard.lib.azurelib.core.connection import AzConnection
+from azdashboard.lib.azurelib.core.prefetch import prefetch
+from azdashboard.lib.azurelib.fake import fake_services
+
+
+class PrefetchTests(unittest.TestCase):
+
+    def test_yields_every_item_in_order(self):
+        assert list(prefetch(iter(range(100)), depth=3)) == list(range(100))
+
+    def test_errors_reach_the_consumer(self):
+        def pages():
+            yield 1
+            raise ValueError("page 2")
+
+        items = prefetch(pages())
+        assert next(items) == 1
+        self.assertRaises(ValueError, next, items)
+
+    def test_closing_stops_the_producer(self):
+        produced = []
+        finished = Event()
+
+        def pages():
+            try:
+                for i in range(1000):
+                    produced.append(i)
+                    yield i
+            finally:
+                finished.set()
+
+        items = prefetch(pages(), depth=1)
+        assert next(items) == 0
+        items.close()
+        assert finished.wait(2)
+        assert len(produced) < 10
+
+
+class IterQueryTests(unittest.TestCase):
+
+    def setUp(self):
+        az = AzConnection("test", "key", services=fake_services())
+        self.table = az.table("entities")
+        self.table.create()
+        self.table.set_partition("p")
+        for i in range(25):
+            self.table.insert({"RowKey": "{0:02d}".format(i), "i": i})
+        self.calls = self.table.get_service().calls
+
+    def test_streams_every_page(self):
+        entities = list(self.table.iter_query(None, ["i"], top=10))
+        assert [entity["i"] for entity in entities] == list(range(25))
+        assert self.calls["query_entities"] == 3
+
+    def test_limit_stops_paging(self):
+        entities = list(self.table.iter_query(None, ["i"], top=10, limit=5,
+                                              prefetch=False))
+        assert len(entities) == 5
+        assert self.calls["query_entities"] == 1
@@ -0,0 +1,76 @@
+import threading
+import unittest
+
+import test_helper
+
+from azdashboard.lib.azurelib.core.connection import AzConnection
+from azdashboard.lib.azurelib.fake import fake_services
+
+
+class DeletePipelineTests(unittest.TestCase):
+
+    def setUp(self):
+        az = AzConnection("test", "key", services=fake_services())
+        self.queue = az.queue("deletes")
+        self.queue.create()
+        for i in range(10):
+            self.queue.push(str(i))
+
+    def test_flush_acknowledges_deletes(self):
+        messages = self.queue.pop_messages(blocking=False, pipelined=True)
+        assert len(messages) == 10
+        assert self.queue.flush_deletes()
+        assert self.queue.size() == 0
+
+    def test_failed_deletes_are_reported(self):
+        messages = self.queue.get_messages(blocking=False)
+        deletes = self.queue.delete_pipeline()
+        messages[3]["pop_receipt"] = "expired"
+        for message in messages:
+            deletes.submit(message)
+        assert not self.queue.flush_deletes()
+        assert [message for message, _ in deletes.failed] == [messages[3]]
+        assert deletes.acknowledged == 10
+        # reported once
+        assert self.queue.flush_deletes()
+
+    def test_close_reports_failed_deletes(self):
+        messages = self.queue.get_messages(blocking=False)
+        deletes = self.queue.delete_pipeline()
+        messages[0]["pop_receipt"] = "expired"
+        for message in messages:
+            deletes.submit(message)
+        assert not self.queue.close()
+        assert self.queue.close()
+
+
+class SizesTests(unittest.TestCase):
+
+    def setUp(self):
+        self.services = fake_services()
+        az = AzConnection("test", "key", services=self.services)
+        for name in ("jobs1", "jobs2", "other"):
+            queue = az.queue(name)
+            queue.create()
+            queue.push("x")
+        self.queue = az.queue()
+
+    def test_sizes_of_prefixed_queues(self):
+        assert self.queue.sizes(prefix="jobs") == {
+            "queues": [{"name": "jobs1", "size": 1},
+                       {"name": "jobs2", "size": 1}],
+            "partial": False}
+
+    def test_late_queues_make_a_partial_answer(self):
+        self.services["queue"].faults.latency = 0.2
+        result = self.queue.sizes(timeout=0.05)
+        assert result["partial"]
+        assert [queue["size"] for queue in result["queues"]] == \
+            [None, None, None]
+
+    def test_threads_are_reused(self):
+        for i in range(10):
+            self.queue.sizes(workers=3)
+        threads = [thread for thread in threading.enumerate()
+                   if thread.name.startswith("azqueue-sizes-3_")]
+        assert 0 < len(threads) <= 3
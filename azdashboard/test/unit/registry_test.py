@@ -0,0 +1,75 @@
+import unittest
+
+import test_helper
+
+from azdashboard.lib.azurelib.core.connection import AzConnection
+from azdashboard.lib.azurelib.core.registry import ResourceRegistry
+from azdashboard.lib.azurelib.fake import fake_services
+
+
+class ResourceRegistryTests(unittest.TestCase):
+
+    def test_answers_expire(self):
+        registry = ResourceRegistry(ttl=0)
+        registry.record("queue", "q")
+        assert registry.known("queue", "q") is None
+
+    def test_ensure_creates_once(self):
+        registry = ResourceRegistry()
+        created = []
+        for _ in range(3):
+            registry.ensure("queue", "q", lambda: created.append(1))
+        assert created == [1]
+        assert registry.known("queue", "q") is True
+        assert not registry._creating
+
+
+class RegisteredEntityTests(unittest.TestCase):
+
+    def setUp(self):
+        self.az = AzConnection("test", "key", services=fake_services())
+
+    def test_exists_is_answered_from_memory(self):
+        queue = self.az.queue("registered")
+        calls = queue.get_service().calls
+        assert not queue.exists()
+        assert not queue.exists()
+        assert calls["list_queues"] == 1
+        queue.ensure_created()
+        queue.ensure_created()
+        assert calls["create_queue"] == 1
+        assert self.az.queue("registered").exists()
+        assert calls["list_queues"] == 1
+
+    def test_exists_matches_exact_queue_name(self):
+        self.az.queue("registered2").create()
+        assert not self.az.queue("registered").exists()
+
+    def test_delete_invalidates(self):
+        table = self.az.table("registered")
+        table.ensure_created()
+        assert table.exists()
+        table.delete()
+        assert not table.exists()
+        table.ensure_created()
+        assert table.get_service().calls["create_table"] == 2
+
+    def test_container_delete_invalidates(self):
+        container = self.az.container("registered")
+        container.ensure_created()
+        container.delete_container("registered")
+        assert not container.exists()
+
+    def test_container_delete_invalidates_the_selected_name(self):
+        container = self.az.container("my_registered")
+        container.ensure_created()
+        container.delete_container("my_registered")
+        assert not container.exists()
+
+    def test_disabled_registry_asks_the_service(self):
+        az = AzConnection("test", "key", services=fake_services(),
+                          registry_ttl=0)
+        queue = az.queue("registered")
+        queue.exists()
+        queue.exists()
+        assert queue.get_service().calls["list_queues"] == 2
@@ -0,0 +1,58 @@
+import unittest
+
+import test_helper
+
+from azure.common import AzureHttpError
+
+from azdashboard.lib.azurelib.core.errhandlers import azure_error
+from azdashboard.lib.azurelib.core.errors import AzureException
+from azdashboard.lib.azurelib.core.retry import ExponentialBackoff, NoRetry
+
+
+class Flaky(object):
+
+    def __init__(self, failures, status_code=503):
+        self.calls = 0
+        self.failures = failures
+        self.status_code = status_code
+
+    @azure_error(policy=ExponentialBackoff(retries=3, base=0.001))
+    def call(self):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise AzureHttpError("busy", self.status_code)
+        return True
+
+
+class RetryTests(unittest.TestCase):
+
+    def test_retries_throttling(self):
+        flaky = Flaky(2)
+        assert flaky.call()
+        assert flaky.calls == 3
+
+    def test_gives_up_after_retries(self):
+        flaky = Flaky(10)
+        self.assertRaises(AzureException, flaky.call)
+        assert flaky.calls == 4
+
+    def test_does_not_retry_client_errors(self):
+        flaky = Flaky(1, status_code=400)
+        self.assertRaises(AzureException, flaky.call)
+        assert flaky.calls == 1
+
+    def test_per_call_policy(self):
+        flaky = Flaky(1)
+        self.assertRaises(AzureException, flaky.call, retry_policy=NoRetry())
+        assert flaky.calls == 1
+
+    def test_deadline(self):
+        policy = ExponentialBackoff(retries=10, base=1, deadline=0.5)
+        assert policy.next_delay(1, 0.6) is None
+
+    def test_first_retry_waits_at_most_base(self):
+        policy = ExponentialBackoff(retries=5, base=0.5, cap=10,
+                                    deadline=None)
+        assert all(policy.next_delay(1, 0) <= 0.5 for _ in range(100))
+        assert all(policy.next_delay(3, 0) <= 2 for _ in range(100))
+        assert policy.next_delay(6, 0) is None
@@ -0,0 +1,53 @@
+import unittest
+
+import test_helper
+
+from azdashboard.app.helpers.sampler_helper import QueueSampler
+
+
+class QueueSamplerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.queues = [{"name": "a", "size": 1}, {"name": "b", "size": 2}]
+        self.partial = False
+        self.sampler = QueueSampler(
+            lambda: {"queues": self.queues, "partial": self.partial},
+            history=2)
+
+    def test_first_changes_are_a_snapshot(self):
+        self.sampler.sample()
+        assert self.sampler.changes(0) == (1, {"a": 1, "b": 2}, True)
+
+    def test_only_changed_depths_are_sent(self):
+        self.sampler.sample()
+        self.queues = [{"name": "a", "size": 5}, {"name": "c", "size": 0}]
+        self.sampler.sample()
+        assert self.sampler.changes(1) == \
+            (2, {"a": 5, "b": None, "c": 0}, False)
+        self.sampler.sample()
+        assert self.sampler.changes(2, timeout=0) == (2, {}, False)
+
+    def test_partial_samples_keep_unanswered_depths(self):
+        self.sampler.sample()
+        self.queues = [{"name": "a", "size": None}, {"name": "b", "size": 3}]
+        self.partial = True
+        self.sampler.sample()
+        assert self.sampler.snapshot() == (2, {"a": 1, "b": 3})
+        assert self.sampler.sizes() == {
+            "queues": [{"name": "a", "size": 1}, {"name": "b", "size": 3}],
+            "partial": True}
+
+    def test_forgotten_versions_get_a_snapshot(self):
+        for size in range(4):
+            self.queues = [{"name": "a", "size": size}]
+            self.sampler.sample()
+        assert self.sampler.changes(1) == (4, {"a": 3}, True)
+        assert self.sampler.changes(2, prefix="b") == (4, {}, False)
+
+    def test_failed_samples_are_not_ready(self):
+        def fail():
+            raise IOError("down")
+        sampler = QueueSampler(fail)
+        sampler.sample()
+        assert not sampler.ready()
+        assert isinstance(sampler.error, IOError)
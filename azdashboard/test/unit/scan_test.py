@@ -0,0 +1,71 @@
+import unittest
+from threading import Thread
+
+import test_helper
+
+from azdashboard.lib.azurelib.core.connection import AzConnection
+from azdashboard.lib.azurelib.core.prefetch import Channel
+from azdashboard.lib.azurelib.fake import fake_services
+
+
+class ChannelTests(unittest.TestCase):
+
+    def test_merges_every_producer(self):
+        channel = Channel(depth=2, producers=3)
+        for start in (0, 10, 20):
+            Thread(target=channel.feed,
+                   args=(range(start, start + 10),)).start()
+        assert sorted(channel) == list(range(30))
+
+    def test_first_error_is_raised(self):
+        def failing():
+            yield 1
+            raise ValueError("down")
+
+        channel = Channel(depth=4)
+        Thread(target=channel.feed, args=(failing(),)).start()
+        self.assertRaises(ValueError, list, channel)
+
+    def test_stop_releases_producers(self):
+        channel = Channel(depth=1)
+        producer = Thread(target=channel.feed, args=(range(100),))
+        producer.start()
+        channel.stop()
+        producer.join(2)
+        assert not producer.is_alive()
+
+
+class ScanTests(unittest.TestCase):
+
+    def setUp(self):
+        az = AzConnection("test", "key", services=fake_services())
+        self.table = az.table("scanned")
+        self.table.create()
+        self.keys = []
+        for partition in "abcdef":
+            self.table.set_partition(partition)
+            for row in range(15):
+                self.table.insert({"RowKey": "{0:02d}".format(row)})
+                self.keys.append((partition, "{0:02d}".format(row)))
+
+    def keys_of(self, entities):
+        return [(entity["PartitionKey"], entity["RowKey"])
+                for entity in entities]
+
+    def test_ordered_scan_merges_ranges_in_key_order(self):
+        ranges = [("d", None), (None, "b"), "b", "c"]
+        entities = self.table.scan(ranges, ["PartitionKey", "RowKey"],
+                                   ordered=True, top=4)
+        assert self.keys_of(entities) == self.keys
+
+    def test_unordered_scan_yields_every_entity(self):
+        ranges = [("a", "c"), ("c", "e"), ("e", None)]
+        entities = self.table.scan(ranges, ["PartitionKey", "RowKey"],
+                                   workers=2, top=4)
+        assert sorted(self.keys_of(entities)) == self.keys
+
+    def test_query_applies_within_ranges(self):
+        entities = self.table.scan(["a", "f"], ["PartitionKey", "RowKey"],
+                                   query="RowKey lt '02'", ordered=True)
+        assert self.keys_of(entities) == \
+            [("a", "00"), ("a", "01"), ("f", "00"), ("f", "01")]
@@ -0,0 +1,69 @@
+import unittest
+
+import test_helper
+
+from azdashboard.app.helpers import series_helper
+from azdashboard.app.helpers.series_helper import RingBuffer, SeriesStore
+from azdashboard.lib.azurelib.core.metrics import registry
+
+
+class RingBufferTests(unittest.TestCase):
+
+    def fill(self):
+        buffer = RingBuffer(capacity=100)
+        for second in range(250):
+            buffer.append(1000 + second, second % 10)
+        return buffer
+
+    def test_keeps_the_last_samples(self):
+        buffer = self.fill()
+        times, values = buffer.window()
+        assert len(buffer) == 100
+        assert list(times) == list(range(1150, 1250))
+        assert list(values[:3]) == [0, 1, 2]
+        times, values = buffer.window(1240, 1245)
+        assert list(times) == [1240, 1241, 1242, 1243, 1244]
+        assert buffer.nbytes() == 800
+
+    def test_downsample(self):
+        points = self.fill().downsample(4, 1150, 1250, percentile=50)
+        assert len(points) == 4
+        assert points[0] == {'t': 1150, 'min': 0, 'max': 9, 'avg': 4.0,
+                             'p': 4.0}
+        assert self.fill().downsample(10, 0, 100) == []
+
+    def test_downsample_without_numpy(self):
+        expected = self.fill().downsample(7, 1140, 1250, percentile=90)
+        numpy, series_helper.numpy = series_helper.numpy, None
+        try:
+            points = self.fill().downsample(7, 1140, 1250, percentile=90)
+        finally:
+            series_helper.numpy = numpy
+        assert len(points) == len(expected)
+        for point, other in zip(points, expected):
+            assert sorted(point) == sorted(other)
+            for name in point:
+                self.assertAlmostEqual(point[name], other[name])
+
+
+class SeriesStoreTests(unittest.TestCase):
+
+    def test_records_depths_and_latencies(self):
+        store = SeriesStore(capacity=10)
+        labels = {'kind': 'AzSeriesTest', 'operation': 'size'}
+        registry.observe('azurelib_call_seconds', labels, 0.25)
+        store.record(1000, {'a': 3})
+        registry.observe('azurelib_call_seconds', labels, 0.5)
+        registry.observe('azurelib_call_seconds', labels, 1.5)
+        store.record(1010, {'a': 4})
+        assert store.names('depth:') == ['depth:a']
+        latencies = store.downsample('latency:AzSeriesTest.size', 2,
+                                     1000, 1020)
+        assert [point['avg'] for point in latencies] == [1.0]
+        assert store.downsample('missing', 2, 1000, 1020) is None
+
+    def test_thousands_of_series_fit_in_a_few_mb(self):
+        store = SeriesStore(capacity=360)
+        for i in range(2000):
+            store.append('depth:{0}'.format(i), 1000, i)
+        assert store.nbytes() <= 6 * 1024 * 1024
@@ -0,0 +1,163 @@
+import base64
+import hashlib
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+import test_helper
+
+from azdashboard.lib.azurelib.core.connection import AzConnection
+from azdashboard.lib.azurelib.core.errors import ChecksumError
+from azdashboard.lib.azurelib.core.retry import (
+    ExponentialBackoff,
+    get_default_policy,
+    set_default_policy
+)
+from azdashboard.lib.azurelib.fake import fake_services
+
+
+class BlockUploadTests(unittest.TestCase):
+
+    def setUp(self):
+        self.az = AzConnection("test", "key", services=fake_services())
+        self.service = self.az.container("c").get_service()
+        self.service.create_container("c")
+        self.blob = self.az.blob("b")
+        self.blob.set_container("c")
+        self.data = os.urandom(10000)
+
+    def test_upload_iterable(self):
+        chunks = [self.data[i:i + 333] for i in range(0, 10000, 333)]
+        size = self.blob.upload_stream(iter(chunks), "text/plain",
+                                       block_size=1024, workers=3)
+        assert size == 10000
+        assert self.service.get_blob("c", "b") == self.data
+        assert self.service.calls["put_block"] == 10
+        properties = self.blob.get_properties()
+        assert properties["content-type"] == "text/plain"
+        assert properties["content-md5"] == base64.b64encode(
+            hashlib.md5(self.data).digest()).decode("ascii")
+
+    def test_blocks_are_retried(self):
+        policy = get_default_policy()
+        set_default_policy(ExponentialBackoff(retries=20, base=0.0001,
+                                              cap=0.001))
+        self.service.faults.error_rate = 0.3
+        try:
+            self.blob.upload_io(io.BytesIO(self.data), "text/plain")
+            self.blob.upload_stream(io.BytesIO(self.data), block_size=1000)
+        finally:
+            self.service.faults.error_rate = 0
+            set_default_policy(policy)
+        assert self.service.get_blob("c", "b") == self.data
+
+    def test_rejects_oversized_blocks(self):
+        self.assertRaises(ValueError, self.blob.upload_stream, [b"x"],
+                          block_size=5 * 1024 * 1024)
+
+
+class RangedDownloadTests(unittest.TestCase):
+
+    def setUp(self):
+        self.az = AzConnection("test", "key", services=fake_services())
+        self.service = self.az.container("c").get_service()
+        self.service.create_container("c")
+        self.blob = self.az.blob("b")
+        self.blob.set_container("c")
+        self.data = os.urandom(10000)
+        self.service.put_block_blob_from_bytes("c", "b", self.data)
+        self.path = tempfile.mktemp()
+
+    def tearDown(self):
+        for path in (self.path, self.path + ".progress"):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def test_download_ranges(self):
+        self.blob.download(self.path, chunk_size=1000, workers=3)
+        with open(self.path, "rb") as stream:
+            assert stream.read() == self.data
+        assert self.service.calls["get_blob"] == 10
+        assert not os.path.exists(self.path + ".progress")
+
+    def test_resumes_from_progress_file(self):
+        # as left by a download interrupted after 3 chunks
+        with open(self.path, "wb") as stream:
+            stream.write(self.data[:3000] + b"\0" * 7000)
+        etag = self.blob.get_properties()["etag"]
+        with open(self.path + ".progress", "w") as stream:
+            json.dump({"etag": etag, "size": 10000, "chunk_size": 1000,
+                       "done": [0, 1, 2]}, stream)
+        self.service.calls.clear()
+        self.blob.download(self.path, chunk_size=1000)
+        assert self.service.calls["get_blob"] == 7
+        with open(self.path, "rb") as stream:
+            assert stream.read() == self.data
+
+    def test_detects_corruption(self):
+        blob = self.service._containers["c"]["blobs"]["b"]
+        blob["data"] = b"y" + blob["data"][1:]
+        self.assertRaises(ChecksumError, self.blob.download, self.path,
+                          chunk_size=1000)
+        self.assertRaises(ChecksumError, list,
+                          self.blob.iter_chunks(chunk_size=1000))
+
+    def test_iter_chunks(self):
+        chunks = list(self.blob.iter_chunks(chunk_size=3000, workers=2))
+        assert [len(chunk) for chunk in chunks] == [3000, 3000, 3000, 1000]
+        assert b"".join(chunks) == self.data
+
+
+class ListingTests(unittest.TestCase):
+
+    def setUp(self):
+        self.az = AzConnection("test", "key", services=fake_services())
+        self.container = self.az.container("c")
+        self.service = self.container.get_service()
+        self.container.create()
+        self.names = sorted("{0}{1:03d}".format(letter, i)
+                            for letter in "abc" for i in range(50))
+        for name in self.names:
+            self.service.put_block_blob_from_bytes("c", name, b"x")
+
+    def test_pages_through_markers(self):
+        blobs = self.container.list_blobs(page_size=40)
+        assert next(blobs).name == "a000"
+        assert self.service.calls["list_blobs"] == 1
+        assert [blob.name for blob in blobs] == self.names[1:]
+        assert self.service.calls["list_blobs"] == 4
+
+    def test_sharded_listing_is_merged_in_order(self):
+        blobs = self.container.list_blobs(shards="cab", page_size=7)
+        assert [blob.name for blob in blobs] == self.names
+        blobs = self.container.list_blobs(prefix="b", shards="0",
+                                          page_size=7)
+        assert [blob.name for blob in blobs] == self.names[50:100]
+
+    def test_stopped_sharded_listing_stops_its_threads(self):
+        threads = threading.active_count()
+        blobs = self.container.list_blobs(shards="cab", page_size=7)
+        assert threading.active_count() == threads
+        assert next(blobs).name == "a000"
+        assert threading.active_count() > threads
+        blobs.close()
+        deadline = time.time() + 2
+        while threading.active_count() > threads and time.time() < deadline:
+            time.sleep(0.01)
+        assert threading.active_count() == threads
+
+    def test_list_containers(self):
+        for i in range(5):
+            self.az.container("d{0}".format(i)).create()
+        assert list(self.container.list_containers(prefix="d",
+                                                   page_size=2)) == \
+            ["d0", "d1", "d2", "d3", "d4"]
+
+    def test_exists(self):
+        assert self.container.exists()
+        assert not self.az.container("missing").exists()
+        assert self.service.calls["list_containers"] == 0
@@ -0,0 +1,85 @@
+import unittest
+from time import time
+
+import test_helper
+
+from azure.storage import AzureBatchOperationError
+
+from azdashboard.lib.azurelib.core.connection import AzConnection
+from azdashboard.lib.azurelib.core.errors import AzureException
+from azdashboard.lib.azurelib.fake import fake_services
+
+
+def rows(partition, count):
+    return [{"PartitionKey": partition, "RowKey": "{0:03d}".format(i)}
+            for i in range(count)]
+
+
+class WriteManyTests(unittest.TestCase):
+
+    def setUp(self):
+        self.services = fake_services()
+        az = AzConnection("test", "key", services=self.services)
+        self.table = az.table("batched")
+        self.table.create()
+        self.calls = self.services["table"].calls
+
+    def count(self):
+        return len(self.table.query(None, ["RowKey"]))
+
+    def test_chunks_of_100_entities(self):
+        assert self.table.insert_many(rows("p", 250)) == [True] * 250
+        assert self.calls["commit_batch"] == 3
+        assert self.count() == 250
+
+    def test_groups_by_partition_key(self):
+        entities = [entity for pair in zip(rows("a", 20), rows("b", 20))
+                    for entity in pair]
+        assert self.table.upsert_many(entities) == [True] * 40
+        assert self.calls["commit_batch"] == 2
+        assert self.count() == 40
+
+    def test_partitions_are_written_concurrently(self):
+        self.services["table"].faults.latency = 0.2
+        entities = [entity for partition in "abcd"
+                    for entity in rows(partition, 5)]
+        started = time()
+        assert self.table.insert_many(entities, workers=4) == [True] * 20
+        assert time() - started < 0.6
+
+    def test_failed_entities_are_left_out_and_retried(self):
+        entities = rows("p", 10)
+        self.table.insert(dict(entities[3]))
+        self.table.insert(dict(entities[7]))
+        results = self.table.insert_many(entities)
+        assert [i for i, result in enumerate(results)
+                if result is not True] == [3, 7]
+        assert results[3].number == 409
+        assert self.calls["commit_batch"] == 3
+        assert self.count() == 10
+
+    def test_delete_many(self):
+        self.table.insert_many(rows("p", 120))
+        assert self.table.delete_many(rows("p", 120)) == [True] * 120
+        assert self.count() == 0
+
+    def test_service_message_format(self):
+        # as azure-storage 0.20.3 builds it from the response's message
+        error = AzureBatchOperationError(
+            "2:The specified entity already exists.\n"
+            "RequestId:6d2b9a26-0002-0040-1a4f-0c3e1b000000\n"
+            "Time:2015-06-01T10:00:00.0000000Z", 409, "EntityAlreadyExists")
+        sent = []
+
+        def send_batch(operation, entities):
+            sent.append([entity["RowKey"] for entity in entities])
+            if len(sent) == 1:
+                raise AzureException(error)
+            return True
+
+        self.table._send_batch = send_batch
+        entities = rows("p", 4)
+        results = self.table.insert_many(entities)
+        assert results[2].exception is error
+        assert [results[i] for i in (0, 1, 3)] == [True] * 3
+        assert sent[1] == ["000", "001", "003"]
@@ -0,0 +1,59 @@
+import unittest
+
+import test_helper
+
+from azdashboard.lib.azurelib.core.connection import AzConnection
+from azdashboard.lib.azurelib.core.errors import AzureException
+from azdashboard.lib.azurelib.core.retry import NoRetry
+from azdashboard.lib.azurelib.fake import fake_services
+
+
+class TableCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        az = AzConnection("test", "key", services=fake_services())
+        self.table = az.table("cached")
+        self.table.create()
+        self.table.set_partition("p")
+        self.table.insert({"RowKey": "r", "value": 1})
+        self.calls = self.table.get_service().calls
+
+    def test_reads_through(self):
+        self.table.cache(ttl=60)
+        assert self.table.get("r")["value"] == 1
+        assert self.table.get("r")["value"] == 1
+        assert self.calls["get_entity"] == 1
+
+    def test_selections_are_cached_apart(self):
+        self.table.cache(ttl=60)
+        assert "value" not in self.table.get("r", selection=["RowKey"])
+        assert self.table.get("r")["value"] == 1
+
+    def test_writes_invalidate(self):
+        self.table.cache(ttl=60)
+        self.table.get("r")
+        self.table.get("r", selection=["value"])
+        self.table.upsert({"RowKey": "r", "value": 2})
+        assert self.table.get("r")["value"] == 2
+        assert self.table.get("r", selection=["value"])["value"] == 2
+        self.table.upsert_many([{"RowKey": "r", "value": 3}])
+        assert self.table.get("r")["value"] == 3
+        self.table.remove("r")
+        self.assertRaises(AzureException, self.table.get, "r",
+                          retry_policy=NoRetry())
+
+    def test_negative_caching(self):
+        self.table.cache(ttl=60, negative_ttl=60)
+        for _ in range(2):
+            self.assertRaises(AzureException, self.table.get, "missing",
+                              retry_policy=NoRetry())
+        assert self.calls["get_entity"] == 1
+        self.table.insert({"RowKey": "missing", "value": 1})
+        assert self.table.get("missing")["value"] == 1
+
+    def test_no_negative_caching_by_default(self):
+        self.table.cache(ttl=60)
+        for _ in range(2):
+            self.assertRaises(AzureException, self.table.get, "missing",
+                              retry_policy=NoRetry())
+        assert self.calls["get_entity"] == 2
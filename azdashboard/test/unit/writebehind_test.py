@@ -0,0 +1,118 @@
+import unittest
+from time import sleep
+
+import test_helper
+
+from azdashboard.lib.azurelib.core.connection import AzConnection
+from azdashboard.lib.azurelib.core.errors import WriteBehindFullError
+from azdashboard.lib.azurelib.core.flusher import flusher
+from azdashboard.lib.azurelib.fake import fake_services
+from azdashboard.lib.azurelib.writebehind import UpsertBuffer
+
+
+class Writer(object):
+
+    def __init__(self, fail=False):
+        self.batches = []
+        self.fail = fail
+
+    def __call__(self, entities):
+        self.batches.append([dict(entity) for entity in entities])
+        if self.fail:
+            return [ValueError("down")] * len(entities)
+        return [True] * len(entities)
+
+
+def row(key, **properties):
+    return dict(properties, PartitionKey="p", RowKey=key)
+
+
+class UpsertBufferTests(unittest.TestCase):
+
+    def test_merges_upserts_of_an_entity(self):
+        writer = Writer()
+        buffer = UpsertBuffer(writer, max_age=None)
+        buffer.add(row("a", x=1, y=1))
+        buffer.add(row("a", x=2))
+        buffer.add(row("b", x=3))
+        assert buffer.flush()
+        assert writer.batches == [[row("a", x=2, y=1), row("b", x=3)]]
+        buffer.close()
+
+    def test_flushes_when_full(self):
+        writer = Writer()
+        buffer = UpsertBuffer(writer, max_entities=2, max_age=None)
+        buffer.add(row("a"))
+        buffer.add(row("a"))
+        assert writer.batches == []
+        buffer.add(row("b"))
+        assert len(writer.batches) == 1
+        buffer.close()
+
+    def test_failed_entities_are_kept_under_newer_upserts(self):
+        writer = Writer(fail=True)
+        buffer = UpsertBuffer(writer, max_age=None)
+        buffer.add(row("a", x=1, y=1))
+        assert not buffer.flush()
+        buffer.add(row("a", x=2))
+        writer.fail = False
+        assert buffer.flush()
+        assert writer.batches[-1] == [row("a", x=2, y=1)]
+        buffer.close()
+
+    def test_max_pending_bounds_unwritten_entities(self):
+        writer = Writer(fail=True)
+        buffer = UpsertBuffer(writer, max_pending=2, max_age=None)
+        buffer.add(row("a"))
+        buffer.add(row("b"))
+        self.assertRaises(ValueError, buffer.add, row("c"))
+        buffer.add(row("a", x=1))
+        assert len(buffer) == 2
+        writer.fail = False
+        buffer.close()
+
+    def test_full_buffer_without_write_error(self):
+        buffer = UpsertBuffer(Writer(), max_pending=0, max_age=None)
+        self.assertRaises(WriteBehindFullError, buffer.add, row("a"))
+        buffer.close()
+
+    def test_background_write_errors_are_kept(self):
+        writer = Writer(fail=True)
+        errors = flusher.errors
+        buffer = UpsertBuffer(writer, max_age=0.05)
+        buffer.add(row("a"))
+        sleep(0.2)
+        assert flusher.errors > errors
+        assert isinstance(buffer.error, ValueError)
+        assert flusher.watching(buffer)
+        writer.fail = False
+        buffer.close()
+        assert not flusher.watching(buffer)
+
+
+class TableWriteBehindTests(unittest.TestCase):
+
+    def test_coalesces_into_batches(self):
+        az = AzConnection("test", "key", services=fake_services())
+        table = az.table("heartbeats")
+        table.create()
+        table.set_partition("p")
+        with table:
+            for i in range(1000):
+                table.upsert_buffered({"RowKey": str(i % 10), "beat": i})
+        calls = table.get_service().calls
+        assert calls["commit_batch"] == 1
+        assert table.get("9")["beat"] == 999
+
+    def test_flushes_on_a_guarded_connection(self):
+        az = AzConnection("test", "key", services=fake_services(),
+                          breaker={}, max_concurrent=4)
+        table = az.table("guardedbeats")
+        table.create()
+        table.set_partition("p")
+        for i in range(300):
+            table.upsert_buffered({"RowKey": str(i), "beat": i})
+        assert table.flush()
+        assert table.write_behind().stats()["failures"] == 0
+        assert len(table.query(None, ["RowKey"])) == 300
+        table.close()
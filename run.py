@@ -42,12 +42,18 @@ def main():
         debug=environment.debug
     )
 
+    options = {}
+    if a.server_type in ('cherrypy', 'cheroot'):
+        # live streams hold a thread each
+        options['numthreads'] = environment.server_threads
+
     bottle.run(
         a.app,
         server=a.server_type,
         reloader=a.reloader,
         host=a.host,
-        port=a.port
+        port=a.port,
+        **options
     )
 
 if __name__ == "__main__":
@@ -12,6 +12,7 @@ config_dir = app_dir + '/config'
 test_dir = app_dir + '/test'
 func_test_dir = test_dir + '/functional'
 unit_test_dir = test_dir + '/unit'
+bench_dir = test_dir + '/bench'
 
 
 @task
@@ -43,6 +44,17 @@ def test(ctx, environment='test', nosetests='nosetests'):
     pass
 
 
+@task
+def bench(ctx, save=False, tolerance=0.25, only=''):
+    cmd = 'python ' + bench_dir + '/azurelib_bench.py --tolerance ' + \
+        str(tolerance)
+    if save:
+        cmd += ' --save'
+    if only:
+        cmd += ' --only ' + only
+    run_cmd(ctx, cmd)
+
+
 @task(set_settings)
 def setup(ctx, ):
     src = 'alembic.ini.sample'